@@ -0,0 +1,52 @@
+"""Сравнение кодеков событий заказов (json, msgpack, schema): время кодирования и декодирования с проверкой
+моделью одного события и размер события в Kafka (значение и заголовки) для создания заказа и изменения статуса.
+Брокер не нужен:
+
+    PYTHONPATH=src python benchmarks/codec_benchmark.py --events 100000
+"""
+import argparse
+import time
+from schemas.order_event_schema import OrderCreatedEvent, OrderStatusChangedEvent
+from schemas.order_schema import OrderCreate
+from services.kafka.codecs import decode_event, event_codecs
+
+EVENTS = {
+    'create': OrderCreatedEvent(
+        order_data=OrderCreate(title="Order 1", description="Test order", price=10.0).model_dump(),
+        user_id=1,
+        idempotency_key="6f1c2d9a-4b7e-4f3a-9c1d-2e8b5a7f0c3d",
+    ),
+    'update': OrderStatusChangedEvent(
+        user_id=1, order_data={"id": 123456, "status": "in_progress"}, previous_status="pending"
+    ),
+}
+
+
+def measure(function, events: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    started = time.perf_counter()
+    for _ in range(events):
+        function()
+    return (time.perf_counter() - started) / events * 1e6
+
+
+def main(events: int):
+    print(f"{'event':<8} {'codec':<8} {'encode us':>10} {'decode us':>10} {'value B':>8} {'headers B':>10}")
+    for event_name, event in EVENTS.items():
+        for codec in event_codecs.values():
+            value, headers = codec.encode(event)
+            decoded_headers = {key: header.decode() for key, header in headers}
+            encode_us = measure(lambda: codec.encode(event), events)
+            decode_us = measure(lambda: decode_event(value, decoded_headers), events)
+            headers_size = sum(len(key) + len(header) for key, header in headers)
+            print(
+                f"{event_name:<8} {codec.name:<8} {encode_us:>10.2f} {decode_us:>10.2f} "
+                f"{len(value):>8} {headers_size:>10}"
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000)
+    args = parser.parse_args()
+    main(args.events)
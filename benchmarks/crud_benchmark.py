@@ -0,0 +1,70 @@
+"""Сравнение записи заказов через session.add + commit + refresh (прежний create_order)
+и через INSERT ... RETURNING (OrderCrud.create_order): выводится число записей в секунду.
+
+Нужна работающая БД с примененными миграциями, созданные строки удаляются после замера:
+
+    PYTHONPATH=src python benchmarks/crud_benchmark.py --orders 2000 --concurrency 10
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import delete, insert
+from config.db import engine, new_session
+from crud.order_crud import OrderCrud
+from models.notifications import Notification  # noqa: F401
+from models.orders import Order, OrderStatus
+from models.users import User
+
+BENCHMARK_USERNAME = 'crud_benchmark'
+
+
+async def create_order_with_refresh(order_data: dict, current_user: User, session):
+    """Прежняя реализация create_order: INSERT, коммит и отдельный SELECT для обновления объекта"""
+    new_order = Order(user_id=current_user.id, **order_data)
+    session.add(new_order)
+    await session.commit()
+    await session.refresh(new_order)
+    return new_order
+
+
+async def run(create_order, current_user: User, orders: int, concurrency: int) -> float:
+    numbers = iter(range(orders))
+
+    async def worker():
+        async with new_session() as session:
+            for number in numbers:
+                order_data = {"title": f"Benchmark {number}", "status": OrderStatus.pending, "price": 10.0}
+                await create_order(order_data, current_user, session)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def main(orders: int, concurrency: int):
+    async with new_session() as session:
+        current_user = await session.scalar(
+            insert(User)
+            .values(username=BENCHMARK_USERNAME, email=f'{BENCHMARK_USERNAME}@example.com', hashed_password='-')
+            .returning(User)
+        )
+        await session.commit()
+    try:
+        print(f"{'mode':<12} {'writes/sec':>12}")
+        for mode, create_order in (('refresh', create_order_with_refresh), ('returning', OrderCrud.create_order)):
+            elapsed = await run(create_order, current_user, orders, concurrency)
+            print(f"{mode:<12} {orders / elapsed:>12.0f}")
+    finally:
+        async with new_session() as session:
+            await session.execute(delete(Order).where(Order.user_id == current_user.id))
+            await session.execute(delete(User).where(User.id == current_user.id))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.orders, args.concurrency))
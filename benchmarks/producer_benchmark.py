@@ -0,0 +1,107 @@
+"""Сравнение режимов отправки событий заказов в Kafka.
+
+per_request - продюсер создается на каждое событие (прежний produce_orders),
+reliable    - общий продюсер, send_and_wait на каждое событие,
+outbox      - общий продюсер, пакеты событий через send_batch с пакетированием и сжатием (как передача из outbox).
+
+Для каждого режима выводится пропускная способность (events/sec) и задержка вызова
+(p50/p99, в режиме outbox - задержка пакета). Все режимы ждут подтверждения брокера. Нужен работающий брокер:
+
+    PYTHONPATH=src KAFKA_BOOTSTRAP_SERVERS=localhost:9092 python benchmarks/producer_benchmark.py --events 5000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from aiokafka import AIOKafkaProducer
+from config.settings import KafkaProducerSettings
+from services.kafka.producers import OrderProducer
+from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS
+
+BENCHMARK_TOPIC = 'order_topic_benchmark'
+
+
+def make_event(number: int) -> str:
+    return json.dumps({
+        "type": "create",
+        "order_data": {"title": f"Order {number}", "description": None, "status": "pending", "price": 10.0},
+        "user_id": 1,
+    })
+
+
+async def produce_per_request(data_json: str):
+    """Прежняя реализация produce_orders: подключение к брокеру на каждое событие"""
+    producer = AIOKafkaProducer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
+    await producer.start()
+    try:
+        await producer.send_and_wait(topic=BENCHMARK_TOPIC, value=data_json.encode('utf-8'))
+    finally:
+        await producer.stop()
+
+
+async def run(send, events: int, concurrency: int):
+    latencies = []
+    queue = iter(range(events))
+
+    async def worker():
+        for number in queue:
+            started = time.perf_counter()
+            await send(make_event(number))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies
+
+
+def report(mode: str, elapsed: float, latencies: list):
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p99 = latencies_ms[int(len(latencies_ms) * 0.99) - 1]
+    print(f"{mode:<12} {len(latencies) / elapsed:>12.0f} {statistics.median(latencies_ms):>10.2f} {p99:>10.2f}")
+
+
+async def main(events: int, concurrency: int, batch_size: int, linger_ms: int, compression_type: str):
+    print(f"{'mode':<12} {'events/sec':>12} {'p50, ms':>10} {'p99, ms':>10}")
+
+    per_request_events = min(events, 200)
+    elapsed, latencies = await run(produce_per_request, per_request_events, concurrency)
+    report('per_request', elapsed, latencies)
+
+    producer = OrderProducer(topic=BENCHMARK_TOPIC, settings=KafkaProducerSettings())
+    await producer.start()
+    if not producer.is_connected:
+        raise SystemExit(f"Kafka broker {KAFKA_BOOTSTRAP_SERVERS} is unavailable")
+    elapsed, latencies = await run(producer.send, events, concurrency)
+    await producer.stop()
+    report('reliable', elapsed, latencies)
+
+    producer = OrderProducer(
+        topic=BENCHMARK_TOPIC, settings=KafkaProducerSettings(linger_ms=linger_ms, compression_type=compression_type)
+    )
+    await producer.start()
+    latencies = []
+    started = time.perf_counter()
+    for first in range(0, events, batch_size):
+        batch_started = time.perf_counter()
+        await producer.send_batch([
+            (BENCHMARK_TOPIC, make_event(number).encode('utf-8'), [])
+            for number in range(first, min(first + batch_size, events))
+        ])
+        latencies.append(time.perf_counter() - batch_started)
+    elapsed = time.perf_counter() - started
+    await producer.stop()
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p99 = latencies_ms[max(int(len(latencies_ms) * 0.99) - 1, 0)]
+    print(f"{'outbox':<12} {events / elapsed:>12.0f} {statistics.median(latencies_ms):>10.2f} {p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50, help='число одновременных "запросов"')
+    parser.add_argument('--batch-size', type=int, default=100, help='размер пакета outbox (OUTBOX_BATCH_SIZE)')
+    parser.add_argument('--linger-ms', type=int, default=10)
+    parser.add_argument('--compression', choices=['gzip', 'lz4', 'zstd'], default='gzip')
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.concurrency, args.batch_size, args.linger_ms, args.compression))
@@ -0,0 +1,83 @@
+"""Сравнение отправки писем через aiosmtplib.send (новое соединение на каждое письмо)
+и через пул постоянных SMTP-соединений на локальном aiosmtpd-сервере.
+
+    PYTHONPATH=src python benchmarks/smtp_pool_benchmark.py --messages 500
+"""
+import argparse
+import asyncio
+import socket
+import time
+from email.message import EmailMessage
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from config.settings import SMTPSettings
+from services.smtp_pool import SMTPConnectionPool
+
+
+class CountingHandler:
+    def __init__(self):
+        self.messages = 0
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.connections += 1
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return '250 Message accepted for delivery'
+
+
+def make_message(number: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "tracker@example.com"
+    msg["To"] = "user@example.com"
+    msg["Subject"] = f"Создан новый заказ {number}"
+    msg.set_content(f"Создан новый заказ. Идентификационный номер: ID={number}")
+    return msg
+
+
+async def run(send, messages: int, concurrency: int) -> float:
+    numbers = iter(range(messages))
+
+    async def worker():
+        for number in numbers:
+            await send(make_message(number))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def main(messages: int, concurrency: int, pool_size: int):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    handler = CountingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        print(f"{'mode':<10} {'messages/sec':>14} {'connections':>12}")
+
+        elapsed = await run(
+            lambda msg: aiosmtplib.send(msg, hostname='127.0.0.1', port=port), messages, concurrency
+        )
+        print(f"{'send':<10} {messages / elapsed:>14.0f} {handler.connections:>12}")
+
+        handler.connections = 0
+        pool = SMTPConnectionPool(SMTPSettings(smtp_server='127.0.0.1', smtp_port=port, smtp_pool_size=pool_size))
+        elapsed = await run(pool.send_message, messages, concurrency)
+        await pool.close()
+        print(f"{'pool':<10} {messages / elapsed:>14.0f} {handler.connections:>12}")
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.concurrency, args.pool_size))
@@ -1,16 +1,123 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 from passlib.context import CryptContext
+from prometheus_client import Counter, Gauge, Histogram
+from config.settings import AppSettings, AuthSettings, PasswordHashSettings
+from exceptions import PasswordHashingBusyException
 
+PASSWORD_HASH_SCHEMES = ['argon2', 'bcrypt', 'scrypt']
+# Параметры стоимости алгоритмов: чем больше значение, тем стойче хэш
+PASSWORD_COST_PARAMS = {
+    'argon2': ('rounds', 'memory_cost'),
+    'bcrypt': ('rounds',),
+    'scrypt': ('rounds', 'block_size'),
+}
 
-password_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+class PasswordContext(CryptContext):
+    """Контекст passlib, в котором хэш алгоритма по умолчанию устаревает, только если он слабее политики:
+    более стойкие хэши не пересчитываются в более слабые"""
+
+    def needs_update(self, hash, scheme=None, category=None, secret=None):
+        handler = self.handler(category=category)
+        if self.identify(hash, category=category) != handler.name:
+            return super().needs_update(hash, scheme=scheme, category=category, secret=secret)
+        parsed = handler.from_string(hash)
+        costs = {}
+        for param in PASSWORD_COST_PARAMS[handler.name]:
+            policy = handler.default_rounds if param == 'rounds' else getattr(handler, param)
+            costs[param] = max(getattr(parsed, param), policy)
+        # Стоимость политики поднимается до стоимости хэша, остальные параметры проверяет passlib
+        return handler.using(**costs).needs_update(hash, secret=secret)
+
+
+def build_password_context(settings: Optional[PasswordHashSettings] = None) -> PasswordContext:
+    """Контекст passlib по политике хэширования: новые хэши создаются алгоритмом settings.scheme,
+    хэши остальных алгоритмов проверяются, но считаются устаревшими.
+    Хэши алгоритма settings.scheme устаревают, если хотя бы один параметр стоимости меньше политики
+    или отличаются остальные параметры (тип argon2, параллелизм)"""
+    settings = settings or AppSettings().password_hash
+    return PasswordContext(
+        schemes=PASSWORD_HASH_SCHEMES,
+        default=settings.scheme,
+        deprecated='auto',
+        bcrypt__rounds=settings.bcrypt_rounds,
+        argon2__type='ID',
+        argon2__rounds=settings.argon2_time_cost,
+        argon2__memory_cost=settings.argon2_memory_cost,
+        argon2__parallelism=settings.argon2_parallelism,
+        scrypt__rounds=settings.scrypt_rounds,
+        scrypt__block_size=settings.scrypt_block_size,
+        scrypt__parallelism=settings.scrypt_parallelism,
+    )
+
+
+password_context = build_password_context()
+
+password_hash_queue_wait = Histogram(
+    'password_hash_queue_wait_seconds', 'Time a password hash/verify call waits for a free hashing thread'
+)
+password_hash_pending = Gauge('password_hash_pending', 'Password hash/verify calls running or waiting for a thread')
+password_hash_rejected = Counter('password_hash_rejected_total', 'Password hash/verify calls rejected: queue is full')
+
+
+class PasswordHashExecutor:
+    """Выполнение хэширования паролей в отдельном пуле потоков, чтобы не блокировать цикл событий.
+    bcrypt отпускает GIL, поэтому потоки выполняют хэширование параллельно.
+    Если потоки заняты и очередь заполнена, вызов сразу отклоняется с 503"""
+
+    def __init__(self, settings: Optional[AuthSettings] = None):
+        settings = settings or AppSettings().auth
+        self.workers = settings.password_hash_workers
+        self.queue_size = settings.password_hash_queue_size
+        self._executor = None
+        self._pending = 0
+
+    async def run(self, func: Callable, *args):
+        if self._pending >= self.workers + self.queue_size:
+            password_hash_rejected.inc()
+            raise PasswordHashingBusyException()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        submitted = time.perf_counter()
+
+        def timed():
+            password_hash_queue_wait.observe(time.perf_counter() - submitted)
+            return func(*args)
+
+        self._pending += 1
+        password_hash_pending.set(self._pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+            password_hash_pending.set(self._pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hash_executor = PasswordHashExecutor()
 
 
 class HashPassword:
     @staticmethod
-    def bcrypt(password: str):
-        """Хэширование пароля"""
-        return password_context.hash(password)
+    async def hash(password: str):
+        """Хэширование пароля алгоритмом из политики хэширования"""
+        return await password_hash_executor.run(password_context.hash, password)
 
     @staticmethod
-    def verify(hashed_password: str, plain_password: str):
+    async def verify(hashed_password: str, plain_password: str):
         """Проверка валидности пароля"""
-        return password_context.verify(plain_password, hashed_password)
\ No newline at end of file
+        return await password_hash_executor.run(password_context.verify, plain_password, hashed_password)
+
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        """Проверка, создан ли хэш устаревшим алгоритмом или со стоимостью меньше политики"""
+        if password_context.identify(hashed_password, required=False) is None:
+            return False
+        return password_context.needs_update(hashed_password)
@@ -1,4 +1,8 @@
+import asyncio
+import hashlib
+import hmac
 import os
+import secrets
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional
@@ -6,11 +10,16 @@ from datetime import datetime, timedelta, timezone
 from jose import jwt
 from jose.exceptions import JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
-from config.db import get_session
+from config.db import get_session, new_session
 from config.logger import logger
+from config.settings import AppSettings
+from auth.token_revocations import token_revocations
+from auth.user_cache import user_cache
 from crud.user_crud import UserCrud
 from dotenv import load_dotenv
 from exceptions import CredentialException, UserNotFoundException
+from models.users import User
+from schemas.user_schema import TokenUser
 
 load_dotenv()
 
@@ -18,7 +27,21 @@ oauth2_schema = OAuth2PasswordBearer(tokenUrl='/v1/api/users/token')
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = AppSettings().auth.access_token_expire_minutes
+REFRESH_TOKEN_EXPIRE_DAYS = AppSettings().auth.refresh_token_expire_days
+# Версия набора claims в токене: токены другой версии проверяются только через БД
+TOKEN_CLAIMS_VERSION = 1
+
+
+def token_claims(user: User) -> dict:
+    """Подписанные claims токена: id, признак суперпользователя и версия токенов пользователя"""
+    return {
+        "username": user.username,
+        "uid": user.id,
+        "su": bool(user.is_superuser),
+        "tv": user.token_version or 0,
+        "cv": TOKEN_CLAIMS_VERSION,
+    }
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -34,18 +57,48 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_schema), session: AsyncSession = Depends(get_session)):
-    """Получение пользователя по токену авторизации"""
+def hash_refresh_token(token: str) -> str:
+    """HMAC токена обновления: в БД хранится только он, проверка не требует bcrypt"""
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def create_refresh_token():
+    """Новый токен обновления: токен для клиента, его HMAC для хранения и срок действия"""
+    token = secrets.token_urlsafe(32)
+    return token, hash_refresh_token(token), datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+def decode_access_token(token: str) -> dict:
+    """Проверка подписи и срока действия токена"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        decode_username: str = payload.get('username')
-        if decode_username is None:
-            raise CredentialException()
     except JWTError:
         raise CredentialException()
-    user = await UserCrud.get_user(session, username=decode_username)
-    if user is None:
+    if payload.get('username') is None:
+        raise CredentialException()
+    if payload.get('cv') == TOKEN_CLAIMS_VERSION and token_revocations.is_revoked(payload['uid'], payload['tv']):
+        raise CredentialException()
+    return payload
+
+
+def check_token_version(payload: dict, user: User):
+    """Отклонение токена, выпущенного до смены пароля или username пользователя"""
+    if payload.get('cv') == TOKEN_CLAIMS_VERSION and payload['tv'] < (user.token_version or 0):
         raise CredentialException()
+
+
+async def get_current_user(token: str = Depends(oauth2_schema), session: AsyncSession = Depends(get_session)):
+    """Получение пользователя по токену авторизации"""
+    payload = decode_access_token(token)
+    decode_username: str = payload['username']
+    user = user_cache.get(decode_username)
+    if user is None:
+        generation = user_cache.generation
+        user = await UserCrud.get_user(session, username=decode_username)
+        if user is None:
+            raise CredentialException()
+        user_cache.set(user, generation)
+    check_token_version(payload, user)
     return user
 
 
@@ -56,3 +109,23 @@ async def get_user_by_token(access_token: str, session: AsyncSession):
         logger.error("Not found: User with token: %s not exist", access_token)
         raise UserNotFoundException()
     return current_user
+
+
+async def get_user_by_claims(access_token: str, session: AsyncSession):
+    """Получение пользователя для эндпоинтов только на чтение из claims токена, без запроса к БД.
+    Токены без claims текущей версии, а также все токены, пока таблица отзыва неактуальна, проверяются через БД"""
+    payload = decode_access_token(access_token)
+    if payload.get('cv') != TOKEN_CLAIMS_VERSION or not token_revocations.is_fresh:
+        return await get_user_by_token(access_token, session)
+    return TokenUser(id=payload['uid'], username=payload['username'], is_superuser=payload['su'])
+
+
+async def refresh_token_revocations():
+    """Периодическая загрузка таблицы отзыва токенов из БД"""
+    while True:
+        try:
+            async with new_session() as session:
+                token_revocations.load(*await UserCrud.get_token_revocations(session))
+        except Exception as e:
+            logger.error(f"Token revocation table refresh failed: {e}")
+        await asyncio.sleep(token_revocations.refresh_interval)
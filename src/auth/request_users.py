@@ -0,0 +1,36 @@
+from typing import Annotated, Optional
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth.oauth2 import check_token_version, decode_access_token, get_user_by_token, oauth2_schema
+from config.db import get_session
+from crud.user_crud import UserCrud
+from models.users import User
+
+
+class RequestUsers:
+    """Пользователи, загруженные в рамках одного запроса: каждый пользователь запрашивается из БД не больше одного раза,
+    загруженные объекты передаются в CRUD"""
+
+    def __init__(
+        self,
+        access_token: Annotated[str, Depends(oauth2_schema)],
+        session: AsyncSession = Depends(get_session)
+    ):
+        self.access_token = access_token
+        self.session = session
+        self._users = {}
+
+    async def get(self, user_id: int) -> Optional[User]:
+        """Пользователь по id, None если он не найден"""
+        if user_id not in self._users:
+            self._users[user_id] = await UserCrud.get_user(self.session, user_id=user_id)
+        return self._users[user_id]
+
+    async def current(self) -> User:
+        """Пользователь по токену авторизации: если он уже загружен в этом запросе, повторного запроса нет"""
+        payload = decode_access_token(self.access_token)
+        user = self._users.get(payload.get('uid'))
+        if user is None or user.username != payload['username']:
+            return await get_user_by_token(self.access_token, self.session)
+        check_token_version(payload, user)
+        return user
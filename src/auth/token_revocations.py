@@ -0,0 +1,52 @@
+import time
+from typing import Dict, Iterable, Optional
+from prometheus_client import Gauge
+from config.settings import AppSettings, AuthSettings
+
+token_revocation_entries = Gauge('token_revocation_entries', 'Users with revoked access tokens in the in-memory table')
+token_revocation_refreshed = Gauge('token_revocation_refreshed_timestamp_seconds', 'Last reload of the token revocation table')
+
+
+class TokenRevocations:
+    """Таблица отзыва токенов в памяти процесса: минимальная действующая версия токенов пользователя
+    и удаленные пользователи. Хранятся только пользователи, чьи токены отзывались, таблица целиком
+    перечитывается из БД раз в refresh_interval секунд, а не на каждый запрос.
+    Пока таблица не загружена или давно не обновлялась, она считается неактуальной"""
+
+    def __init__(self, settings: Optional[AuthSettings] = None):
+        settings = settings or AppSettings().auth
+        self.refresh_interval = settings.token_revocation_refresh_interval
+        self._versions: Dict[int, int] = {}
+        self._deleted = set()
+        self._refreshed_at = None
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._refreshed_at is not None and time.monotonic() - self._refreshed_at <= 2 * self.refresh_interval
+
+    def is_revoked(self, user_id: int, token_version: int) -> bool:
+        return user_id in self._deleted or token_version < self._versions.get(user_id, 0)
+
+    def load(self, versions: Dict[int, int], deleted: Iterable[int]):
+        """Замена таблицы данными из БД"""
+        self._versions = {user_id: version for user_id, version in versions.items() if version > 0}
+        self._deleted = set(deleted)
+        self._refreshed_at = time.monotonic()
+        token_revocation_entries.set(len(self._versions) + len(self._deleted))
+        token_revocation_refreshed.set_to_current_time()
+
+    def revoke(self, user_id: int, token_version: Optional[int] = None):
+        """Отзыв токенов в текущем процессе сразу после изменения пользователя, не дожидаясь обновления таблицы:
+        с версией - токены более ранних версий, без версии - все токены удаленного пользователя"""
+        if token_version is None:
+            self._deleted.add(user_id)
+        else:
+            self._versions[user_id] = max(token_version, self._versions.get(user_id, 0))
+        token_revocation_entries.set(len(self._versions) + len(self._deleted))
+
+    def clear(self):
+        self._versions, self._deleted, self._refreshed_at = {}, set(), None
+        token_revocation_entries.set(0)
+
+
+token_revocations = TokenRevocations()
@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+from prometheus_client import Counter, Gauge
+from config.settings import AppSettings, AuthSettings
+from models.users import User
+
+user_cache_hits = Counter('user_cache_hits_total', 'Authenticated requests served from the user cache')
+user_cache_misses = Counter('user_cache_misses_total', 'Authenticated requests that loaded the user from the DB')
+user_cache_size = Gauge('user_cache_size', 'Users in the authentication cache')
+
+
+class UserCache:
+    """Кэш пользователей авторизации по username с ограничением размера (LRU) и временем жизни записи.
+    Кэш локален для процесса: изменения пользователя через UserCrud удаляют запись сразу,
+    в остальных процессах запись устаревает не позже чем через ttl"""
+
+    def __init__(self, settings: Optional[AuthSettings] = None):
+        settings = settings or AppSettings().auth
+        self.max_size = settings.user_cache_size
+        self.ttl = settings.user_cache_ttl
+        self._users = OrderedDict()
+        self.generation = 0
+
+    def get(self, username: str) -> Optional[User]:
+        """Получение пользователя из кэша, None - если записи нет или она устарела"""
+        entry = self._users.get(username)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._users[username]
+                user_cache_size.set(len(self._users))
+            user_cache_misses.inc()
+            return None
+        self._users.move_to_end(username)
+        user_cache_hits.inc()
+        return entry[1]
+
+    def set(self, user: User, generation: Optional[int] = None):
+        """Сохранение копии пользователя, не привязанной к сессии БД.
+        generation - значение self.generation до чтения пользователя из БД: если с тех пор кэш инвалидировался,
+        прочитанные данные могли устареть и не сохраняются"""
+        if self.ttl <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._users[user.username] = (time.monotonic() + self.ttl, detached_copy(user))
+        self._users.move_to_end(user.username)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+        user_cache_size.set(len(self._users))
+
+    def invalidate(self, *usernames: str):
+        self.generation += 1
+        for username in usernames:
+            self._users.pop(username, None)
+        user_cache_size.set(len(self._users))
+
+    def clear(self):
+        self.generation += 1
+        self._users.clear()
+        user_cache_size.set(0)
+
+
+def detached_copy(user: User) -> User:
+    """Копия пользователя только с колонками таблицы: объект из кэша используется разными запросами
+    и не должен ссылаться на сессию, в которой был загружен"""
+    return User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+
+
+user_cache = UserCache()
@@ -1,11 +1,26 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
+from config.db_pool import InstrumentedAsyncPool
+from config.db_routing import ReplicaSet, RoutingSession
 from config.settings import AppSettings
 
+db_settings = AppSettings().db
 
-engine = create_async_engine(AppSettings().db.url)
+engine = create_async_engine(db_settings.url, poolclass=InstrumentedAsyncPool, **db_settings.engine_options)
 
-new_session = async_sessionmaker(engine, expire_on_commit=False)
+replicas = ReplicaSet(
+    [
+        create_async_engine(
+            url, poolclass=InstrumentedAsyncPool, pool_logging_name=f'replica-{number}', **db_settings.engine_options
+        )
+        for number, url in enumerate(db_settings.replica_urls)
+    ],
+    max_lag=db_settings.replica_max_lag,
+)
+
+new_session = async_sessionmaker(
+    engine, expire_on_commit=False, sync_session_class=RoutingSession, replicas=replicas
+)
 
 Base = declarative_base()
 
@@ -0,0 +1,41 @@
+import time
+from prometheus_client import Gauge, Histogram
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+db_pool_size = Gauge('db_pool_size', 'Configured number of persistent DB connections', ['pool'])
+db_pool_checked_out = Gauge('db_pool_checked_out', 'DB connections currently checked out of the pool', ['pool'])
+db_pool_overflow = Gauge('db_pool_overflow', 'DB connections open above pool_size', ['pool'])
+db_pool_checkout_wait = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a DB connection from the pool', ['pool'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Пул соединений SQLAlchemy с метриками Prometheus: время ожидания соединения, выданные и сверхлимитные соединения.
+    Метки метрик - pool_logging_name движка (primary по умолчанию)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool = self._orig_logging_name or 'primary'
+        self._size_metric = db_pool_size.labels(pool=pool)
+        self._checked_out_metric = db_pool_checked_out.labels(pool=pool)
+        self._overflow_metric = db_pool_overflow.labels(pool=pool)
+        self._checkout_wait_metric = db_pool_checkout_wait.labels(pool=pool)
+        self._size_metric.set(self.size())
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self._checkout_wait_metric.observe(time.perf_counter() - started)
+            self._update_gauges()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        self._checked_out_metric.set(self.checkedout())
+        self._overflow_metric.set(max(self.overflow(), 0))
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+from typing import List, Optional
+from prometheus_client import Gauge
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from config.logger import logger
+
+db_replica_available = Gauge('db_replica_available', 'Read replica is reachable and not lagging (1)', ['replica'])
+
+# Отставание реплики в секундах, 0 - если реплика применила все полученные изменения
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaSet:
+    """Реплики для чтения: запросы распределяются по кругу между доступными репликами.
+    Реплика считается доступной после успешной проверки отставания, недоступные и отстающие пропускаются"""
+
+    def __init__(self, engines: List[AsyncEngine], max_lag: float):
+        self.engines = engines
+        self.max_lag = max_lag
+        self._available: List[AsyncEngine] = []
+        self._counter = itertools.count()
+
+    def pick(self) -> Optional[AsyncEngine]:
+        available = self._available
+        if not available:
+            return None
+        return available[next(self._counter) % len(available)]
+
+    async def check(self):
+        """Проверка подключения и отставания каждой реплики"""
+        available = []
+        for number, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as connection:
+                    lag = await connection.scalar(REPLICA_LAG_QUERY)
+                if lag <= self.max_lag:
+                    available.append(engine)
+                else:
+                    logger.warning("DB replica %s is lagging by %.1f s, reading from primary", number, lag)
+            except Exception as e:
+                logger.warning(f"DB replica {number} is unavailable, reading from primary: {e}")
+            db_replica_available.labels(replica=str(number)).set(engine in available)
+        self._available = available
+
+    async def monitor(self, interval: float):
+        """Периодическая проверка реплик"""
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+
+class RoutingSession(Session):
+    """Сессия с чтением с реплик: SELECT с execution_options(replica=True) выполняется на доступной реплике,
+    остальные запросы - на основной БД. После первой записи в сессии все запросы идут на основную БД,
+    чтобы запрос видел собственные изменения (read-your-writes)"""
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or (clause is not None and clause.is_dml):
+            use_primary(self)
+        if (
+            self.replicas is not None
+            and not self.info.get('primary')
+            and clause is not None
+            and clause.is_select
+            and clause.get_execution_options().get('replica')
+        ):
+            engine = self.replicas.pick()
+            if engine is not None:
+                return engine.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+def use_primary(session):
+    """Направление всех дальнейших запросов сессии на основную БД"""
+    session.info['primary'] = True
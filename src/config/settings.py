@@ -1,4 +1,5 @@
 import os
+from typing import Literal, Optional
 
 from dotenv import load_dotenv
 from pydantic import Field
@@ -7,21 +8,196 @@ from pydantic_settings import BaseSettings
 load_dotenv()
 
 class DatabaseSettings(BaseSettings):
+    """Подключение к PostgreSQL и пул соединений: pool_size - постоянные соединения, max_overflow - дополнительные
+    при пиковой нагрузке, pool_timeout - сколько секунд запрос ждет свободное соединение, pool_recycle - через сколько
+    секунд соединение пересоздается, pool_pre_ping - проверка соединения перед выдачей из пула;
+    statement_timeout_ms - ограничение времени выполнения запроса на сервере (0 - без ограничения),
+    prepared_statement_cache_size - размер кэша подготовленных запросов asyncpg на соединение;
+    replica_hosts - реплики для чтения через запятую (host или host:port), replica_max_lag - отставание реплики
+    в секундах, после которого чтение идет с основной БД, replica_check_interval - период проверки реплик"""
     user: str = Field(default_factory=lambda: os.getenv("POSTGRES_USER", "postgres"))
     password: str = Field(default_factory=lambda: os.getenv("POSTGRES_PASSWORD", "postgres"))
     database: str = Field(default_factory=lambda: os.getenv("POSTGRES_DATABASE", "postgres"))
     host: str = Field(default_factory=lambda: os.getenv("POSTGRES_HOST", "localhost"))
     port: int = Field(default_factory=lambda: os.getenv("POSTGRES_PORT", 5432))
+    pool_size: int = Field(default_factory=lambda: os.getenv("DB_POOL_SIZE", 10), gt=0)
+    max_overflow: int = Field(default_factory=lambda: os.getenv("DB_MAX_OVERFLOW", 10), ge=0)
+    pool_timeout: float = Field(default_factory=lambda: os.getenv("DB_POOL_TIMEOUT", 30), gt=0)
+    pool_recycle: int = Field(default_factory=lambda: os.getenv("DB_POOL_RECYCLE", 1800))
+    pool_pre_ping: bool = Field(default_factory=lambda: os.getenv("DB_POOL_PRE_PING", True))
+    statement_timeout_ms: int = Field(default_factory=lambda: os.getenv("DB_STATEMENT_TIMEOUT_MS", 0), ge=0)
+    prepared_statement_cache_size: int = Field(
+        default_factory=lambda: os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 100), ge=0
+    )
+    replica_hosts: str = Field(default_factory=lambda: os.getenv("POSTGRES_REPLICA_HOSTS", ""))
+    replica_max_lag: float = Field(default_factory=lambda: os.getenv("DB_REPLICA_MAX_LAG", 5), ge=0)
+    replica_check_interval: float = Field(default_factory=lambda: os.getenv("DB_REPLICA_CHECK_INTERVAL", 5), gt=0)
 
     @property
     def url(self):
         return f'postgresql+asyncpg://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}'
 
+    @property
+    def replica_urls(self):
+        urls = []
+        for replica in filter(None, (host.strip() for host in self.replica_hosts.split(','))):
+            host, _, port = replica.partition(':')
+            urls.append(
+                f'postgresql+asyncpg://{self.user}:{self.password}@{host}:{port or self.port}/{self.database}'
+            )
+        return urls
+
+    @property
+    def engine_options(self) -> dict:
+        """Параметры create_async_engine для пула соединений и драйвера asyncpg"""
+        connect_args = {"prepared_statement_cache_size": self.prepared_statement_cache_size}
+        if self.statement_timeout_ms:
+            connect_args["server_settings"] = {"statement_timeout": str(self.statement_timeout_ms)}
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+            "connect_args": connect_args,
+        }
+
     @property
     def url_sync(self):
         return f'postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}'
 
 
+class KafkaProducerSettings(BaseSettings):
+    """Настройки продюсера событий заказов: события отправляются с ожиданием подтверждения брокера,
+    пакеты outbox собираются продюсером в пакеты Kafka по linger_ms и max_batch_size и сжимаются compression_type;
+    event_codec - формат событий заказов в Kafka (json, msgpack или schema - двоичный формат по схеме из реестра),
+    schema_registry_path - каталог схем событий для формата schema (по умолчанию схемы, поставляемые с приложением)"""
+    linger_ms: int = Field(default_factory=lambda: os.getenv("KAFKA_PRODUCER_LINGER_MS", 0))
+    max_batch_size: int = Field(default_factory=lambda: os.getenv("KAFKA_PRODUCER_MAX_BATCH_SIZE", 16384))
+    compression_type: Optional[Literal['gzip', 'lz4', 'zstd']] = Field(
+        default_factory=lambda: os.getenv("KAFKA_PRODUCER_COMPRESSION_TYPE") or None
+    )
+    event_codec: Literal['json', 'msgpack', 'schema'] = Field(
+        default_factory=lambda: os.getenv("KAFKA_EVENT_CODEC", "json")
+    )
+    schema_registry_path: Optional[str] = Field(
+        default_factory=lambda: os.getenv("KAFKA_SCHEMA_REGISTRY_PATH") or None
+    )
+
+
+class KafkaConsumerSettings(BaseSettings):
+    """Настройки обработчика событий заказов.
+    concurrent - события обрабатываются параллельно: concurrency - число одновременно обрабатываемых событий,
+    max_pending - число полученных, но еще не обработанных событий, после которого чтение из топика ждет;
+    batch - события читаются пакетами до batch_max_records и записываются в БД одним запросом на пакет;
+    notification_concurrency - число одновременно отправляемых писем в обработчике рассылок;
+    notification_digest_window - изменения статуса заказа, пришедшие с интервалом меньше окна (секунды),
+    объединяются в одно письмо (0 - без объединения), notification_digest_max_delay - максимальная задержка письма;
+    dedup_cache_size - число ключей идемпотентности обработанных событий создания заказа, хранимых в памяти;
+    max_retries - число повторных попыток обработки события через топик повторов, после которых оно передается в DLQ,
+    retry_backoff - задержка первой повторной попытки в секундах, каждая следующая вдвое дольше,
+    но не дольше retry_backoff_max"""
+    processing_mode: Literal['concurrent', 'batch'] = Field(
+        default_factory=lambda: os.getenv("KAFKA_CONSUMER_PROCESSING_MODE", "concurrent")
+    )
+    concurrency: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_CONCURRENCY", 10), gt=0)
+    max_pending: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_MAX_PENDING", 100), gt=0)
+    batch_max_records: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_BATCH_MAX_RECORDS", 500), gt=0)
+    batch_timeout_ms: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_BATCH_TIMEOUT_MS", 200), ge=0)
+    notification_concurrency: int = Field(
+        default_factory=lambda: os.getenv("KAFKA_NOTIFICATION_CONCURRENCY", 10), gt=0
+    )
+    notification_digest_window: float = Field(
+        default_factory=lambda: os.getenv("NOTIFICATION_DIGEST_WINDOW", 5), ge=0
+    )
+    notification_digest_max_delay: float = Field(
+        default_factory=lambda: os.getenv("NOTIFICATION_DIGEST_MAX_DELAY", 30), ge=0
+    )
+    dedup_cache_size: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_DEDUP_CACHE_SIZE", 10000), gt=0)
+    max_retries: int = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_MAX_RETRIES", 5), ge=0)
+    retry_backoff: float = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_RETRY_BACKOFF", 1), gt=0)
+    retry_backoff_max: float = Field(default_factory=lambda: os.getenv("KAFKA_CONSUMER_RETRY_BACKOFF_MAX", 300), gt=0)
+
+
+class OutboxSettings(BaseSettings):
+    """Передача событий заказов из outbox в Kafka: relay_workers - число партиций outbox, передаваемых параллельно
+    (события одного заказа всегда в одной партиции; значение должно быть одинаковым во всех процессах приложения),
+    batch_size - число событий, отправляемых за одну транзакцию, poll_interval - пауза в секундах,
+    когда неотправленных событий меньше пакета"""
+    relay_workers: int = Field(default_factory=lambda: os.getenv("OUTBOX_RELAY_WORKERS", 2), gt=0)
+    batch_size: int = Field(default_factory=lambda: os.getenv("OUTBOX_BATCH_SIZE", 100), gt=0)
+    poll_interval: float = Field(default_factory=lambda: os.getenv("OUTBOX_POLL_INTERVAL", 0.5), gt=0)
+
+
+class SMTPSettings(BaseSettings):
+    """Настройки SMTP-сервера и пула постоянных соединений с ним:
+    smtp_pool_idle_timeout - через сколько секунд простоя соединение закрывается,
+    smtp_pool_health_check_after - после скольких секунд простоя соединение проверяется командой NOOP,
+    smtp_pool_max_messages - сколько писем отправляется через одно соединение до переподключения"""
+    smtp_server: Optional[str] = Field(default_factory=lambda: os.getenv("SMTP_SERVER"))
+    smtp_port: int = Field(default_factory=lambda: os.getenv("SMTP_PORT", 587))
+    smtp_username: Optional[str] = Field(default_factory=lambda: os.getenv("SMTP_USERNAME"))
+    smtp_password: Optional[str] = Field(default_factory=lambda: os.getenv("SMTP_PASSWORD"))
+    smtp_pool_size: int = Field(default_factory=lambda: os.getenv("SMTP_POOL_SIZE", 5), gt=0)
+    smtp_pool_idle_timeout: float = Field(default_factory=lambda: os.getenv("SMTP_POOL_IDLE_TIMEOUT", 60), gt=0)
+    smtp_pool_health_check_after: float = Field(
+        default_factory=lambda: os.getenv("SMTP_POOL_HEALTH_CHECK_AFTER", 10), ge=0
+    )
+    smtp_pool_max_messages: int = Field(default_factory=lambda: os.getenv("SMTP_POOL_MAX_MESSAGES", 100), gt=0)
+
+
+class PaginationSettings(BaseSettings):
+    """Размер страницы списков: по умолчанию и максимально допустимый в запросе;
+    export_chunk_size - число строк, читаемых из курсора БД и отправляемых клиенту за раз при выгрузке"""
+    page_size_default: int = Field(default_factory=lambda: os.getenv("PAGE_SIZE_DEFAULT", 50), gt=0)
+    page_size_max: int = Field(default_factory=lambda: os.getenv("PAGE_SIZE_MAX", 500), gt=0)
+    export_chunk_size: int = Field(default_factory=lambda: os.getenv("EXPORT_CHUNK_SIZE", 1000), gt=0)
+
+
+class AuthSettings(BaseSettings):
+    """Настройки авторизации: user_cache_size - число пользователей в кэше авторизации процесса,
+    user_cache_ttl - время жизни записи кэша в секундах (0 - без кэша);
+    password_hash_workers - число потоков для хэширования и проверки паролей,
+    password_hash_queue_size - число запросов, ожидающих свободный поток, сверх которого запросы отклоняются с 503;
+    token_revocation_refresh_interval - период обновления таблицы отзыва токенов из БД в секундах;
+    access_token_expire_minutes - срок действия токена авторизации, refresh_token_expire_days - токена обновления"""
+    user_cache_size: int = Field(default_factory=lambda: os.getenv("USER_CACHE_SIZE", 10000), gt=0)
+    user_cache_ttl: float = Field(default_factory=lambda: os.getenv("USER_CACHE_TTL", 60), ge=0)
+    password_hash_workers: int = Field(default_factory=lambda: os.getenv("PASSWORD_HASH_WORKERS", 4), gt=0)
+    password_hash_queue_size: int = Field(default_factory=lambda: os.getenv("PASSWORD_HASH_QUEUE_SIZE", 64), ge=0)
+    token_revocation_refresh_interval: float = Field(
+        default_factory=lambda: os.getenv("TOKEN_REVOCATION_REFRESH_INTERVAL", 30), gt=0
+    )
+    access_token_expire_minutes: float = Field(
+        default_factory=lambda: os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15), gt=0
+    )
+    refresh_token_expire_days: float = Field(default_factory=lambda: os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30), gt=0)
+
+
+class PasswordHashSettings(BaseSettings):
+    """Политика хэширования паролей: scheme - алгоритм для новых хэшей, остальные параметры - стоимость алгоритмов.
+    Хэши другого алгоритма или со стоимостью меньше заданной продолжают проверяться и пересчитываются при входе
+    пользователя, более стойкие хэши не пересчитываются;
+    argon2_memory_cost задается в КиБ, scrypt_rounds - log2 числа итераций"""
+    scheme: Literal['argon2', 'bcrypt', 'scrypt'] = Field(
+        default_factory=lambda: os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")
+    )
+    bcrypt_rounds: int = Field(default_factory=lambda: os.getenv("PASSWORD_BCRYPT_ROUNDS", 12), ge=4, le=31)
+    argon2_time_cost: int = Field(default_factory=lambda: os.getenv("PASSWORD_ARGON2_TIME_COST", 3), gt=0)
+    argon2_memory_cost: int = Field(default_factory=lambda: os.getenv("PASSWORD_ARGON2_MEMORY_COST", 65536), ge=8)
+    argon2_parallelism: int = Field(default_factory=lambda: os.getenv("PASSWORD_ARGON2_PARALLELISM", 4), gt=0)
+    scrypt_rounds: int = Field(default_factory=lambda: os.getenv("PASSWORD_SCRYPT_ROUNDS", 16), gt=0)
+    scrypt_block_size: int = Field(default_factory=lambda: os.getenv("PASSWORD_SCRYPT_BLOCK_SIZE", 8), gt=0)
+    scrypt_parallelism: int = Field(default_factory=lambda: os.getenv("PASSWORD_SCRYPT_PARALLELISM", 1), gt=0)
+
+
 class AppSettings(BaseSettings):
     db: DatabaseSettings = DatabaseSettings()
+    kafka_producer: KafkaProducerSettings = KafkaProducerSettings()
+    kafka_consumer: KafkaConsumerSettings = KafkaConsumerSettings()
+    outbox: OutboxSettings = OutboxSettings()
+    smtp: SMTPSettings = SMTPSettings()
+    pagination: PaginationSettings = PaginationSettings()
+    auth: AuthSettings = AuthSettings()
+    password_hash: PasswordHashSettings = PasswordHashSettings()
     title: str = "Order Tracker"
\ No newline at end of file
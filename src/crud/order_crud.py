@@ -1,48 +1,196 @@
-from sqlalchemy import select
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import select, insert, update, values, cast, column, and_, or_, tuple_, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from models.orders import Order
+from config.db_routing import use_primary
+from exceptions import OrderNotFoundException, OrderStatusConflictException
+from models.orders import ORDER_IDEMPOTENCY_CONSTRAINT, ORDER_STATUS_PREDECESSORS, Order, OrderStatus
 from models.users import User
+from schemas.order_schema import OrderFilter
 
 
 class OrderCrud:
     @staticmethod
-    async def create_order(order_data: dict, current_user: User, session: AsyncSession):
-        """Создание записи о заказе в БД"""
-        new_order = Order(
-            title=order_data.get("title"),
-            description=order_data.get("description"),
-            status=order_data.get("status"),
-            price=order_data.get("price"),
-            user_id=current_user.id
+    async def create_order(
+        order_data: dict, current_user: User, session: AsyncSession, idempotency_key: Optional[str] = None
+    ):
+        """Создание записи о заказе в БД одним INSERT ... RETURNING.
+        Если заказ с таким ключом идемпотентности у пользователя уже есть, новый не создается и возвращается None"""
+        new_order = await session.scalar(
+            pg_insert(Order)
+            .values(
+                title=order_data.get("title"),
+                description=order_data.get("description"),
+                status=order_data.get("status"),
+                price=order_data.get("price"),
+                user_id=current_user.id,
+                idempotency_key=idempotency_key
+            )
+            .on_conflict_do_nothing(constraint=ORDER_IDEMPOTENCY_CONSTRAINT)
+            .returning(Order)
         )
-        session.add(new_order)
         await session.commit()
-        await session.refresh(new_order)
         return new_order
 
     @staticmethod
-    async def get_all_orders(session: AsyncSession, current_user: User):
-        """Получение всех заказов из БД: суперпользователь получает все записи, а обычный пользователь - только свои"""
-        if current_user.is_superuser:
-            result = await session.execute(select(Order))
-        else:
-            result = await session.execute(select(Order).where(Order.user_id == current_user.id))
+    async def bulk_create_orders(session: AsyncSession, orders_data: List[Tuple[dict, User, Optional[str]]]):
+        """Создание пакета заказов без коммита: заказы без ключа идемпотентности - одним INSERT ... RETURNING,
+        с ключом - одним INSERT ... ON CONFLICT DO NOTHING. Заказы возвращаются в порядке orders_data,
+        вместо заказа, уже созданного по тому же ключу, возвращается None"""
+        rows = [
+            {
+                "title": order_data.get("title"),
+                "description": order_data.get("description"),
+                "status": order_data.get("status"),
+                "price": order_data.get("price"),
+                "user_id": current_user.id,
+                "idempotency_key": idempotency_key,
+            }
+            for order_data, current_user, idempotency_key in orders_data
+        ]
+        orders = [None] * len(rows)
+        keyless = [number for number, row in enumerate(rows) if row["idempotency_key"] is None]
+        keyed = [number for number, row in enumerate(rows) if row["idempotency_key"] is not None]
+        if keyless:
+            result = await session.scalars(
+                insert(Order).returning(Order, sort_by_parameter_order=True), [rows[number] for number in keyless]
+            )
+            for number, order in zip(keyless, result.all()):
+                orders[number] = order
+        if keyed:
+            result = await session.scalars(
+                pg_insert(Order).on_conflict_do_nothing(constraint=ORDER_IDEMPOTENCY_CONSTRAINT).returning(Order),
+                [rows[number] for number in keyed]
+            )
+            created = {(order.user_id, order.idempotency_key): order for order in result.all()}
+            for number in keyed:
+                orders[number] = created.pop((rows[number]["user_id"], rows[number]["idempotency_key"]), None)
+        return orders
+
+    @staticmethod
+    async def bulk_update_status_orders(
+        session: AsyncSession, orders_data: List[dict], check_transitions: bool = False
+    ):
+        """Обновление статусов пакета заказов одним UPDATE ... FROM (VALUES ...) без коммита.
+        Если заказ встречается в пакете несколько раз, применяется последний статус.
+        check_transitions - заказ обновляется, только если переход из его текущего статуса в новый допустим
+        по таблице переходов. Возвращает id и статусы обновленных заказов"""
+        statuses = {order_data.get("id"): OrderStatus(order_data.get("status")) for order_data in orders_data}
+        if not statuses:
+            return []
+        status_updates = values(
+            column('id', Integer),
+            column('status', Order.status.type),
+            name='status_updates'
+        ).data(list(statuses.items()))
+        query = update(Order).where(Order.id == status_updates.c.id)
+        if check_transitions:
+            query = query.where(or_(*(
+                and_(
+                    cast(status_updates.c.status, Order.status.type) == status,
+                    Order.status.in_(ORDER_STATUS_PREDECESSORS[status])
+                )
+                for status in set(statuses.values())
+            )))
+        result = await session.execute(
+            query
+            .values(status=status_updates.c.status, updated_at=datetime.utcnow(), version=Order.version + 1)
+            .returning(Order.id, Order.status)
+            .execution_options(synchronize_session=False)
+        )
+        return result.all()
+
+    @staticmethod
+    def filter_orders(current_user: User, filters: Optional[OrderFilter] = None):
+        """Запрос заказов с фильтрами: суперпользователь получает все записи, а обычный пользователь - только свои"""
+        query = select(Order)
+        if not current_user.is_superuser:
+            query = query.where(Order.user_id == current_user.id)
+        if filters is None:
+            return query
+        if filters.status is not None:
+            query = query.where(Order.status == filters.status)
+        if filters.price_min is not None:
+            query = query.where(Order.price >= filters.price_min)
+        if filters.price_max is not None:
+            query = query.where(Order.price <= filters.price_max)
+        if filters.created_from is not None:
+            query = query.where(Order.created_at >= filters.created_from)
+        if filters.created_to is not None:
+            query = query.where(Order.created_at < filters.created_to)
+        return query
+
+    @staticmethod
+    async def get_all_orders(
+        session: AsyncSession,
+        current_user: User,
+        filters: Optional[OrderFilter] = None,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None
+    ):
+        """Получение заказов из БД от новых к старым с постраничной выдачей по ключу (created_at, id):
+        after - позиция последнего заказа предыдущей страницы"""
+        query = OrderCrud.filter_orders(current_user, filters).order_by(Order.created_at.desc(), Order.id.desc())
+        if after is not None:
+            query = query.where(tuple_(Order.created_at, Order.id) < after)
+        if limit is not None:
+            query = query.limit(limit)
+        result = await session.execute(query.execution_options(replica=True))
         orders = result.scalars().all()
         return orders
 
+    @staticmethod
+    async def stream_orders(
+        session: AsyncSession,
+        current_user: User,
+        filters: Optional[OrderFilter] = None,
+        chunk_size: int = 1000
+    ):
+        """Чтение заказов через серверный курсор: заказы возвращаются пачками по chunk_size,
+        не загружая всю выборку в память"""
+        query = OrderCrud.filter_orders(current_user, filters).order_by(Order.id).execution_options(replica=True)
+        result = await session.stream_scalars(query, execution_options={"yield_per": chunk_size})
+        async for orders in result.partitions():
+            yield orders
+
     @staticmethod
     async def get_order(order_id: int, session: AsyncSession):
         """Получение конкретного заказа"""
-        result = await session.execute(select(Order).where(Order.id == order_id))
+        result = await session.execute(select(Order).where(Order.id == order_id).execution_options(replica=True))
         order = result.scalars().first()
         return order
 
     @staticmethod
-    async def update_status_order(session: AsyncSession, order_id: int, order_data: dict):
-        """Обновление статуса заказа"""
-        order = await OrderCrud.get_order(order_id, session)
-        order.status = order_data.get("status")
-        session.add(order)
+    async def update_status_order(
+        session: AsyncSession,
+        order_id: int,
+        order_data: dict,
+        check_transition: bool = False,
+        expected_version: Optional[int] = None
+    ):
+        """Обновление статуса заказа одним UPDATE ... RETURNING.
+        check_transition - заказ обновляется, только если переход из его текущего статуса в новый допустим
+        по таблице переходов; expected_version - версия заказа, на основе которой принято изменение.
+        Если условие не выполнено, выбрасывается OrderStatusConflictException"""
+        query = update(Order).where(Order.id == order_id)
+        if check_transition:
+            query = query.where(Order.status.in_(ORDER_STATUS_PREDECESSORS[OrderStatus(order_data.get("status"))]))
+        if expected_version is not None:
+            query = query.where(Order.version == expected_version)
+        result = await session.scalars(
+            query
+            .values(status=order_data.get("status"), updated_at=datetime.utcnow(), version=Order.version + 1)
+            .returning(Order)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        order = result.first()
+        if order is None:
+            use_primary(session)
+            exists = await session.scalar(select(Order.id).where(Order.id == order_id))
+            await session.rollback()
+            if exists is None:
+                raise OrderNotFoundException(order_id)
+            raise OrderStatusConflictException(order_id)
         await session.commit()
-        await session.refresh(order)
-        return order
\ No newline at end of file
+        return order
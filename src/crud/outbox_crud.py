@@ -0,0 +1,43 @@
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import String, cast, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.outbox import OutboxEvent
+
+# Класс advisory-блокировок партиций outbox: партицию в любой момент передает не больше одного обработчика
+OUTBOX_PARTITION_LOCK = 7401
+
+
+class OutboxCrud:
+    @staticmethod
+    async def add_event(session: AsyncSession, topic: str, payload: str, key: Optional[str] = None):
+        """Запись события в outbox и коммит транзакции запроса"""
+        await session.execute(insert(OutboxEvent).values(topic=topic, payload=payload, key=key))
+        await session.commit()
+
+    @staticmethod
+    async def get_oldest_event_time(session: AsyncSession) -> Optional[datetime]:
+        """Время записи самого старого неотправленного события, None - если outbox пуст"""
+        return await session.scalar(select(func.min(OutboxEvent.created_at)))
+
+    @staticmethod
+    async def lock_events(
+        session: AsyncSession, batch_size: int, partition: int = 0, partitions: int = 1
+    ) -> List[OutboxEvent]:
+        """Самые старые неотправленные события партиции outbox. События распределяются по партициям по ключу
+        (события без ключа - по id), партиция блокируется advisory-блокировкой до конца транзакции,
+        поэтому события одного ключа передаются одним обработчиком по порядку даже при нескольких процессах.
+        Если партицию уже передает другой обработчик, возвращается пустой список"""
+        if not await session.scalar(select(func.pg_try_advisory_xact_lock(OUTBOX_PARTITION_LOCK, partition))):
+            return []
+        query = select(OutboxEvent)
+        if partitions > 1:
+            partition_key = func.coalesce(OutboxEvent.key, cast(OutboxEvent.id, String))
+            query = query.where(func.hashtext(partition_key).op('&')(0x7FFFFFFF) % partitions == partition)
+        result = await session.execute(query.order_by(OutboxEvent.id).limit(batch_size))
+        return result.scalars().all()
+
+    @staticmethod
+    async def delete_events(session: AsyncSession, event_ids: List[int]):
+        """Удаление отправленных событий, коммит выполняет вызывающий код"""
+        await session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(event_ids)))
@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.refresh_tokens import RefreshToken
+
+
+class RefreshTokenCrud:
+    @staticmethod
+    async def create_refresh_token(
+        session: AsyncSession, user_id: int, token_hash: str, family_id: str, expires_at: datetime
+    ):
+        """Сохранение токена обновления, выпущенного при входе"""
+        session.add(RefreshToken(user_id=user_id, token_hash=token_hash, family_id=family_id, expires_at=expires_at))
+        await session.commit()
+
+    @staticmethod
+    async def rotate_refresh_token(
+        session: AsyncSession, token_hash: str, new_token_hash: str, expires_at: datetime
+    ) -> Optional[int]:
+        """Замена токена обновления новым из того же семейства одним UPDATE ... RETURNING, возвращает id пользователя.
+        Повторное предъявление отозванного или истекшего токена отзывает все семейство и возвращает None"""
+        now = datetime.utcnow()
+        result = await session.execute(
+            update(RefreshToken)
+            .where(
+                RefreshToken.token_hash == token_hash,
+                RefreshToken.revoked_at.is_(None),
+                RefreshToken.expires_at > now
+            )
+            .values(revoked_at=now)
+            .returning(RefreshToken.user_id, RefreshToken.family_id)
+        )
+        rotated = result.first()
+        if rotated is None:
+            await session.execute(
+                update(RefreshToken)
+                .where(
+                    RefreshToken.family_id == select(RefreshToken.family_id)
+                    .where(RefreshToken.token_hash == token_hash)
+                    .scalar_subquery(),
+                    RefreshToken.revoked_at.is_(None)
+                )
+                .values(revoked_at=now)
+            )
+            await session.commit()
+            return None
+        session.add(RefreshToken(
+            user_id=rotated.user_id, token_hash=new_token_hash, family_id=rotated.family_id, expires_at=expires_at
+        ))
+        await session.commit()
+        return rotated.user_id
+
+    @staticmethod
+    async def revoke_user_tokens(session: AsyncSession, user_id: int):
+        """Отзыв всех токенов обновления пользователя одним запросом в транзакции вызывающего кода"""
+        await session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+        )
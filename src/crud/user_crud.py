@@ -1,16 +1,35 @@
-from sqlalchemy import select
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.hash_password import HashPassword
+from auth.token_revocations import token_revocations
+from auth.user_cache import user_cache
+from config.db_routing import use_primary
+from crud.refresh_token_crud import RefreshTokenCrud
 from exceptions import UsernameAlreadyExistsException, EmailAlreadyExistsException
 from models.users import User
 from schemas.user_schema import UserCreate, UserUpdate
 
+# Уникальные индексы таблицы users, нарушение которых возвращается клиенту как 400
+USERNAME_UNIQUE_INDEX = 'ix_users_username'
+EMAIL_UNIQUE_INDEX = 'ix_users_email'
+
+
+def raise_unique_violation(e: IntegrityError, username: str, email: str):
+    """Преобразование нарушения уникального индекса users в ошибку для клиента"""
+    message = str(e.orig)
+    if USERNAME_UNIQUE_INDEX in message:
+        raise UsernameAlreadyExistsException(username)
+    if EMAIL_UNIQUE_INDEX in message:
+        raise EmailAlreadyExistsException(email)
+    raise e
+
 
 class UserCrud:
     @staticmethod
     async def get_users(session: AsyncSession):
         """Получение всех пользователей"""
-        result = await session.execute(select(User).where(User.is_active == True))
+        result = await session.execute(select(User).where(User.is_active == True).execution_options(replica=True))
         users = result.scalars().all()
         return users
 
@@ -18,66 +37,117 @@ class UserCrud:
     async def get_user(session: AsyncSession, user_id: int = None, email: str = None, username: str = None):
         """Получение конкретного пользователя по id, username или email"""
         if user_id:
-            result = await session.execute(select(User).where(User.id == user_id, User.is_active == True))
+            query = select(User).where(User.id == user_id, User.is_active == True)
         if email:
-            result = await session.execute(select(User).where(User.email == email, User.is_active == True))
+            query = select(User).where(User.email == email, User.is_active == True)
         if username:
-            result = await session.execute(select(User).where(User.username == username, User.is_active == True))
+            query = select(User).where(User.username == username, User.is_active == True)
+        result = await session.execute(query.execution_options(replica=True))
         return result.scalars().first()
 
     @staticmethod
-    async def create_user(session: AsyncSession, request: UserCreate):
-        """Добавление пользователя"""
-        username_exists = await session.execute(select(User).where(User.username == request.username))
-        if username_exists.scalars().first():
-            raise UsernameAlreadyExistsException(request.username)
-        email_exists = await session.execute(select(User).where(User.email == request.email))
-        if email_exists.scalars().first():
-            raise EmailAlreadyExistsException(request.email)
-        new_user = User()
-        new_user.username = request.username
-        new_user.email = request.email
-        new_user.hashed_password = HashPassword.bcrypt(request.password)
+    async def get_users_by_ids(session: AsyncSession, user_ids):
+        """Получение активных пользователей по набору id одним запросом: словарь id -> пользователь"""
+        result = await session.execute(select(User).where(User.id.in_(user_ids), User.is_active == True))
+        return {user.id: user for user in result.scalars().all()}
 
-        session.add(new_user)
-        await session.commit()
-        await session.refresh(new_user)
+    @staticmethod
+    async def get_token_revocations(session: AsyncSession):
+        """Данные для таблицы отзыва токенов: версии токенов пользователей, у которых они отзывались,
+        и id удаленных пользователей"""
+        result = await session.execute(
+            select(User.id, User.token_version, User.is_active)
+            .where((User.token_version > 0) | (User.is_active == False))
+        )
+        versions, deleted = {}, []
+        for user_id, token_version, is_active in result.all():
+            if is_active:
+                versions[user_id] = token_version
+            else:
+                deleted.append(user_id)
+        return versions, deleted
+
+    @staticmethod
+    async def create_user(session: AsyncSession, request: UserCreate):
+        """Добавление пользователя, уникальность username и email проверяется уникальными индексами"""
+        try:
+            new_user = await session.scalar(
+                insert(User)
+                .values(
+                    username=request.username,
+                    email=request.email,
+                    hashed_password=await HashPassword.hash(request.password)
+                )
+                .returning(User)
+            )
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            raise_unique_violation(e, request.username, request.email)
         return new_user
 
     @staticmethod
-    async def update_user(session: AsyncSession, request: UserUpdate, user_id: int):
-        """Изменение данных о пользователе"""
-        db_user = await UserCrud.get_user(session, user_id=user_id)
+    async def update_user(session: AsyncSession, request: UserUpdate, db_user: User):
+        """Изменение данных загруженного пользователя одним UPDATE ... RETURNING"""
+        use_primary(session)
+        user_id, previous_username = db_user.id, db_user.username
+        changes = {}
         if request.username:
-            username_exists = await session.execute(select(User).where(
-                User.username == request.username,
-                            User.id != user_id
-            ))
-            if username_exists.scalars().first():
-                raise UsernameAlreadyExistsException(request.username)
-            db_user.username = request.username
+            changes['username'] = request.username
         if request.email:
-            email_exists = await session.execute(select(User).where(
-                User.email == request.email,
-                User.id != user_id
-            ))
-            if email_exists.scalars().first():
-                raise EmailAlreadyExistsException(request.email)
-            db_user.email = request.email
+            changes['email'] = request.email
         if request.password:
-            db_user.hashed_password = HashPassword.bcrypt(request.password)
+            changes['hashed_password'] = await HashPassword.hash(request.password)
+        if not changes:
+            return db_user
+        revoke_tokens = bool(request.password) or changes.get('username', previous_username) != previous_username
+        if revoke_tokens:
+            changes['token_version'] = User.token_version + 1
+            await RefreshTokenCrud.revoke_user_tokens(session, user_id)
 
-        session.add(db_user)
-        await session.commit()
-        await session.refresh(db_user)
+        try:
+            db_user = await session.scalar(
+                update(User)
+                .where(User.id == user_id)
+                .values(**changes)
+                .returning(User)
+                .execution_options(populate_existing=True)
+            )
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            raise_unique_violation(e, request.username, request.email)
+        user_cache.invalidate(previous_username, db_user.username)
+        if revoke_tokens:
+            token_revocations.revoke(db_user.id, db_user.token_version)
 
         return db_user
 
     @staticmethod
-    async def delete_user(session: AsyncSession, user_id: int):
-        """Удаление пользователя: изменение статуса активности"""
-        db_user = await UserCrud.get_user(session, user_id=user_id)
+    async def update_password_hash(session: AsyncSession, user_id: int, previous_hash: str, hashed_password: str):
+        """Замена хэша пароля пересчитанным по текущей политике хэширования.
+        Хэш не заменяется, если пароль успели изменить после входа: возвращает True, если хэш обновлен"""
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id, User.hashed_password == previous_hash)
+            .values(hashed_password=hashed_password)
+            .returning(User.username)
+        )
+        username = result.scalar_one_or_none()
+        await session.commit()
+        if username is None:
+            return False
+        user_cache.invalidate(username)
+        return True
+
+    @staticmethod
+    async def delete_user(session: AsyncSession, db_user: User):
+        """Удаление загруженного пользователя: изменение статуса активности"""
+        use_primary(session)
         db_user.is_active = False
         session.add(db_user)
+        await RefreshTokenCrud.revoke_user_tokens(session, db_user.id)
         await session.commit()
+        user_cache.invalidate(db_user.username)
+        token_revocations.revoke(db_user.id)
         return db_user
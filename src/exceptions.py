@@ -27,6 +27,33 @@ class OrderNotFoundException(HTTPException):
         )
 
 
+class OrderStatusConflictException(HTTPException):
+    def __init__(self, order_id):
+        logger.warning("Conflict: Order ID=%s was changed concurrently", order_id)
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Conflict: Order status was changed concurrently"
+        )
+
+
+class InvalidStatusTransitionException(HTTPException):
+    def __init__(self, order_id, current_status, new_status):
+        logger.warning("Conflict: Order ID=%s status cannot change from %s to %s", order_id, current_status, new_status)
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Conflict: Order status cannot change from {current_status.value} to {new_status.value}"
+        )
+
+
+class InvalidCursorException(HTTPException):
+    def __init__(self, cursor: str):
+        logger.warning("Bad request: Invalid pagination cursor '%s'", cursor)
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bad request: Invalid pagination cursor"
+        )
+
+
 class UsernameAlreadyExistsException(HTTPException):
     def __init__(self, username: str):
         logger.warning("Bad request: Username '%s' is already registered.", username)
@@ -55,6 +82,16 @@ class CredentialException(HTTPException):
         )
 
 
+class PasswordHashingBusyException(HTTPException):
+    def __init__(self):
+        logger.warning("Service unavailable: Password hashing queue is full")
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service unavailable: Too many authentication requests, try again later",
+            headers={'Retry-After': '1'}
+        )
+
+
 class JSONSerializationError(HTTPException):
     def __init__(self, e):
         logger.error(f"JSON serialization error: {e}")
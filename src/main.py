@@ -1,16 +1,41 @@
 import asyncio
+from datetime import datetime
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from prometheus_client import Counter
 from prometheus_fastapi_instrumentator import Instrumentator
 from pydantic import ValidationError
 from fastapi.responses import JSONResponse
+from auth.hash_password import password_hash_executor
+from auth.oauth2 import refresh_token_revocations
+from config.db import db_settings, new_session, replicas
 from config.logger import logger
 from routers.order_routers import router as order_router
 from routers.user_routers import router as user_router
 from config.settings import AppSettings
-from services.kafka.consumers import consume_orders
+from crud.outbox_crud import OutboxCrud
+from services.kafka.consumers import consume_order_retries, consume_orders
+from services.kafka.notifications import consume_notifications
+from services.kafka.outbox_relay import outbox_lag, outbox_relay
+from services.kafka.producers import order_producer
 
-app = FastAPI(**AppSettings().model_dump())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Подключение общего продюсера Kafka, запуск передачи событий из outbox, загрузка таблицы отзыва токенов
+    и проверка реплик БД при старте, отправка накопленных событий при остановке"""
+    await order_producer.start()
+    background_tasks = [asyncio.create_task(refresh_token_revocations()), asyncio.create_task(outbox_relay.run())]
+    if replicas.engines:
+        background_tasks.append(asyncio.create_task(replicas.monitor(db_settings.replica_check_interval)))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await order_producer.stop()
+    password_hash_executor.shutdown()
+
+
+app = FastAPI(**AppSettings().model_dump(), lifespan=lifespan)
 app.include_router(order_router, prefix='/v1/api/orders', tags=["orders"])
 app.include_router(user_router, prefix='/v1/api/users', tags=["user"])
 
@@ -27,8 +52,26 @@ async def track_requests(request, call_next):
     request_counter.labels(endpoint=endpoint, method=method).inc()
     return response
 
+
+@app.get("/health")
+async def health():
+    """Состояние БД и outbox. Брокер Kafka не проверяется: API записывает события в outbox и работает без брокера,
+    пока брокер недоступен, растет отставание outbox (метрика outbox_lag_seconds)"""
+    try:
+        async with new_session() as session:
+            oldest_event_time = await OutboxCrud.get_oldest_event_time(session)
+    except Exception as e:
+        logger.error(f"Health check failed: database is unavailable: {e}")
+        return JSONResponse(status_code=503, content={"database": "unavailable"})
+    lag = (datetime.utcnow() - oldest_event_time).total_seconds() if oldest_event_time else 0
+    outbox_lag.set(lag)
+    return {"database": "connected", "outbox_lag_seconds": lag}
+
+
 if __name__ == "src.main":
     asyncio.create_task(consume_orders())
+    asyncio.create_task(consume_order_retries())
+    asyncio.create_task(consume_notifications())
 
 
 @app.exception_handler(ValidationError)
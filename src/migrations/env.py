@@ -8,6 +8,8 @@ from alembic import context
 from config.settings import AppSettings
 from models.users import User
 from models.orders import Order
+from models.refresh_tokens import RefreshToken
+from models.outbox import OutboxEvent
 from config.db import Base
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,26 @@
+"""outbox event key
+
+Revision ID: 5d8b2f6a9c13
+Revises: 7c4f2a9e1d36
+Create Date: 2026-10-18 23:40:12.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8b2f6a9c13'
+down_revision: Union[str, None] = '7c4f2a9e1d36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('outbox_events', sa.Column('key', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox_events', 'key')
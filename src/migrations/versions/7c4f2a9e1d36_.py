@@ -0,0 +1,28 @@
+"""orders idempotency key
+
+Revision ID: 7c4f2a9e1d36
+Revises: e3a1c5f0b8d2
+Create Date: 2026-10-18 21:52:08.640127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4f2a9e1d36'
+down_revision: Union[str, None] = 'e3a1c5f0b8d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('idempotency_key', sa.String(length=255), nullable=True))
+    op.create_unique_constraint('uq_orders_user_id_idempotency_key', 'orders', ['user_id', 'idempotency_key'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_orders_user_id_idempotency_key', 'orders', type_='unique')
+    op.drop_column('orders', 'idempotency_key')
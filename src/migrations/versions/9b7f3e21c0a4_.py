@@ -0,0 +1,26 @@
+"""orders version
+
+Revision ID: 9b7f3e21c0a4
+Revises: 5e2b9c0d7f31
+Create Date: 2026-10-18 20:35:12.904211
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b7f3e21c0a4'
+down_revision: Union[str, None] = '5e2b9c0d7f31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'version')
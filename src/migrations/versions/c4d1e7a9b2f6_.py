@@ -0,0 +1,26 @@
+"""users token version
+
+Revision ID: c4d1e7a9b2f6
+Revises: a8442ae348e1
+Create Date: 2026-10-18 19:12:40.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d1e7a9b2f6'
+down_revision: Union[str, None] = 'a8442ae348e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
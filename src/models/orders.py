@@ -1,6 +1,6 @@
 import enum
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey, DateTime, Float
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, DateTime, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from config.db import Base
 
@@ -12,6 +12,22 @@ class OrderStatus(str, enum.Enum):
     done = 'done'
 
 
+# Допустимые переходы статуса заказа: из текущего статуса в новый
+ORDER_STATUS_TRANSITIONS = {
+    OrderStatus.pending: {OrderStatus.in_progress, OrderStatus.done},
+    OrderStatus.in_progress: {OrderStatus.done},
+    OrderStatus.done: set(),
+}
+# Статусы, из которых допустим переход в данный статус
+ORDER_STATUS_PREDECESSORS = {
+    status: [previous for previous in OrderStatus if status in ORDER_STATUS_TRANSITIONS[previous]]
+    for status in OrderStatus
+}
+
+# Ключ идемпотентности уникален в пределах пользователя, заказы без ключа не ограничиваются
+ORDER_IDEMPOTENCY_CONSTRAINT = 'uq_orders_user_id_idempotency_key'
+
+
 class Order(Base):
     """Модель Заказа"""
     __tablename__ = 'orders'
@@ -23,6 +39,15 @@ class Order(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     price = Column(Float)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    idempotency_key = Column(String(255), nullable=True)
 
     owner = relationship("User", back_populates='orders')
     notifications = relationship("Notification", back_populates='orders')
+
+    __table_args__ = (
+        Index('ix_orders_created_at_id', 'created_at', 'id'),
+        Index('ix_orders_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        Index('ix_orders_status_created_at_id', 'status', 'created_at', 'id'),
+        UniqueConstraint('user_id', 'idempotency_key', name=ORDER_IDEMPOTENCY_CONSTRAINT),
+    )
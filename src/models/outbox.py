@@ -0,0 +1,14 @@
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, DateTime, String, Text
+from config.db import Base
+
+
+class OutboxEvent(Base):
+    """Событие, записанное в транзакции запроса и ожидающее отправки в Kafka"""
+    __tablename__ = 'outbox_events'
+    id = Column(BigInteger, primary_key=True)
+    topic = Column(String(255), nullable=False)
+    payload = Column(Text, nullable=False)
+    # Ключ сообщения Kafka (id заказа): события с одним ключом попадают в одну партицию и передаются по порядку
+    key = Column(String(255), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
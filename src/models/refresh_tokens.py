@@ -0,0 +1,16 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, String
+from config.db import Base
+
+
+class RefreshToken(Base):
+    """Модель токена обновления: хранится только HMAC токена.
+    Токены, выпущенные ротацией от одного входа, образуют семейство (family_id)"""
+    __tablename__ = 'refresh_tokens'
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
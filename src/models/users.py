@@ -12,4 +12,5 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     username: Mapped[str] = Column(
         String(length=320), unique=True, index=True, nullable=False
     )
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
     orders = relationship("Order", back_populates='owner')
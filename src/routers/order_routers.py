@@ -1,50 +1,98 @@
-import json
-from typing import Annotated, List
-from fastapi import Depends, APIRouter, Body
+from typing import Annotated, List, Literal, Optional
+from fastapi import Depends, APIRouter, Body, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from auth.oauth2 import oauth2_schema, get_user_by_token
-from config.db import get_session
+from auth.oauth2 import oauth2_schema, get_user_by_claims, get_user_by_token
+from config.db import get_session, new_session
+from config.db_routing import use_primary
 from config.logger import logger
+from config.settings import AppSettings
 from crud.order_crud import OrderCrud
+from crud.outbox_crud import OutboxCrud
 from exceptions import JSONSerializationError, PermissionDeniedException, OrderNotFoundException
-from schemas.order_schema import OrderCreate, OrderUpdateStatus, OrderInfo, OrderChangeStatus
-from services.kafka.producers import produce_orders
+from schemas.order_event_schema import OrderCreatedEvent, OrderStatusChangedEvent
+from schemas.order_schema import OrderCreate, OrderUpdateStatus, OrderInfo, OrderChangeStatus, OrderFilter
+from services.check_permissions import check_permissions_users
+from services.export import csv_header, orders_to_csv, orders_to_ndjson
+from services.kafka.settings import ORDER_TOPIC
+from services.order_status import check_status_transition
+from services.pagination import decode_cursor, encode_cursor
 
 router = APIRouter()
+pagination_settings = AppSettings().pagination
 
 @router.post("/create/", response_model=OrderCreate)
 async def create_order(
     access_token: Annotated[str, Depends(oauth2_schema)],
     order_data: OrderCreate = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias='Idempotency-Key', min_length=1, max_length=255),
     session: AsyncSession = Depends(get_session)
 ):
-    """Создание заказа"""
+    """Создание заказа: событие записывается в outbox и передается в Kafka в фоне.
+    Повторные запросы с тем же заголовком Idempotency-Key создают не больше одного заказа"""
     current_user = await get_user_by_token(access_token, session)
     try:
-        produce_data = json.dumps({
-            "type": "create",
-            "order_data": order_data.model_dump(),
-            "user_id": current_user.id,
-        })
-        await produce_orders(data_json=produce_data)
+        event = OrderCreatedEvent(
+            order_data=order_data.model_dump(), user_id=current_user.id, idempotency_key=idempotency_key
+        )
     except Exception as e:
-        logger.error(f"JSON serialization error: {e}")
-        JSONSerializationError(e)
+        raise JSONSerializationError(e)
+    await OutboxCrud.add_event(session, ORDER_TOPIC, event.model_dump_json())
     return order_data
 
 
 @router.get("/", response_model=List[OrderInfo])
 async def get_orders(
         access_token: Annotated[str, Depends(oauth2_schema)],
+        response: Response,
+        filters: OrderFilter = Depends(),
+        cursor: Optional[str] = Query(None),
+        limit: Optional[int] = Query(None, gt=0),
         session: AsyncSession = Depends(get_session)
 ):
-    """Просмотр заказов, пользователь может просматривать только свои заказы а суперпользователь все"""
-    current_user = await get_user_by_token(access_token, session)
-    orders = await OrderCrud.get_all_orders(session, current_user)
+    """Просмотр заказов, пользователь может просматривать только свои заказы а суперпользователь все.
+    Заказы выдаются постранично от новых к старым, курсор следующей страницы передается в заголовке X-Next-Cursor"""
+    current_user = await get_user_by_claims(access_token, session)
+    page_size = min(limit or pagination_settings.page_size_default, pagination_settings.page_size_max)
+    after = decode_cursor(cursor) if cursor else None
+    orders = await OrderCrud.get_all_orders(session, current_user, filters, limit=page_size + 1, after=after)
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        response.headers['X-Next-Cursor'] = encode_cursor(orders[-1].created_at, orders[-1].id)
     logger.info("User ID=%s retrieved the order list", current_user.id)
     return [OrderInfo.model_validate(order) for order in orders]
 
 
+async def export_orders_chunks(current_user, filters: OrderFilter, export_format: str):
+    """Выгрузка заказов пачками в отдельной сессии: сессия запроса закрывается до начала отправки ответа"""
+    async with new_session() as session:
+        if export_format == 'csv':
+            yield csv_header()
+        async for orders in OrderCrud.stream_orders(
+            session, current_user, filters, chunk_size=pagination_settings.export_chunk_size
+        ):
+            yield orders_to_csv(orders) if export_format == 'csv' else orders_to_ndjson(orders)
+
+
+@router.get("/export/")
+async def export_orders(
+        access_token: Annotated[str, Depends(oauth2_schema)],
+        filters: OrderFilter = Depends(),
+        export_format: Literal['ndjson', 'csv'] = Query('ndjson', alias='format'),
+        session: AsyncSession = Depends(get_session)
+):
+    """Потоковая выгрузка заказов в NDJSON или CSV, доступно для суперпользователя"""
+    current_user = await get_user_by_claims(access_token, session)
+    check_permissions_users(current_user, superuser_only=True)
+    logger.info("User ID=%s exported orders in %s", current_user.id, export_format)
+    media_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        export_orders_chunks(current_user, filters, export_format),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="orders.{export_format}"'}
+    )
+
+
 @router.put("/{order_id}/", response_model=OrderChangeStatus)
 async def update_status_order(
     access_token: Annotated[str, Depends(oauth2_schema)],
@@ -52,27 +100,27 @@ async def update_status_order(
     order_data: OrderUpdateStatus = Body(...),
     session: AsyncSession = Depends(get_session)
 ):
-    """Изменение статуса заказа"""
+    """Изменение статуса заказа: недопустимый переход статуса отклоняется сразу, без записи события в outbox.
+    Текущий статус читается с основной БД: статус с отстающей реплики пропустил бы недопустимый переход.
+    Обработчик события повторно проверяет переход по статусу в БД, previous_status используется только в уведомлении"""
     current_user = await get_user_by_token(access_token, session)
-    previous_status = order_data.status
+    use_primary(session)
     order = await OrderCrud.get_order(order_id, session)
+    if not order:
+        raise OrderNotFoundException(order_id)
     if not (current_user.is_superuser or current_user.id == order.user_id):
         logger.error("FORBIDDEN: Insufficient permissions to change the status of order ID=%s for user ID=%s", order.id,
                      current_user.id)
         raise PermissionDeniedException()
-    if not order:
-        raise OrderNotFoundException(order_id)
-    if order.status == previous_status:
-        logger.warning("Conflict: Failed to change the status for order ID=%s", order_id)
+    check_status_transition(order, order_data.status)
+    previous_status = order.status
     try:
-        notification = json.dumps({
-            "type": "update",
-            "user_id": current_user.id,
-            "order_data": {"id": order_id, "status": order_data.status},
-            "previous_status": previous_status
-        })
-        await produce_orders(data_json=notification)
+        event = OrderStatusChangedEvent(
+            user_id=current_user.id,
+            order_data={"id": order_id, "status": order_data.status},
+            previous_status=previous_status
+        )
     except Exception as e:
-        logger.error(f"JSON serialization error: {e}")
-        JSONSerializationError(e)
+        raise JSONSerializationError(e)
+    await OutboxCrud.add_event(session, ORDER_TOPIC, event.model_dump_json(), key=str(order_id))
     return OrderChangeStatus(id=order_id, status=order_data.status)
@@ -1,20 +1,38 @@
+import secrets
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Body
 from typing import Annotated, List
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.hash_password import HashPassword
-from auth.oauth2 import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, oauth2_schema, get_user_by_token
-from config.db import get_session
+from auth.oauth2 import (
+    create_access_token, create_refresh_token, hash_refresh_token, ACCESS_TOKEN_EXPIRE_MINUTES, oauth2_schema,
+    get_user_by_token, token_claims
+)
+from auth.request_users import RequestUsers
+from config.db import get_session, new_session
+from config.db_routing import use_primary
 from config.logger import logger
+from crud.refresh_token_crud import RefreshTokenCrud
 from crud.user_crud import UserCrud
-from exceptions import UserNotFoundException
-from schemas.user_schema import UserInfo, UserCreate, UserUpdate, AccessToken
+from exceptions import CredentialException, UserNotFoundException
+from schemas.user_schema import UserInfo, UserCreate, UserUpdate, AccessToken, RefreshTokenRequest
 from services.check_permissions import check_permissions_users
 
 router = APIRouter()
 
 
+async def rehash_password(user_id: int, previous_hash: str, plain_password: str):
+    """Пересчет хэша пароля по текущей политике хэширования после успешного входа"""
+    try:
+        hashed_password = await HashPassword.hash(plain_password)
+        async with new_session() as session:
+            if await UserCrud.update_password_hash(session, user_id, previous_hash, hashed_password):
+                logger.info("Password hash of user ID=%s updated to the current hashing policy", user_id)
+    except Exception as e:
+        logger.error(f"Password rehash for user ID={user_id} failed: {e}")
+
+
 @router.get('/', response_model=List[UserInfo])
 async def get_all_users(
     access_token: Annotated[str, Depends(oauth2_schema)],
@@ -30,16 +48,15 @@ async def get_all_users(
 
 @router.get('/{user_id}', response_model=UserInfo)
 async def get_user_detail(
-    access_token: Annotated[str, Depends(oauth2_schema)],
     user_id: int,
-    session: AsyncSession = Depends(get_session)
+    users: RequestUsers = Depends()
 ):
     """Получение информации о пользователе, доступно пользователю и суперпользователю"""
-    user = await UserCrud.get_user(session, user_id)
+    user = await users.get(user_id)
     if not user:
         logger.error("Not found: User with ID=%s not exist", user_id)
         raise UserNotFoundException()
-    current_user = await get_user_by_token(access_token, session)
+    current_user = await users.current()
     check_permissions_users(current_user, user_id=user.id)
     logger.info("Retrieving information about user ID=%s by user ID=%s", user.id, current_user.id)
     return user
@@ -59,18 +76,19 @@ async def register(
 @router.put('/{user_id}/update', response_model=UserInfo)
 async def update_user(
     user_id: int,
-    access_token: Annotated[str, Depends(oauth2_schema)],
     request: UserUpdate = Body(...),
+    users: RequestUsers = Depends(),
     session: AsyncSession = Depends(get_session)
 ):
     """Обновление иноформации о пользователе, доступно пользователю и суперпользователю"""
-    user = await UserCrud.get_user(session, user_id)
+    use_primary(session)
+    user = await users.get(user_id)
     if not user:
         logger.error("Not found: User with ID=%s not exist", user_id)
         raise UserNotFoundException()
-    current_user = await get_user_by_token(access_token, session)
+    current_user = await users.current()
     check_permissions_users(current_user, user_id=user.id)
-    update_user = await UserCrud.update_user(session, request=request, user_id=user_id)
+    update_user = await UserCrud.update_user(session, request=request, db_user=user)
     logger.info("Information for user ID=%s updated by user ID=%s", user.id, current_user.id)
     return update_user
 
@@ -78,22 +96,24 @@ async def update_user(
 @router.delete('/{user_id}/delete', response_model=UserInfo)
 async def delete_user(
         user_id: int,
-        access_token: Annotated[str, Depends(oauth2_schema)],
+        users: RequestUsers = Depends(),
         session: AsyncSession = Depends(get_session)
 ):
     """Удаление пользователя, доступно пользователю и суперпользователю"""
-    user = await UserCrud.get_user(session, user_id=user_id)
+    use_primary(session)
+    user = await users.get(user_id)
     if not user:
         logger.error("Not found: User with ID=%s not exist", user_id)
         raise UserNotFoundException()
-    current_user = await get_user_by_token(access_token, session)
+    current_user = await users.current()
     check_permissions_users(current_user, superuser_only=True)
     logger.info("User ID=%s deleted by user ID=%s", user.id, current_user.id)
-    return await UserCrud.delete_user(session, user_id)
+    return await UserCrud.delete_user(session, user)
 
 
 @router.post("/token", response_model=AccessToken)
 async def login(
+        background_tasks: BackgroundTasks,
         request: OAuth2PasswordRequestForm = Depends(),
         session: AsyncSession = Depends(get_session),
 ):
@@ -102,11 +122,40 @@ async def login(
     if not user:
         logger.error("Not found: User with username='%s' not exist", request.username)
         raise UserNotFoundException()
-    if not HashPassword.verify(user.hashed_password, request.password):
+    if not await HashPassword.verify(user.hashed_password, request.password):
         logger.error("User with username='%s' entered an incorrect password", request.username)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Invalid password')
+    if HashPassword.needs_rehash(user.hashed_password):
+        background_tasks.add_task(rehash_password, user.id, user.hashed_password, request.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"username": user.username}, expires_delta=access_token_expires)
+    access_token = create_access_token(data=token_claims(user), expires_delta=access_token_expires)
+    refresh_token, refresh_token_hash, refresh_expires_at = create_refresh_token()
+    await RefreshTokenCrud.create_refresh_token(
+        session, user.id, refresh_token_hash, family_id=secrets.token_hex(16), expires_at=refresh_expires_at
+    )
     logger.info("User with username=%s has logged in", request.username)
-    token = AccessToken(access_token=access_token)
-    return token
\ No newline at end of file
+    token = AccessToken(access_token=access_token, refresh_token=refresh_token)
+    return token
+
+
+@router.post("/token/refresh", response_model=AccessToken)
+async def refresh_access_token(
+        request: RefreshTokenRequest = Body(...),
+        session: AsyncSession = Depends(get_session),
+):
+    """Выпуск нового токена авторизации по токену обновления без проверки пароля.
+    Токен обновления одноразовый: вместе с токеном авторизации выдается новый"""
+    refresh_token, refresh_token_hash, refresh_expires_at = create_refresh_token()
+    user_id = await RefreshTokenCrud.rotate_refresh_token(
+        session, hash_refresh_token(request.refresh_token), refresh_token_hash, refresh_expires_at
+    )
+    if user_id is None:
+        logger.error("Refresh token is invalid, expired or already used")
+        raise CredentialException()
+    user = await UserCrud.get_user(session, user_id=user_id)
+    if not user:
+        raise CredentialException()
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(data=token_claims(user), expires_delta=access_token_expires)
+    logger.info("Access token of user ID=%s refreshed", user.id)
+    return AccessToken(access_token=access_token, refresh_token=refresh_token)
\ No newline at end of file
@@ -0,0 +1,49 @@
+from typing import Annotated, Literal, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field, Strict, TypeAdapter
+from models.orders import OrderStatus
+from schemas.order_schema import OrderCreate
+
+# Строгая проверка типов: строка вместо числа и число вместо строки не приводятся, событие отклоняется.
+# Статусы передаются значениями перечисления и после проверки хранятся строками, как в JSON
+EVENT_CONFIG = ConfigDict(strict=True, use_enum_values=True)
+EventOrderStatus = Annotated[OrderStatus, Strict(False)]
+
+
+class OrderEventData(OrderCreate):
+    """Данные создаваемого заказа в событии"""
+    model_config = EVENT_CONFIG
+
+    status: EventOrderStatus
+
+
+class OrderStatusEventData(BaseModel):
+    """Новый статус заказа в событии"""
+    model_config = EVENT_CONFIG
+
+    id: int
+    status: EventOrderStatus
+
+
+class OrderCreatedEvent(BaseModel):
+    """Событие создания заказа"""
+    model_config = EVENT_CONFIG
+
+    type: Literal['create'] = 'create'
+    user_id: int
+    order_data: OrderEventData
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=255)
+
+
+class OrderStatusChangedEvent(BaseModel):
+    """Событие изменения статуса заказа"""
+    model_config = EVENT_CONFIG
+
+    type: Literal['update'] = 'update'
+    user_id: int
+    order_data: OrderStatusEventData
+    previous_status: EventOrderStatus
+
+
+OrderEvent = Annotated[Union[OrderCreatedEvent, OrderStatusChangedEvent], Field(discriminator='type')]
+# Проверка события любого типа: тип выбирается по полю type, JSON разбирается и проверяется за один проход
+order_event_adapter = TypeAdapter(OrderEvent)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel, Field, ConfigDict, field_validator
 from typing import Optional
 from models.orders import OrderStatus
@@ -23,10 +24,23 @@ class OrderInfo(OrderCreate):
     model_config = ConfigDict(from_attributes=True)
 
 
+class OrderExport(OrderInfo):
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
 class OrderUpdateStatus(BaseModel):
     status: OrderStatus
 
 
 class OrderChangeStatus(BaseModel):
     id: int
-    status: OrderStatus
\ No newline at end of file
+    status: OrderStatus
+
+
+class OrderFilter(BaseModel):
+    status: Optional[OrderStatus] = None
+    price_min: Optional[float] = Field(None, ge=0)
+    price_max: Optional[float] = Field(None, ge=0)
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
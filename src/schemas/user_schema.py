@@ -34,6 +34,18 @@ class UserUpdate(BaseModel):
     password: Optional[str] = None
 
 
+class TokenUser(BaseModel):
+    """Пользователь, восстановленный из подписанных claims токена без запроса к БД"""
+    id: int
+    username: str
+    is_superuser: bool
+
+
 class AccessToken(BaseModel):
     access_token: str
-    token_type: str = 'bearer'
\ No newline at end of file
+    token_type: str = 'bearer'
+    refresh_token: Optional[str] = None
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
\ No newline at end of file
@@ -0,0 +1,28 @@
+import csv
+import io
+from typing import List
+from models.orders import Order
+from schemas.order_schema import OrderExport
+
+EXPORT_FIELDS = list(OrderExport.model_fields)
+
+
+def orders_to_ndjson(orders: List[Order]) -> str:
+    """Пачка заказов в формате NDJSON: один JSON-объект на строку"""
+    return ''.join(OrderExport.model_validate(order).model_dump_json() + '\n' for order in orders)
+
+
+def csv_header() -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_FIELDS)
+    return buffer.getvalue()
+
+
+def orders_to_csv(orders: List[Order]) -> str:
+    """Пачка заказов в формате CSV без заголовка"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for order in orders:
+        row = OrderExport.model_validate(order).model_dump(mode='json')
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+    return buffer.getvalue()
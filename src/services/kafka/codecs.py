@@ -0,0 +1,136 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+import msgpack
+from config.settings import AppSettings
+from schemas.order_event_schema import OrderEvent, order_event_adapter
+from services.kafka.producers import Headers
+from services.kafka.schema_registry import DEFAULT_SCHEMA_DIR, FileSchemaRegistry
+
+# Заголовки формата события: по ним обработчик выбирает кодек и версию схемы
+CONTENT_TYPE_HEADER = 'content-type'
+EVENT_VERSION_HEADER = 'event-version'
+EVENT_SCHEMA_HEADER = 'event-schema'
+# Версия структуры события в форматах без схемы (JSON и msgpack)
+EVENT_VERSION = 1
+# Схемы событий заказов по типу события
+ORDER_EVENT_SCHEMAS = {'create': 'order.create', 'update': 'order.update'}
+
+
+class EventCodec(ABC):
+    """Формат сериализации событий заказов в сообщениях Kafka. Прочитанное событие проверяется моделью,
+    событие с неверной структурой или типами полей отклоняется ValidationError"""
+    name: str
+    content_type: str
+
+    @abstractmethod
+    def encode(self, event: OrderEvent) -> Tuple[bytes, Headers]:
+        pass
+
+    def encode_json(self, payload: str) -> Tuple[bytes, Headers]:
+        """Запись события, сохраненного в JSON (в outbox)"""
+        return self.encode(order_event_adapter.validate_json(payload))
+
+    @abstractmethod
+    def decode(self, value: bytes, headers: Dict[str, str]) -> OrderEvent:
+        pass
+
+    def _headers(self, version: int = EVENT_VERSION) -> Headers:
+        return [(CONTENT_TYPE_HEADER, self.content_type.encode()), (EVENT_VERSION_HEADER, str(version).encode())]
+
+
+class JsonCodec(EventCodec):
+    """JSON: ключи и значения перечислений передаются текстом в каждом событии"""
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, event: OrderEvent) -> Tuple[bytes, Headers]:
+        return event.model_dump_json().encode('utf-8'), self._headers()
+
+    def encode_json(self, payload: str) -> Tuple[bytes, Headers]:
+        """Событие из outbox уже записано в JSON и передается без повторного разбора"""
+        return payload.encode('utf-8'), self._headers()
+
+    def decode(self, value: bytes, headers: Dict[str, str]) -> OrderEvent:
+        return order_event_adapter.validate_json(value)
+
+
+class MsgpackCodec(EventCodec):
+    """msgpack: та же структура, что и в JSON, в двоичном виде"""
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def encode(self, event: OrderEvent) -> Tuple[bytes, Headers]:
+        return msgpack.packb(event.model_dump(), use_bin_type=True), self._headers()
+
+    def decode(self, value: bytes, headers: Dict[str, str]) -> OrderEvent:
+        return order_event_adapter.validate_python(msgpack.unpackb(value, raw=False))
+
+
+def pack_fields(fields: List[dict], data: dict) -> list:
+    """Значения полей в порядке схемы: имена полей не передаются, перечисления передаются номером значения"""
+    values = []
+    for field in fields:
+        value = data.get(field['name'])
+        if value is None:
+            if not field.get('optional'):
+                raise ValueError(f"Event field '{field['name']}' is required by the schema")
+        elif field['type'] == 'record':
+            value = pack_fields(field['fields'], value)
+        elif field['type'] == 'enum':
+            value = field['symbols'].index(value)
+        values.append(value)
+    return values
+
+
+def unpack_fields(fields: List[dict], values: list) -> dict:
+    if len(values) != len(fields):
+        raise ValueError(f"Event has {len(values)} fields, schema expects {len(fields)}")
+    data = {}
+    for field, value in zip(fields, values):
+        if value is not None and field['type'] == 'record':
+            value = unpack_fields(field['fields'], value)
+        elif value is not None and field['type'] == 'enum':
+            if not isinstance(value, int) or not 0 <= value < len(field['symbols']):
+                raise ValueError(f"Event field '{field['name']}' has unknown enum index {value}")
+            value = field['symbols'][value]
+        data[field['name']] = value
+    return data
+
+
+class SchemaCodec(EventCodec):
+    """Компактный двоичный формат по схеме из реестра: событие записывается массивом msgpack значений полей
+    в порядке схемы, имя и версия схемы передаются в заголовках. Событие читается по схеме той версии,
+    которой оно записано"""
+    name = 'schema'
+    content_type = 'application/vnd.order-event+msgpack'
+
+    def __init__(self, registry: Optional[FileSchemaRegistry] = None):
+        self.registry = registry or FileSchemaRegistry(
+            AppSettings().kafka_producer.schema_registry_path or DEFAULT_SCHEMA_DIR
+        )
+        self._event_types = {schema: event_type for event_type, schema in ORDER_EVENT_SCHEMAS.items()}
+
+    def encode(self, event: OrderEvent) -> Tuple[bytes, Headers]:
+        schema = self.registry.latest(ORDER_EVENT_SCHEMAS[event.type])
+        value = msgpack.packb(pack_fields(schema['fields'], event.model_dump()), use_bin_type=True)
+        return value, self._headers(schema['version']) + [(EVENT_SCHEMA_HEADER, schema['name'].encode())]
+
+    def decode(self, value: bytes, headers: Dict[str, str]) -> OrderEvent:
+        schema = self.registry.get(headers[EVENT_SCHEMA_HEADER], int(headers[EVENT_VERSION_HEADER]))
+        event = unpack_fields(schema['fields'], msgpack.unpackb(value, raw=False))
+        event['type'] = self._event_types[schema['name']]
+        return order_event_adapter.validate_python(event)
+
+
+def decode_event(value: bytes, headers: Dict[str, str]) -> OrderEvent:
+    """Чтение события кодеком, указанным в заголовке content-type; события без заголовка читаются как JSON"""
+    content_type = headers.get(CONTENT_TYPE_HEADER, JsonCodec.content_type)
+    for codec in event_codecs.values():
+        if codec.content_type == content_type:
+            return codec.decode(value, headers)
+    raise ValueError(f"Unsupported event content type: {content_type}")
+
+
+event_codecs = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec(), SchemaCodec())}
+# Кодек, которым записываются новые события; читаются события в любом из форматов
+event_codec = event_codecs[AppSettings().kafka_producer.event_codec]
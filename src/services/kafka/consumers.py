@@ -1,61 +1,309 @@
-from aiokafka import AIOKafkaConsumer
-import json
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, List, Optional
+from aiokafka import AIOKafkaConsumer, TopicPartition
 from config.db import get_session
 from config.logger import logger
-from crud.notification_crud import NotificationCrud
+from config.settings import AppSettings, KafkaConsumerSettings
 from crud.order_crud import OrderCrud
 from crud.user_crud import UserCrud
-from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS
-from services.send_mail import EmailService
+from exceptions import OrderStatusConflictException
+from schemas.order_event_schema import OrderCreatedEvent, OrderEvent, OrderStatusChangedEvent
+from services.kafka.dedup import duplicate_order_events, processed_events
+from services.kafka.codecs import decode_event
+from services.kafka.retry import FailedEvents, failed_order_events, message_headers, retry_due_in
+from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS, ORDER_RETRY_TOPIC, ORDER_TOPIC
+from services.kafka.worker_pool import EventWorkerPool
+from services.kafka.notifications import (
+    creation_notification_event, status_notification_event, publish_notification, notification_producer
+)
+
+
+def event_idempotency_key(order_msg: OrderEvent):
+    """Ключ идемпотентности события создания заказа в пределах пользователя, None - если клиент его не передал"""
+    if not isinstance(order_msg, OrderCreatedEvent) or order_msg.idempotency_key is None:
+        return None
+    return order_msg.user_id, order_msg.idempotency_key
+
+
+def order_event_key(order_msg: OrderEvent):
+    """Ключ упорядочивания события: id заказа для изменения статуса, у создаваемого заказа id еще нет"""
+    if isinstance(order_msg, OrderCreatedEvent):
+        return None
+    return order_msg.order_data.id
+
+
+async def publish_committed_notifications(notification_events: List[dict]):
+    """Передача событий рассылок по уже записанным в БД заказам.
+    Ошибка рассылки только логируется: повтор события после коммита создал бы заказ повторно,
+    а исключение из пакетной обработки остановило бы consumer"""
+    results = await asyncio.gather(
+        *(publish_notification(notification_event) for notification_event in notification_events),
+        return_exceptions=True
+    )
+    for notification_event, result in zip(notification_events, results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"Error in Kafka consumer: notification for order ID={notification_event.get('order_id')} "
+                f"was not delivered: {result}"
+            )
+
+
+async def handle_order_event(order_msg: OrderEvent):
+    """Обработка проверенного события заказа: запись в БД и передача события рассылки обработчику уведомлений"""
+    user_id = order_msg.user_id
+    order_data = order_msg.order_data.model_dump()
+    idempotency_key = event_idempotency_key(order_msg)
+    if idempotency_key is not None and idempotency_key in processed_events:
+        duplicate_order_events.labels(source='cache').inc()
+        logger.info("Repeated order creation event of user ID=%s skipped", user_id)
+        return
+    async for session in get_session():
+        current_user = await UserCrud.get_user(session, user_id=user_id)
+        if isinstance(order_msg, OrderCreatedEvent):
+            order = await OrderCrud.create_order(
+                order_data, current_user, session, idempotency_key=order_msg.idempotency_key
+            )
+            if idempotency_key is not None:
+                processed_events.add(idempotency_key)
+            if order is None:
+                duplicate_order_events.labels(source='db').inc()
+                logger.info("Repeated order creation event of user ID=%s skipped", user_id)
+                notification_event = None
+            else:
+                logger.info("Order ID=%s created by user ID=%s", order.id, current_user.id)
+                notification_event = creation_notification_event(order.id, current_user.email)
+        else:
+            order_id = order_msg.order_data.id
+            try:
+                await OrderCrud.update_status_order(session, order_id, order_data, check_transition=True)
+            except OrderStatusConflictException:
+                logger.warning(
+                    "Status change of order ID=%s to %s skipped: transition from the current status is not allowed",
+                    order_id, order_msg.order_data.status
+                )
+                notification_event = None
+            else:
+                logger.info("Order ID=%s status changed by user ID=%s", order_id, current_user.id)
+                notification_event = status_notification_event(
+                    order_id, order_msg.order_data.status, order_msg.previous_status, current_user.email
+                )
+    if notification_event is not None:
+        await publish_committed_notifications([notification_event])
+
+
+async def save_order_events_batch(session, order_msgs: List[OrderEvent]):
+    """Запись пакета событий в БД: один INSERT для новых заказов, один UPDATE для статусов и один коммит.
+    Возвращает события рассылок по сохраненным заказам"""
+    users = await UserCrud.get_users_by_ids(session, {order_msg.user_id for order_msg in order_msgs})
+    creates, batch_keys = [], set()
+    for order_msg in order_msgs:
+        if not isinstance(order_msg, OrderCreatedEvent):
+            continue
+        idempotency_key = event_idempotency_key(order_msg)
+        if idempotency_key is not None:
+            if idempotency_key in processed_events or idempotency_key in batch_keys:
+                duplicate_order_events.labels(source='cache').inc()
+                continue
+            batch_keys.add(idempotency_key)
+        creates.append(order_msg)
+    updates = [order_msg for order_msg in order_msgs if isinstance(order_msg, OrderStatusChangedEvent)]
+    orders = await OrderCrud.bulk_create_orders(
+        session,
+        [
+            (order_msg.order_data.model_dump(), users[order_msg.user_id], order_msg.idempotency_key)
+            for order_msg in creates
+        ]
+    )
+    updated = await OrderCrud.bulk_update_status_orders(
+        session, [order_msg.order_data.model_dump() for order_msg in updates], check_transitions=True
+    )
+    await session.commit()
+    for idempotency_key in batch_keys:
+        processed_events.add(idempotency_key)
+    duplicates = sum(order is None for order in orders)
+    if duplicates:
+        duplicate_order_events.labels(source='db').inc(duplicates)
+        logger.info("Order events batch: %s repeated order creation events skipped", duplicates)
+    updated_ids = {order_id for order_id, _ in updated}
+    skipped = [order_msg for order_msg in updates if order_msg.order_data.id not in updated_ids]
+    if skipped:
+        logger.warning(
+            "Order events batch: %s status changes skipped, transition from the current status is not allowed",
+            len(skipped)
+        )
+        updates = [order_msg for order_msg in updates if order_msg.order_data.id in updated_ids]
+    logger.info(
+        "Order events batch saved: %s orders created, %s statuses changed", len(creates) - duplicates, len(updates)
+    )
+    notification_events = [
+        creation_notification_event(order.id, users[order_msg.user_id].email)
+        for order_msg, order in zip(creates, orders)
+        if order is not None
+    ]
+    notification_events += [
+        status_notification_event(
+            order_msg.order_data.id,
+            order_msg.order_data.status,
+            order_msg.previous_status,
+            users[order_msg.user_id].email,
+        )
+        for order_msg in updates
+    ]
+    return notification_events
+
+
+async def handle_order_events_batch(
+    order_msgs: List[OrderEvent], on_failure: Optional[Callable[[int, Exception], Awaitable]] = None
+):
+    """Обработка пакета событий заказов с передачей событий рассылок обработчику уведомлений.
+    Если пакет не удалось записать целиком, события обрабатываются по одному,
+    для событий, обработка которых завершилась ошибкой, вызывается on_failure с номером события в пакете"""
+    async for session in get_session():
+        try:
+            notification_events = await save_order_events_batch(session, order_msgs)
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error in Kafka consumer: batch of {len(order_msgs)} events failed, retrying one by one: {e}")
+            for number, order_msg in enumerate(order_msgs):
+                try:
+                    await handle_order_event(order_msg)
+                except Exception as e:
+                    if on_failure is None:
+                        logger.error(f"Error in Kafka consumer: {e}")
+                    else:
+                        await on_failure(number, e)
+            return
+    await publish_committed_notifications(notification_events)
+
+
+def decode_order_message(msg) -> OrderEvent:
+    """Чтение и проверка события заказа кодеком, указанным в заголовках сообщения.
+    Событие с неверной структурой или типами полей отклоняется до записи в БД и передается в DLQ без повторов"""
+    return decode_event(msg.value, message_headers(msg))
+
+
+def order_message_key(msg):
+    """Ключ упорядочивания сообщения, у сообщения, которое не удается разобрать, ключа нет"""
+    try:
+        return order_event_key(decode_order_message(msg))
+    except Exception:
+        return None
+
+
+async def handle_order_message(msg, failed_events: FailedEvents = failed_order_events):
+    """Обработка сообщения топика заказов или топика повторов.
+    Ошибка обработки не останавливает чтение топика: событие передается в топик повторов или в DLQ"""
+    try:
+        await handle_order_event(decode_order_message(msg))
+    except Exception as e:
+        await failed_events.handle(msg, e)
+
+
+def resume_partition(consumer: AIOKafkaConsumer, tp: TopicPartition):
+    try:
+        consumer.resume(tp)
+    except Exception as e:
+        logger.warning(f"Kafka consumer: partition {tp.topic}[{tp.partition}] was not resumed: {e}")
+
+
+def delay_until_due(consumer: AIOKafkaConsumer, msg) -> bool:
+    """Отложенная обработка события топика повторов, срок попытки которого еще не наступил: партиция
+    приостанавливается до срока, позиция чтения возвращается к событию, и оно читается повторно после возобновления.
+    Ожидающие события не занимают обработчики и место в пуле, остальные партиции читаются без задержки"""
+    tp = TopicPartition(msg.topic, msg.partition)
+    if tp in consumer.paused():
+        # Событие уже полученного пакета приостановленной партиции будет прочитано повторно после возобновления
+        return True
+    due_in = retry_due_in(msg)
+    if due_in <= 0:
+        return False
+    consumer.pause(tp)
+    consumer.seek(tp, msg.offset)
+    asyncio.get_running_loop().call_later(due_in, resume_partition, consumer, tp)
+    return True
+
+
+async def consume_concurrently(consumer: AIOKafkaConsumer, settings: KafkaConsumerSettings, pipeline: str = 'orders'):
+    """Чтение событий по одному с параллельной обработкой в пуле, события топика повторов - не раньше срока попытки"""
+    pool = EventWorkerPool(
+        consumer, concurrency=settings.concurrency, max_pending=settings.max_pending, pipeline=pipeline
+    )
+    try:
+        async for msg in consumer:
+            if delay_until_due(consumer, msg):
+                continue
+            await pool.submit(msg, order_message_key(msg), partial(handle_order_message, msg))
+    finally:
+        await pool.join()
+
+
+async def consume_batches(consumer: AIOKafkaConsumer, settings: KafkaConsumerSettings):
+    """Чтение событий пакетами через getmany() с коммитом смещений после обработки пакета"""
+    while True:
+        records = await consumer.getmany(timeout_ms=settings.batch_timeout_ms, max_records=settings.batch_max_records)
+        messages = [msg for partition_records in records.values() for msg in partition_records]
+        if not messages:
+            continue
+        decoded, order_msgs = [], []
+        for msg in messages:
+            try:
+                order_msgs.append(decode_order_message(msg))
+            except Exception as e:
+                await failed_order_events.handle(msg, e)
+                continue
+            decoded.append(msg)
+        await handle_order_events_batch(
+            order_msgs, on_failure=lambda number, e: failed_order_events.handle(decoded[number], e)
+        )
+        await consumer.commit()
 
 
 async def consume_orders():
+    settings = AppSettings().kafka_consumer
     try:
         consumer = AIOKafkaConsumer(
-        'order_topic',
+            ORDER_TOPIC,
             bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-            group_id='group-id'
+            group_id='group-id',
+            enable_auto_commit=False
         )
         await consumer.start()
+        await notification_producer.start()
         try:
-            async for msg in consumer:
-                order_msg = json.loads(msg.value.decode('utf-8'))
-                user_id = order_msg['user_id']
-                order_data = order_msg['order_data']
-                async for session in get_session():
-                    current_user = await UserCrud.get_user(session, user_id=user_id)
-                mail_service = EmailService()
-                if order_msg['type'] == 'create':
-                    order = await OrderCrud.create_order(order_data, current_user, session)
-                    logger.info("Order ID=%s created by user ID=%s", order.id, current_user.id)
-                    try:
-                        notification_data = await mail_service.notify_order_creation(
-                            to_email=current_user.email,
-                            order_id=order.id,
-                            type=order_msg.get('type'),
-                        )
-                    except Exception as e:
-                        notification_data = None
-                        logger.error(f"SMTP Error: {e}")
-                else:
-                    order_id = order_data.get('id')
-                    order = await OrderCrud.update_status_order(session, order_id, order_data)
-                    logger.info("Order ID=%s status changed by user ID=%s", order_id, current_user.id)
-                    try:
-                        notification_data = await mail_service.notify_order_status_update(
-                            to_email=current_user.email,
-                            order_data=order_data,
-                            previous_status=order_msg['previous_status'],
-                            type=order_msg.get('type'),
-                        )
-                    except Exception as e:
-                        notification_data = None
-                        logger.error(f"SMTP Error: {e}")
-                if notification_data:
-                    await NotificationCrud.create_notification(session, notification_data)
+            if settings.processing_mode == 'batch':
+                await consume_batches(consumer, settings)
+            else:
+                await consume_concurrently(consumer, settings)
         except Exception as e:
             logger.error(f"Error in Kafka consumer: {e}")
         finally:
             await consumer.stop()
+            await notification_producer.stop()
+            await failed_order_events.producer.stop()
     except Exception as e:
         logger.error(f"Error in Kafka consumer: {e}")
+
+
+async def consume_order_retries():
+    """Обработчик топика повторов: события обрабатываются параллельно, каждое не раньше срока своей попытки"""
+    settings = AppSettings().kafka_consumer
+    try:
+        consumer = AIOKafkaConsumer(
+            ORDER_RETRY_TOPIC,
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id='group-id-retry',
+            enable_auto_commit=False
+        )
+        await consumer.start()
+        await notification_producer.start()
+        try:
+            await consume_concurrently(consumer, settings, pipeline='order-retries')
+        except Exception as e:
+            logger.error(f"Error in Kafka retry consumer: {e}")
+        finally:
+            await consumer.stop()
+            await notification_producer.stop()
+            await failed_order_events.producer.stop()
+    except Exception as e:
+        logger.error(f"Error in Kafka retry consumer: {e}")
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from typing import Hashable, Optional
+from prometheus_client import Counter
+from config.settings import AppSettings, KafkaConsumerSettings
+
+duplicate_order_events = Counter(
+    'kafka_consumer_duplicate_order_events_total', 'Repeated order creation events that were skipped', ['source']
+)
+
+
+class ProcessedEvents:
+    """Ключи идемпотентности недавно обработанных событий создания заказа с ограничением размера (LRU).
+    Повторно доставленное событие отбрасывается без запроса к БД, после вытеснения ключа из кэша
+    дубликат отсекается уникальным ограничением в БД"""
+
+    def __init__(self, settings: Optional[KafkaConsumerSettings] = None):
+        settings = settings or AppSettings().kafka_consumer
+        self.max_size = settings.dedup_cache_size
+        self._keys = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key not in self._keys:
+            return False
+        self._keys.move_to_end(key)
+        return True
+
+    def add(self, key: Hashable):
+        """Запоминание ключа события, записанного в БД"""
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def clear(self):
+        self._keys.clear()
+
+
+processed_events = ProcessedEvents()
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import time
+from functools import partial
+from typing import Awaitable, Callable, List
+from aiokafka import AIOKafkaConsumer
+from config.db import get_session
+from config.logger import logger
+from config.settings import AppSettings
+from crud.notification_crud import NotificationCrud
+from services.kafka.producers import OrderProducer
+from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS, NOTIFICATION_TOPIC
+from services.kafka.worker_pool import EventWorkerPool
+from services.send_mail import EmailService
+from services.smtp_pool import smtp_pool
+
+notification_producer = OrderProducer(topic=NOTIFICATION_TOPIC)
+
+
+def creation_notification_event(order_id: int, email: str) -> dict:
+    return {"type": "create", "order_id": order_id, "email": email}
+
+
+def status_notification_event(order_id: int, status: str, previous_status: str, email: str) -> dict:
+    return {
+        "type": "update",
+        "order_id": order_id,
+        "status": status,
+        "previous_status": previous_status,
+        "email": email,
+    }
+
+
+# Обязательные поля события рассылки по типу события
+NOTIFICATION_EVENT_FIELDS = {
+    'create': ('order_id', 'email'),
+    'update': ('order_id', 'email', 'status', 'previous_status'),
+}
+
+
+def decode_notification_message(msg) -> dict:
+    """Чтение события рассылки из сообщения Kafka, событие с неверной структурой отклоняется ValueError"""
+    notification_event = json.loads(msg.value.decode('utf-8'))
+    if not isinstance(notification_event, dict) or notification_event.get('type') not in NOTIFICATION_EVENT_FIELDS:
+        raise ValueError("Notification event has unknown type")
+    required = NOTIFICATION_EVENT_FIELDS[notification_event['type']]
+    missing = [field for field in required if field not in notification_event]
+    if missing:
+        raise ValueError(f"Notification event has no fields: {', '.join(missing)}")
+    return notification_event
+
+
+async def publish_notification(notification_event: dict):
+    """Передача события рассылки обработчику уведомлений через топик Kafka.
+    Если брокер недоступен, уведомление отправляется сразу, чтобы письмо не потерялось"""
+    if not await notification_producer.send(json.dumps(notification_event)):
+        await handle_notification_event(notification_event)
+
+
+async def handle_notification_event(notification_event: dict):
+    """Отправка email по событию рассылки и сохранение записи о рассылке"""
+    mail_service = EmailService()
+    try:
+        if notification_event['type'] == 'create':
+            notification_data = await mail_service.notify_order_creation(
+                to_email=notification_event['email'],
+                order_id=notification_event['order_id'],
+                type=notification_event['type'],
+            )
+        else:
+            notification_data = await mail_service.notify_order_status_update(
+                to_email=notification_event['email'],
+                order_data={"id": notification_event['order_id'], "status": notification_event['status']},
+                previous_status=notification_event['previous_status'],
+                type=notification_event['type'],
+            )
+    except Exception as e:
+        logger.error(f"SMTP Error: {e}")
+        return
+    async for session in get_session():
+        await NotificationCrud.create_notification(session, notification_data)
+
+
+class StatusDigest:
+    """Накопленные изменения статуса одного заказа для одного получателя"""
+
+    def __init__(self, notification_event: dict):
+        self.order_id = notification_event['order_id']
+        self.email = notification_event['email']
+        self.statuses = [notification_event['previous_status']]
+        self.on_flushed: List[Callable[[], Awaitable]] = []
+        self.task = None
+        self.first_added = time.monotonic()
+        self.last_added = self.first_added
+
+    def add(self, notification_event: dict, on_flushed: Callable[[], Awaitable]):
+        self.statuses.append(notification_event['status'])
+        self.on_flushed.append(on_flushed)
+        self.last_added = time.monotonic()
+
+
+class NotificationCoalescer:
+    """Объединение уведомлений об изменении статуса заказа: изменения, пришедшие с интервалом меньше window,
+    отправляются одним письмом, но не позже чем через max_delay после первого изменения"""
+
+    def __init__(self, window: float, max_delay: float, flush: Callable[[StatusDigest], Awaitable]):
+        self.window = window
+        self.max_delay = max_delay
+        self.flush = flush
+        self._digests = {}
+        self._tasks = set()
+
+    def add(self, notification_event: dict, on_flushed: Callable[[], Awaitable]):
+        """Добавление изменения статуса, on_flushed вызывается после отправки письма"""
+        key = (notification_event['email'], notification_event['order_id'])
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = StatusDigest(notification_event)
+            digest.task = asyncio.create_task(self._flush_when_quiet(key, digest))
+            self._tasks.add(digest.task)
+            digest.task.add_done_callback(self._tasks.discard)
+        digest.add(notification_event, on_flushed)
+
+    async def close(self):
+        """Немедленная отправка всех накопленных писем"""
+        digests, self._digests = list(self._digests.values()), {}
+        for digest in digests:
+            digest.task.cancel()
+        for digest in digests:
+            await self._flush(digest)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush_when_quiet(self, key, digest: StatusDigest):
+        while True:
+            deadline = min(digest.last_added + self.window, digest.first_added + self.max_delay)
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        del self._digests[key]
+        await self._flush(digest)
+
+    async def _flush(self, digest: StatusDigest):
+        try:
+            await self.flush(digest)
+        except Exception as e:
+            logger.error(f"Error in notification consumer: digest for order ID={digest.order_id} failed: {e}")
+        finally:
+            for on_flushed in digest.on_flushed:
+                await on_flushed()
+
+
+async def handle_status_digest(digest: StatusDigest):
+    """Отправка одного письма по накопленным изменениям статуса и сохранение одной записи о рассылке"""
+    if len(digest.statuses) == 2:
+        await handle_notification_event(
+            status_notification_event(digest.order_id, digest.statuses[1], digest.statuses[0], digest.email)
+        )
+        return
+    mail_service = EmailService()
+    try:
+        notification_data = await mail_service.notify_order_status_digest(
+            to_email=digest.email,
+            order_id=digest.order_id,
+            statuses=digest.statuses,
+            type='update',
+        )
+    except Exception as e:
+        logger.error(f"SMTP Error: {e}")
+        return
+    async for session in get_session():
+        await NotificationCrud.create_notification(session, notification_data)
+
+
+async def consume_notifications():
+    """Обработчик рассылок: читает события из отдельного топика и отправляет письма со своей скоростью,
+    не задерживая запись заказов"""
+    settings = AppSettings().kafka_consumer
+    try:
+        consumer = AIOKafkaConsumer(
+            NOTIFICATION_TOPIC,
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id='notification-group-id',
+            enable_auto_commit=False
+        )
+        await consumer.start()
+        pool = EventWorkerPool(
+            consumer,
+            concurrency=settings.notification_concurrency,
+            max_pending=settings.max_pending,
+            pipeline='notifications'
+        )
+        coalescer = None
+        if settings.notification_digest_window > 0:
+            coalescer = NotificationCoalescer(
+                window=settings.notification_digest_window,
+                max_delay=settings.notification_digest_max_delay,
+                flush=handle_status_digest,
+            )
+        try:
+            async for msg in consumer:
+                try:
+                    notification_event = decode_notification_message(msg)
+                except Exception as e:
+                    # Ошибка в одном событии не останавливает чтение топика: событие пропускается, смещение коммитится
+                    logger.error(
+                        f"Error in notification consumer: {msg.topic}[{msg.partition}] offset {msg.offset} skipped: {e}"
+                    )
+                    complete = await pool.track(msg)
+                    await complete()
+                    continue
+                if coalescer is not None and notification_event['type'] == 'update':
+                    coalescer.add(notification_event, await pool.track(msg))
+                    continue
+                await pool.submit(
+                    msg, notification_event['order_id'], partial(handle_notification_event, notification_event)
+                )
+        except Exception as e:
+            logger.error(f"Error in notification consumer: {e}")
+        finally:
+            if coalescer is not None:
+                await coalescer.close()
+            await pool.join()
+            await consumer.stop()
+            await smtp_pool.close()
+    except Exception as e:
+        logger.error(f"Error in notification consumer: {e}")
+
+
+if __name__ == '__main__':
+    asyncio.run(consume_notifications())
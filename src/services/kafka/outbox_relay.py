@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+from prometheus_client import Counter, Gauge
+from config.db import new_session
+from config.logger import logger
+from config.settings import AppSettings, OutboxSettings
+from crud.outbox_crud import OutboxCrud
+from services.kafka.codecs import event_codec
+from services.kafka.producers import OrderProducer, order_producer
+
+outbox_lag = Gauge('outbox_lag_seconds', 'Age of the oldest order event waiting in the outbox')
+outbox_published = Counter('outbox_published_total', 'Order events relayed from the outbox to Kafka')
+outbox_publish_failures = Counter('outbox_publish_failures_total', 'Outbox batches the broker failed to accept')
+
+
+class OutboxRelay:
+    """Передача событий из outbox в Kafka. Каждый обработчик передает свою партицию outbox (события одного заказа
+    всегда в одной партиции) пакетами по порядку id, события удаляются в той же транзакции после подтверждения брокера.
+    Пакет, который брокер не принял, отправляется повторно раньше следующих событий партиции, а ключ сообщения
+    (id заказа) направляет события заказа в одну партицию Kafka, поэтому порядок событий заказа сохраняется.
+    В outbox события хранятся в JSON, в Kafka записываются кодеком из настройки KAFKA_EVENT_CODEC
+    (JSON передается без повторного разбора).
+    Если брокер недоступен, события остаются в outbox и отправляются повторно"""
+
+    def __init__(self, producer: OrderProducer, settings: Optional[OutboxSettings] = None):
+        self.producer = producer
+        self.settings = settings or AppSettings().outbox
+
+    async def relay_batch(self, partition: int = 0) -> int:
+        """Отправка одного пакета событий партиции outbox, возвращает число отправленных событий"""
+        async with new_session() as session:
+            events = await OutboxCrud.lock_events(
+                session, self.settings.batch_size, partition, self.settings.relay_workers
+            )
+            if not events:
+                outbox_lag.set(0)
+                return 0
+            outbox_lag.set((datetime.utcnow() - events[0].created_at).total_seconds())
+            if not await self.producer.send_batch([
+                (event.topic, *event_codec.encode_json(event.payload), event.key and event.key.encode('utf-8'))
+                for event in events
+            ]):
+                outbox_publish_failures.inc()
+                await session.rollback()
+                return 0
+            await OutboxCrud.delete_events(session, [event.id for event in events])
+            await session.commit()
+        outbox_published.inc(len(events))
+        return len(events)
+
+    async def run_worker(self, partition: int):
+        """Обработчик партиции outbox: пакеты отправляются подряд, пока партиция не опустеет,
+        затем обработчик ждет poll_interval"""
+        while True:
+            try:
+                relayed = await self.relay_batch(partition)
+            except Exception as e:
+                logger.error(f"Error in outbox relay: {e}")
+                relayed = 0
+            if relayed < self.settings.batch_size:
+                await asyncio.sleep(self.settings.poll_interval)
+
+    async def run(self):
+        """Запуск обработчиков всех relay_workers партиций outbox"""
+        await asyncio.gather(*(self.run_worker(partition) for partition in range(self.settings.relay_workers)))
+
+
+outbox_relay = OutboxRelay(order_producer)
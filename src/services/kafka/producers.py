@@ -1,14 +1,159 @@
+import asyncio
+from typing import List, Optional, Tuple
 from aiokafka import AIOKafkaProducer
+from prometheus_client import Counter, Gauge
+from config.logger import logger
+from config.settings import AppSettings, KafkaProducerSettings
+from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS, ORDER_TOPIC
 
-from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS
+# Заголовки сообщения Kafka: пары (имя, значение)
+Headers = List[Tuple[str, bytes]]
+# Событие пакета: топик, данные, заголовки и ключ сообщения (события с одним ключом попадают в одну партицию)
+KeyedEvent = Tuple[str, bytes, Headers, Optional[bytes]]
 
+producer_connected = Gauge(
+    'kafka_producer_connected', 'Kafka producer connection state by topic (1 - connected to a broker)', ['topic']
+)
+producer_delivery_errors = Counter('kafka_producer_delivery_errors_total', 'Order events the broker failed to accept')
 
-async def produce_orders(data_json):
-    producer = AIOKafkaProducer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
-    await producer.start()
-    try:
-        await producer.send_and_wait(topic='order_topic', value=data_json.encode('utf-8'))
-    except Exception as e:
-        print(e)
-    finally:
-        await producer.stop()
\ No newline at end of file
+
+class OrderProducer:
+    """Общий для процесса продюсер Kafka: подключается один раз в lifespan приложения"""
+
+    def __init__(
+        self,
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        topic: str = ORDER_TOPIC,
+        settings: Optional[KafkaProducerSettings] = None
+    ):
+        self.bootstrap_servers = bootstrap_servers
+        self.topic = topic
+        self.settings = settings or AppSettings().kafka_producer
+        self._producer = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_connected(self) -> bool:
+        """Есть ли открытое соединение с брокером. Клиент Kafka сам восстанавливает соединения,
+        поэтому состояние берется из его соединений, а не из того, что продюсер однажды запустился"""
+        producer = self._producer
+        return producer is not None and any(conn.connected() for conn in producer.client._conns.values())
+
+    async def start(self):
+        """Подключение к брокеру, при недоступности брокера продюсер остается отключенным"""
+        async with self._lock:
+            if self._producer is not None:
+                return
+            # Значение метрики вычисляется при каждом сборе по текущему состоянию соединения
+            producer_connected.labels(topic=self.topic).set_function(lambda: float(self.is_connected))
+            producer = AIOKafkaProducer(
+                bootstrap_servers=self.bootstrap_servers,
+                linger_ms=self.settings.linger_ms,
+                max_batch_size=self.settings.max_batch_size,
+                compression_type=self.settings.compression_type,
+            )
+            try:
+                await producer.start()
+            except Exception as e:
+                logger.error(f"Kafka producer connection error: {e}")
+                await producer.stop()
+                return
+            self._producer = producer
+            logger.info("Kafka producer connected to %s", self.bootstrap_servers)
+
+    async def stop(self):
+        """Отправка накопленных сообщений и отключение от брокера"""
+        async with self._lock:
+            if self._producer is None:
+                return
+            producer, self._producer = self._producer, None
+            await producer.stop()
+            logger.info("Kafka producer stopped")
+
+    async def send(self, data_json: str) -> bool:
+        """Отправка события в топик с ожиданием подтверждения брокера,
+        при отключенном продюсере выполняется попытка переподключения"""
+        if self._producer is None:
+            await self.start()
+        if self._producer is None:
+            logger.error("Kafka producer is disconnected: order event was not sent")
+            return False
+        try:
+            await self._producer.send_and_wait(topic=self.topic, value=data_json.encode('utf-8'))
+        except Exception as e:
+            logger.error(f"Error in Kafka producer: {e}")
+            return False
+        return True
+
+    async def send_message(
+        self, topic: str, value: bytes, headers: Optional[Headers] = None, key: Optional[bytes] = None
+    ) -> bool:
+        """Отправка сообщения в указанный топик с заголовками и ключом с ожиданием подтверждения брокера"""
+        if self._producer is None:
+            await self.start()
+        if self._producer is None:
+            logger.error("Kafka producer is disconnected: message to %s was not sent", topic)
+            return False
+        try:
+            await self._producer.send_and_wait(topic=topic, value=value, headers=headers, key=key)
+        except Exception as e:
+            producer_delivery_errors.inc()
+            logger.error(f"Error in Kafka producer: {e}")
+            return False
+        return True
+
+    async def send_batch(self, events: List[KeyedEvent]) -> bool:
+        """Отправка пакета событий с ожиданием подтверждения брокера по каждому событию.
+        События отправляются в порядке пакета, поэтому события одного ключа записываются в партицию по порядку"""
+        if self._producer is None:
+            await self.start()
+        if self._producer is None:
+            logger.error("Kafka producer is disconnected: %s events were not sent", len(events))
+            return False
+        try:
+            deliveries = [
+                await self._producer.send(topic=topic, value=value, headers=headers, key=key)
+                for topic, value, headers, key in events
+            ]
+            await asyncio.gather(*deliveries)
+        except Exception as e:
+            producer_delivery_errors.inc()
+            logger.error(f"Error in Kafka producer: {e}")
+            return False
+        return True
+
+
+class InMemoryOrderProducer(OrderProducer):
+    """Продюсер без брокера: сохраняет события в памяти, используется в тестах"""
+
+    def __init__(self, topic: str = ORDER_TOPIC):
+        super().__init__(bootstrap_servers=None, topic=topic)
+        self.messages = []
+        self._connected = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def start(self):
+        self._connected = True
+
+    async def stop(self):
+        self._connected = False
+
+    async def send(self, data_json: str) -> bool:
+        self.messages.append(data_json)
+        return True
+
+    async def send_message(
+        self, topic: str, value: bytes, headers: Optional[Headers] = None, key: Optional[bytes] = None
+    ) -> bool:
+        self.messages.append(value)
+        return True
+
+    async def send_batch(self, events: List[KeyedEvent]) -> bool:
+        self.messages.extend(value for _, value, _, _ in events)
+        return True
+
+
+order_producer = OrderProducer()
@@ -0,0 +1,73 @@
+"""Повторная отправка событий заказов из DLQ в исходный топик после устранения причины ошибки.
+Событие отправляется с заголовками формата, но без заголовков повторов, и снова получает max_retries попыток;
+смещения DLQ коммитятся после подтверждения брокера, поэтому повторный запуск не отправляет события дважды.
+
+    PYTHONPATH=src python -m services.kafka.replay_dlq --dry-run
+    PYTHONPATH=src python -m services.kafka.replay_dlq --limit 1000
+"""
+import argparse
+import asyncio
+from typing import Optional
+from aiokafka import AIOKafkaConsumer
+from config.logger import logger
+from services.kafka.producers import OrderProducer
+from services.kafka.retry import (
+    ERROR_HEADER, FAILURE_HEADER_PREFIX, ORIGINAL_TOPIC_HEADER, RETRY_COUNT_HEADER, message_headers
+)
+from services.kafka.settings import KAFKA_BOOTSTRAP_SERVERS, ORDER_DLQ_TOPIC, ORDER_TOPIC
+
+REPLAY_GROUP_ID = 'group-id-dlq-replay'
+REPLAY_BATCH_SIZE = 500
+# Если за это время из DLQ не пришло ни одного сообщения, считается, что DLQ прочитан до конца
+REPLAY_IDLE_TIMEOUT_MS = 5000
+
+
+async def replay_dead_letters(limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """Отправка событий из DLQ в исходные топики, возвращает число обработанных событий.
+    В режиме dry_run события только выводятся, смещения DLQ не коммитятся"""
+    consumer = AIOKafkaConsumer(
+        ORDER_DLQ_TOPIC,
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=REPLAY_GROUP_ID,
+        enable_auto_commit=False,
+        auto_offset_reset='earliest'
+    )
+    producer = OrderProducer()
+    await consumer.start()
+    replayed = 0
+    try:
+        while limit is None or replayed < limit:
+            max_records = REPLAY_BATCH_SIZE if limit is None else min(REPLAY_BATCH_SIZE, limit - replayed)
+            records = await consumer.getmany(timeout_ms=REPLAY_IDLE_TIMEOUT_MS, max_records=max_records)
+            messages = [msg for partition_records in records.values() for msg in partition_records]
+            if not messages:
+                break
+            for msg in messages:
+                headers = message_headers(msg)
+                topic = headers.get(ORIGINAL_TOPIC_HEADER, ORDER_TOPIC)
+                if dry_run:
+                    print(
+                        f"{msg.partition}:{msg.offset} -> {topic} "
+                        f"retries={headers.get(RETRY_COUNT_HEADER, 0)} error={headers.get(ERROR_HEADER)}"
+                    )
+                elif not await producer.send_message(topic, msg.value, [
+                    (key, value.encode('utf-8')) for key, value in headers.items()
+                    if not key.startswith(FAILURE_HEADER_PREFIX)
+                ], key=msg.key):
+                    raise RuntimeError(f"DLQ replay stopped at {msg.partition}:{msg.offset}: broker is unavailable")
+                replayed += 1
+            if not dry_run:
+                await consumer.commit()
+    finally:
+        await consumer.stop()
+        await producer.stop()
+    logger.info("DLQ replay: %s order events %s", replayed, 'listed' if dry_run else 'replayed')
+    return replayed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--limit', type=int, default=None, help='максимальное число событий')
+    parser.add_argument('--dry-run', action='store_true', help='только вывести события, не отправляя их')
+    args = parser.parse_args()
+    print(asyncio.run(replay_dead_letters(args.limit, args.dry_run)))
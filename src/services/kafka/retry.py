@@ -0,0 +1,97 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+from prometheus_client import Counter
+from config.logger import logger
+from config.settings import AppSettings, KafkaConsumerSettings
+from exceptions import OrderNotFoundException
+from services.kafka.producers import OrderProducer
+from services.kafka.settings import ORDER_DLQ_TOPIC, ORDER_RETRY_TOPIC
+
+retried_order_events = Counter('kafka_consumer_retried_events_total', 'Order events sent to the retry topic')
+dead_letter_order_events = Counter('kafka_consumer_dead_letter_events_total', 'Order events sent to the DLQ')
+
+# Заголовки сообщений в топике повторов и DLQ
+FAILURE_HEADER_PREFIX = 'x-'
+RETRY_COUNT_HEADER = 'x-retry-count'
+NOT_BEFORE_HEADER = 'x-not-before'
+ERROR_HEADER = 'x-error'
+FAILED_AT_HEADER = 'x-failed-at'
+ORIGINAL_TOPIC_HEADER = 'x-original-topic'
+ORIGINAL_PARTITION_HEADER = 'x-original-partition'
+ORIGINAL_OFFSET_HEADER = 'x-original-offset'
+
+# Ошибки в данных события и ошибки, которые повторятся при каждой попытке (заказ удален - OrderNotFoundException,
+# пользователь не найден - AttributeError): повторная попытка не поможет, событие сразу передается в DLQ
+NON_RETRYABLE_ERRORS = (ValueError, KeyError, TypeError, AttributeError, OrderNotFoundException)
+
+
+def message_headers(msg) -> dict:
+    """Заголовки сообщения Kafka в виде словаря строк"""
+    return {key: value.decode('utf-8') for key, value in msg.headers or ()}
+
+
+def retry_due_in(msg) -> float:
+    """Сколько секунд осталось до повторной обработки события из топика повторов"""
+    not_before = message_headers(msg).get(NOT_BEFORE_HEADER)
+    if not_before is None:
+        return 0
+    return max(float(not_before) - time.time(), 0)
+
+
+class FailedEvents:
+    """Передача событий, обработка которых завершилась ошибкой, в топик повторов с экспоненциальной задержкой.
+    После max_retries попыток, а также при ошибке в данных события, оно передается в DLQ с описанием ошибки"""
+
+    def __init__(self, producer: OrderProducer, settings: Optional[KafkaConsumerSettings] = None):
+        self.producer = producer
+        self.settings = settings or AppSettings().kafka_consumer
+
+    def retry_delay(self, retries: int) -> float:
+        """Задержка перед повторной попыткой с номером retries + 1"""
+        return min(self.settings.retry_backoff * 2 ** retries, self.settings.retry_backoff_max)
+
+    async def handle(self, msg, error: Exception):
+        """Передача необработанного события в топик повторов или в DLQ"""
+        headers = message_headers(msg)
+        retries = int(headers.get(RETRY_COUNT_HEADER, 0))
+        # Заголовки формата события сохраняются, чтобы повторная попытка прочитала его тем же кодеком
+        failure = {key: value for key, value in headers.items() if not key.startswith(FAILURE_HEADER_PREFIX)}
+        failure.update({
+            ORIGINAL_TOPIC_HEADER: headers.get(ORIGINAL_TOPIC_HEADER, msg.topic),
+            ORIGINAL_PARTITION_HEADER: headers.get(ORIGINAL_PARTITION_HEADER, str(msg.partition)),
+            ORIGINAL_OFFSET_HEADER: headers.get(ORIGINAL_OFFSET_HEADER, str(msg.offset)),
+            ERROR_HEADER: f"{type(error).__name__}: {error}"[:1000],
+            FAILED_AT_HEADER: datetime.utcnow().isoformat(),
+        })
+        if isinstance(error, NON_RETRYABLE_ERRORS) or retries >= self.settings.max_retries:
+            topic = ORDER_DLQ_TOPIC
+            failure[RETRY_COUNT_HEADER] = str(retries)
+            dead_letter_order_events.inc()
+            logger.error(
+                "Order event %s[%s] offset %s moved to DLQ after %s retries: %s",
+                msg.topic, msg.partition, msg.offset, retries, failure[ERROR_HEADER]
+            )
+        else:
+            topic = ORDER_RETRY_TOPIC
+            delay = self.retry_delay(retries)
+            failure[RETRY_COUNT_HEADER] = str(retries + 1)
+            failure[NOT_BEFORE_HEADER] = str(time.time() + delay)
+            retried_order_events.inc()
+            logger.warning(
+                "Order event %s[%s] offset %s will be retried in %.1f s: %s",
+                msg.topic, msg.partition, msg.offset, delay, failure[ERROR_HEADER]
+            )
+        await self._send(
+            topic, msg.value, [(key, value.encode('utf-8')) for key, value in failure.items()], msg.key
+        )
+
+    async def _send(self, topic: str, value: bytes, headers, key: Optional[bytes] = None):
+        """Отправка повторяется до подтверждения брокера: смещение события коммитится только после передачи.
+        Ключ исходного сообщения сохраняется, чтобы повторы событий одного заказа попадали в одну партицию"""
+        while not await self.producer.send_message(topic, value, headers, key=key):
+            await asyncio.sleep(self.settings.retry_backoff)
+
+
+failed_order_events = FailedEvents(OrderProducer(topic=ORDER_RETRY_TOPIC))
@@ -0,0 +1,36 @@
+import json
+from pathlib import Path
+from typing import Dict, Tuple
+
+# Схемы событий, поставляемые с приложением
+DEFAULT_SCHEMA_DIR = Path(__file__).parent / 'schemas'
+
+
+class SchemaNotFoundError(KeyError):
+    pass
+
+
+class FileSchemaRegistry:
+    """Реестр схем событий в каталоге: один JSON-файл на версию схемы (name, version, fields).
+    Новая версия схемы добавляется отдельным файлом, старые версии остаются для чтения ранее записанных событий"""
+
+    def __init__(self, path=DEFAULT_SCHEMA_DIR):
+        self.path = Path(path)
+        self._schemas: Dict[Tuple[str, int], dict] = {}
+        self._latest: Dict[str, int] = {}
+        for schema_file in sorted(self.path.glob('*.json')):
+            schema = json.loads(schema_file.read_text(encoding='utf-8'))
+            self._schemas[schema['name'], schema['version']] = schema
+            self._latest[schema['name']] = max(self._latest.get(schema['name'], 0), schema['version'])
+
+    def get(self, name: str, version: int) -> dict:
+        try:
+            return self._schemas[name, version]
+        except KeyError:
+            raise SchemaNotFoundError(f"Schema {name} v{version} is not registered in {self.path}")
+
+    def latest(self, name: str) -> dict:
+        """Последняя версия схемы: по ней записываются новые события"""
+        if name not in self._latest:
+            raise SchemaNotFoundError(f"Schema {name} is not registered in {self.path}")
+        return self._schemas[name, self._latest[name]]
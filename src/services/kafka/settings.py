@@ -4,4 +4,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS')
-KAFKA_CONSUMER_GROUP = os.getenv('KAFKA_CONSUMER_GROUP')
\ No newline at end of file
+KAFKA_CONSUMER_GROUP = os.getenv('KAFKA_CONSUMER_GROUP')
+ORDER_TOPIC = 'order_topic'
+ORDER_RETRY_TOPIC = 'order_topic_retry'
+ORDER_DLQ_TOPIC = 'order_topic_dlq'
+NOTIFICATION_TOPIC = 'notification_topic'
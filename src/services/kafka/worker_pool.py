@@ -0,0 +1,126 @@
+import asyncio
+from collections import OrderedDict, defaultdict
+from typing import Awaitable, Callable, Hashable, Optional
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from prometheus_client import Gauge
+from config.logger import logger
+
+consumer_queue_depth = Gauge(
+    'kafka_consumer_queue_depth', 'Events fetched from Kafka but not yet processed', ['pipeline']
+)
+consumer_busy_workers = Gauge('kafka_consumer_busy_workers', 'Events being processed right now', ['pipeline'])
+consumer_worker_utilization = Gauge('kafka_consumer_worker_utilization', 'Share of busy event workers', ['pipeline'])
+
+
+class PartitionOffsets:
+    """Смещения партиции в порядке получения: коммитится только непрерывный префикс обработанных событий"""
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self.committable: Optional[int] = None
+
+    def add(self, offset: int):
+        self._pending[offset] = False
+
+    def complete(self, offset: int) -> Optional[int]:
+        """Отметка события обработанным, возвращает смещение для коммита"""
+        self._pending[offset] = True
+        while self._pending:
+            first_offset, done = next(iter(self._pending.items()))
+            if not done:
+                break
+            self._pending.popitem(last=False)
+            self.committable = first_offset + 1
+        return self.committable
+
+
+class EventWorkerPool:
+    """Параллельная обработка событий из топика Kafka.
+    События с одинаковым ключом (например, id заказа) выполняются строго по порядку, события без ключа - независимо"""
+
+    def __init__(self, consumer: AIOKafkaConsumer, concurrency: int, max_pending: int, pipeline: str = 'orders'):
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self._queue_depth = consumer_queue_depth.labels(pipeline=pipeline)
+        self._busy_workers = consumer_busy_workers.labels(pipeline=pipeline)
+        self._worker_utilization = consumer_worker_utilization.labels(pipeline=pipeline)
+        self._workers = asyncio.Semaphore(concurrency)
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._tails = {}
+        self._tasks = set()
+        self._offsets = defaultdict(PartitionOffsets)
+        self._committed = {}
+        self._commit_lock = asyncio.Lock()
+        self._busy = 0
+
+    async def submit(self, msg, key: Optional[Hashable], handler: Callable[[], Awaitable]):
+        """Постановка события в обработку, при max_pending необработанных событий ожидает освобождения места"""
+        await self._capacity.acquire()
+        tp = TopicPartition(msg.topic, msg.partition)
+        self._offsets[tp].add(msg.offset)
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(tp, msg.offset, previous, handler))
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda done, key=key: self._release_key(key, done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._queue_depth.inc()
+
+    async def track(self, msg) -> Callable[[], Awaitable]:
+        """Регистрация события, которое будет обработано вне пула.
+        Возвращает функцию, которую нужно вызвать после обработки, чтобы смещение события можно было закоммитить"""
+        await self._capacity.acquire()
+        tp = TopicPartition(msg.topic, msg.partition)
+        self._offsets[tp].add(msg.offset)
+        self._queue_depth.inc()
+
+        async def complete():
+            self._queue_depth.dec()
+            self._capacity.release()
+            await self._commit(tp, msg.offset)
+
+        return complete
+
+    async def join(self):
+        """Ожидание обработки всех полученных событий"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _release_key(self, key: Hashable, task: asyncio.Task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def _set_busy(self, delta: int):
+        self._busy += delta
+        self._busy_workers.set(self._busy)
+        self._worker_utilization.set(self._busy / self.concurrency)
+
+    async def _run(self, tp: TopicPartition, offset: int, previous: Optional[asyncio.Task], handler):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self._workers:
+                self._set_busy(1)
+                try:
+                    await handler()
+                except Exception as e:
+                    logger.error(f"Error in Kafka consumer: {tp.topic}[{tp.partition}] offset {offset}: {e}")
+                finally:
+                    self._set_busy(-1)
+        finally:
+            self._queue_depth.dec()
+            self._capacity.release()
+            await self._commit(tp, offset)
+
+    async def _commit(self, tp: TopicPartition, offset: int):
+        """Коммит смещения партиции, если обработан непрерывный префикс событий"""
+        async with self._commit_lock:
+            committable = self._offsets[tp].complete(offset)
+            if committable is None or committable <= self._committed.get(tp, -1):
+                return
+            try:
+                await self.consumer.commit({tp: committable})
+                self._committed[tp] = committable
+            except Exception as e:
+                logger.error(f"Error in Kafka consumer: commit of {tp.topic}[{tp.partition}] failed: {e}")
@@ -0,0 +1,9 @@
+from exceptions import InvalidStatusTransitionException
+from models.orders import Order, OrderStatus, ORDER_STATUS_TRANSITIONS
+
+
+def check_status_transition(order: Order, new_status: OrderStatus):
+    """Проверка изменения статуса по таблице переходов: повторная установка текущего статуса
+    и недопустимые переходы отклоняются до отправки события в Kafka"""
+    if new_status not in ORDER_STATUS_TRANSITIONS[order.status]:
+        raise InvalidStatusTransitionException(order.id, order.status, new_status)
@@ -0,0 +1,19 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Tuple
+from exceptions import InvalidCursorException
+
+
+def encode_cursor(created_at: datetime, order_id: int) -> str:
+    """Курсор постраничной выдачи: позиция последнего заказа страницы по (created_at, id)"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{order_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разбор курсора, полученного от клиента"""
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursorException(cursor)
@@ -1,35 +1,24 @@
-import os
 from email.message import EmailMessage
-from dotenv import load_dotenv
-import aiosmtplib
+from typing import List, Optional
 from fastapi import HTTPException
 from config.logger import logger
 from schemas.notification_schema import NotificationCreate
+from services.smtp_pool import SMTPConnectionPool, smtp_pool
 
-load_dotenv()
 
 class EmailService:
-    def __init__(self):
-        self.smtp_server = os.getenv("SMTP_SERVER")
-        self.smtp_port = int(os.getenv("SMTP_PORT"))
-        self.smtp_username = os.getenv("SMTP_USERNAME")
-        self.smtp_password = os.getenv("SMTP_PASSWORD")
+    def __init__(self, pool: Optional[SMTPConnectionPool] = None):
+        self.pool = pool or smtp_pool
 
     async def send_email(self, to_email: str, subject: str, message: str, logger_msg: str):
         """Отправка email."""
         msg = EmailMessage()
-        msg["From"] = self.smtp_username
+        msg["From"] = self.pool.settings.smtp_username
         msg["To"] = to_email
         msg["Subject"] = subject
         msg.set_content(message)
         try:
-            await aiosmtplib.send(
-                msg,
-                hostname=self.smtp_server,
-                port=self.smtp_port,
-                username=self.smtp_username,
-                password=self.smtp_password
-            )
+            await self.pool.send_message(msg)
             logger.info(logger_msg)
         except Exception as e:
             logger.error(f"SMTP Error: Notification sending error: {e}")
@@ -43,6 +32,14 @@ class EmailService:
         await self.send_email(to_email=to_email, subject=subject, message=message, logger_msg=logger_msg)
         return NotificationCreate(order_id=order_data.get('id'), type=type, message=message)
 
+    async def notify_order_status_digest(self, to_email: str, order_id: int, statuses: List[str], type: str):
+        """Отправка одного уведомления о нескольких изменениях статуса заказа."""
+        subject = f"Обновление статуса заказа ID={order_id}"
+        message = f"Статус заказа изменился: {' → '.join(statuses)}"
+        logger_msg = f"Digest of {len(statuses) - 1} status changes for order ID={order_id} sent"
+        await self.send_email(to_email=to_email, subject=subject, message=message, logger_msg=logger_msg)
+        return NotificationCreate(order_id=order_id, type=type, message=message)
+
     async def notify_order_creation(self, to_email: str, order_id: int, type: str):
         """Отправка уведомления о создании нового заказа."""
         subject = f"Создан новый заказ {order_id}"
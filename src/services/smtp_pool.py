@@ -0,0 +1,108 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from typing import Optional
+import aiosmtplib
+from prometheus_client import Counter, Gauge
+from config.logger import logger
+from config.settings import AppSettings, SMTPSettings
+
+smtp_open_connections = Gauge('smtp_pool_open_connections', 'Open SMTP connections in the pool')
+smtp_connects = Counter('smtp_pool_connects_total', 'New SMTP connections (connect, STARTTLS, login)')
+
+# Ошибки, после которых письмо повторно отправляется через новое соединение
+RECONNECT_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class PooledConnection:
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Пул постоянных авторизованных SMTP-соединений, общий для процесса.
+    Соединение открывается при первой отправке и переиспользуется, пока не превысит лимит писем
+    или время простоя; перед повторным использованием после простоя проверяется командой NOOP"""
+
+    def __init__(self, settings: Optional[SMTPSettings] = None):
+        self.settings = settings or AppSettings().smtp
+        self._idle = []
+        self._open = 0
+        self._slots = asyncio.Semaphore(self.settings.smtp_pool_size)
+
+    async def send_message(self, msg: EmailMessage):
+        """Отправка письма через соединение из пула, при обрыве соединения - одна повторная попытка"""
+        try:
+            async with self.connection() as client:
+                return await client.send_message(msg)
+        except RECONNECT_ERRORS as e:
+            logger.warning(f"SMTP connection lost, reconnecting: {e}")
+            async with self.connection() as client:
+                return await client.send_message(msg)
+
+    @asynccontextmanager
+    async def connection(self):
+        """Получение соединения из пула: при ошибке соединение закрывается, иначе возвращается в пул"""
+        async with self._slots:
+            pooled = await self._checkout()
+            try:
+                yield pooled.client
+            except BaseException:
+                await self._discard(pooled)
+                raise
+            pooled.sent += 1
+            pooled.last_used = time.monotonic()
+            if pooled.sent >= self.settings.smtp_pool_max_messages:
+                await self._discard(pooled)
+            else:
+                self._idle.append(pooled)
+
+    async def close(self):
+        """Закрытие всех свободных соединений"""
+        idle, self._idle = self._idle, []
+        for pooled in idle:
+            await self._discard(pooled)
+
+    async def _checkout(self) -> PooledConnection:
+        while self._idle:
+            pooled = self._idle.pop()
+            idle_for = time.monotonic() - pooled.last_used
+            if idle_for > self.settings.smtp_pool_idle_timeout or not pooled.client.is_connected:
+                await self._discard(pooled)
+                continue
+            if idle_for > self.settings.smtp_pool_health_check_after:
+                try:
+                    await pooled.client.noop()
+                except Exception as e:
+                    logger.warning(f"SMTP connection failed health check: {e}")
+                    await self._discard(pooled)
+                    continue
+            return pooled
+        return await self._connect()
+
+    async def _connect(self) -> PooledConnection:
+        client = aiosmtplib.SMTP(
+            hostname=self.settings.smtp_server,
+            port=self.settings.smtp_port,
+            username=self.settings.smtp_username,
+            password=self.settings.smtp_password,
+        )
+        await client.connect()
+        smtp_connects.inc()
+        self._open += 1
+        smtp_open_connections.set(self._open)
+        return PooledConnection(client)
+
+    async def _discard(self, pooled: PooledConnection):
+        self._open -= 1
+        smtp_open_connections.set(self._open)
+        try:
+            await pooled.client.quit()
+        except Exception:
+            pooled.client.close()
+
+
+smtp_pool = SMTPConnectionPool()
@@ -0,0 +1,15 @@
+import pytest
+from auth.token_revocations import token_revocations
+from auth.user_cache import user_cache
+from services.kafka.dedup import processed_events
+
+
+@pytest.fixture(autouse=True)
+def clear_process_state():
+    user_cache.clear()
+    token_revocations.clear()
+    processed_events.clear()
+    yield
+    user_cache.clear()
+    token_revocations.clear()
+    processed_events.clear()
@@ -0,0 +1,579 @@
+import asyncio
+import json
+import re
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from aiokafka import TopicPartition
+from sqlalchemy.dialects import postgresql
+from models.orders import Order, OrderStatus
+from models.users import User
+from schemas.notification_schema import NotificationCreate
+from schemas.order_event_schema import order_event_adapter
+from crud.order_crud import OrderCrud
+from exceptions import OrderNotFoundException, OrderStatusConflictException
+from config.settings import KafkaConsumerSettings
+from services.kafka.consumers import (
+    consume_concurrently, order_event_key, handle_order_event, handle_order_events_batch, handle_order_message
+)
+from services.kafka.retry import FailedEvents, message_headers, retry_due_in
+from services.kafka.notifications import (
+    NotificationCoalescer, consume_notifications, handle_notification_event, publish_notification,
+    status_notification_event
+)
+from services.kafka.worker_pool import EventWorkerPool, PartitionOffsets
+
+
+def make_message(offset, partition=0, value=b'{}', headers=(), topic='order_topic', key=None):
+    return SimpleNamespace(topic=topic, partition=partition, offset=offset, key=key, value=value, headers=headers)
+
+
+@pytest.fixture
+def session(mocker):
+    session = AsyncMock()
+
+    async def get_session():
+        yield session
+
+    mocker.patch('services.kafka.consumers.get_session', get_session)
+    mocker.patch('services.kafka.notifications.get_session', get_session)
+    return session
+
+
+@pytest.fixture
+def consumer():
+    consumer = MagicMock()
+    consumer.commit = AsyncMock()
+    return consumer
+
+
+class TestPartitionOffsets:
+    def test_commits_only_contiguous_offsets(self):
+        offsets = PartitionOffsets()
+        for offset in (10, 11, 12):
+            offsets.add(offset)
+        assert offsets.complete(11) is None
+        assert offsets.complete(10) == 12
+        assert offsets.complete(12) == 13
+
+
+class TestOrderEventKey:
+    def test_key_is_order_id_for_update(self):
+        assert order_event_key(order_event_adapter.validate_python({
+            "type": "update", "user_id": 1, "order_data": {"id": 5, "status": "done"}, "previous_status": "pending"
+        })) == 5
+
+    def test_create_has_no_key(self):
+        assert order_event_key(order_event_adapter.validate_python({
+            "type": "create", "user_id": 1, "order_data": {"title": "Test", "status": "pending", "price": 1.0}
+        })) is None
+
+
+@pytest.mark.asyncio
+class TestEventWorkerPool:
+    async def test_same_key_runs_in_order(self, consumer):
+        pool = EventWorkerPool(consumer, concurrency=4, max_pending=10)
+        processed = []
+
+        async def handler(name, delay):
+            await asyncio.sleep(delay)
+            processed.append(name)
+
+        await pool.submit(make_message(0), 1, lambda: handler('first', 0.02))
+        await pool.submit(make_message(1), 1, lambda: handler('second', 0))
+        await pool.join()
+
+        assert processed == ['first', 'second']
+
+    async def test_different_keys_run_concurrently(self, consumer):
+        pool = EventWorkerPool(consumer, concurrency=2, max_pending=10)
+        processed = []
+
+        async def handler(name, delay):
+            await asyncio.sleep(delay)
+            processed.append(name)
+
+        await pool.submit(make_message(0), 1, lambda: handler('slow', 0.02))
+        await pool.submit(make_message(1), 2, lambda: handler('fast', 0))
+        await pool.join()
+
+        assert processed == ['fast', 'slow']
+
+    async def test_commit_waits_for_unfinished_offsets(self, consumer):
+        pool = EventWorkerPool(consumer, concurrency=2, max_pending=10)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        await pool.submit(make_message(0), 1, blocked)
+        await pool.submit(make_message(1), 2, AsyncMock())
+        await asyncio.sleep(0.01)
+        consumer.commit.assert_not_called()
+
+        release.set()
+        await pool.join()
+        consumer.commit.assert_awaited_once_with({TopicPartition('order_topic', 0): 2})
+
+    async def test_tracked_event_blocks_commit_until_complete(self, consumer):
+        pool = EventWorkerPool(consumer, concurrency=2, max_pending=10)
+
+        complete = await pool.track(make_message(0))
+        await pool.submit(make_message(1), None, AsyncMock())
+        await pool.join()
+        consumer.commit.assert_not_called()
+
+        await complete()
+        consumer.commit.assert_awaited_once_with({TopicPartition('order_topic', 0): 2})
+
+    async def test_failed_event_does_not_stop_pool(self, consumer):
+        pool = EventWorkerPool(consumer, concurrency=1, max_pending=10)
+        handler = AsyncMock()
+
+        await pool.submit(make_message(0), 1, AsyncMock(side_effect=Exception("DB error")))
+        await pool.submit(make_message(1), 1, handler)
+        await pool.join()
+
+        handler.assert_awaited_once()
+        consumer.commit.assert_awaited_with({TopicPartition('order_topic', 0): 2})
+
+
+@pytest.mark.asyncio
+class TestHandleOrderEventsBatch:
+    order_msgs = [order_event_adapter.validate_python(order_msg) for order_msg in (
+        {"type": "create", "user_id": 1, "order_data": {"title": "Test 1", "status": "pending", "price": 1.0}},
+        {"type": "create", "user_id": 1, "order_data": {"title": "Test 2", "status": "pending", "price": 2.0}},
+        {"type": "update", "user_id": 1, "order_data": {"id": 7, "status": "done"}, "previous_status": "pending"},
+    )]
+
+    async def test_batch_written_with_single_commit(self, mocker, session):
+        user = User(id=1, username="user1", email="user1@mail.com")
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', return_value={1: user})
+        bulk_create = mocker.patch(
+            'crud.order_crud.OrderCrud.bulk_create_orders',
+            return_value=[Order(id=10, user_id=1), Order(id=11, user_id=1)]
+        )
+        bulk_update = mocker.patch('crud.order_crud.OrderCrud.bulk_update_status_orders', return_value=[(7, "done")])
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+        handle_order_event = mocker.patch('services.kafka.consumers.handle_order_event')
+
+        await handle_order_events_batch(self.order_msgs)
+
+        bulk_create.assert_awaited_once()
+        assert len(bulk_create.call_args.args[1]) == 2
+        bulk_update.assert_awaited_once_with(session, [{"id": 7, "status": "done"}], check_transitions=True)
+        session.commit.assert_awaited_once()
+        assert [call.args[0]['order_id'] for call in publish.await_args_list] == [10, 11, 7]
+        handle_order_event.assert_not_called()
+
+    async def test_conflicting_status_change_not_notified(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', return_value={1: User(id=1, email="user1@mail.com")})
+        mocker.patch('crud.order_crud.OrderCrud.bulk_create_orders', return_value=[Order(id=10), Order(id=11)])
+        mocker.patch('crud.order_crud.OrderCrud.bulk_update_status_orders', return_value=[])
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        await handle_order_events_batch(self.order_msgs)
+
+        assert [call.args[0]['order_id'] for call in publish.await_args_list] == [10, 11]
+
+    async def test_notification_error_after_commit_not_raised(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', return_value={1: User(id=1, email="user1@mail.com")})
+        mocker.patch('crud.order_crud.OrderCrud.bulk_create_orders', return_value=[Order(id=10), Order(id=11)])
+        mocker.patch('crud.order_crud.OrderCrud.bulk_update_status_orders', return_value=[(7, "done")])
+        publish = mocker.patch(
+            'services.kafka.consumers.publish_notification', side_effect=[None, Exception("DB error"), None]
+        )
+        handle_order_event = mocker.patch('services.kafka.consumers.handle_order_event')
+
+        await handle_order_events_batch(self.order_msgs)
+
+        session.commit.assert_awaited_once()
+        assert publish.await_count == 3
+        handle_order_event.assert_not_called()
+
+    async def test_failed_batch_processed_one_by_one(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', return_value={1: User(id=1)})
+        mocker.patch('crud.order_crud.OrderCrud.bulk_create_orders', side_effect=Exception("DB error"))
+        handle_order_event = mocker.patch(
+            'services.kafka.consumers.handle_order_event',
+            side_effect=[None, Exception("DB error"), None]
+        )
+
+        await handle_order_events_batch(self.order_msgs)
+
+        session.rollback.assert_awaited_once()
+        assert handle_order_event.await_count == len(self.order_msgs)
+
+    async def test_repeated_creation_events_skipped(self, mocker, session):
+        order_msg = order_event_adapter.validate_python({
+            "type": "create", "user_id": 1, "idempotency_key": "order-1",
+            "order_data": {"title": "Test", "status": "pending", "price": 1.0},
+        })
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', return_value={1: User(id=1, email="user1@mail.com")})
+        bulk_create = mocker.patch('crud.order_crud.OrderCrud.bulk_create_orders', return_value=[Order(id=10)])
+        mocker.patch('crud.order_crud.OrderCrud.bulk_update_status_orders', return_value=[])
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        await handle_order_events_batch([order_msg, order_msg])
+        await handle_order_events_batch([order_msg])
+
+        first_batch, second_batch = [call.args[1] for call in bulk_create.await_args_list]
+        assert [key for _, _, key in first_batch] == ["order-1"]
+        assert second_batch == []
+        assert publish.await_count == 1
+
+
+@pytest.mark.asyncio
+class TestHandleOrderEvent:
+    order_msg = order_event_adapter.validate_python(
+        {"type": "update", "user_id": 1, "order_data": {"id": 7, "status": "done"}, "previous_status": "pending"}
+    )
+
+    async def test_status_changed_with_transition_check(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_user', return_value=User(id=1, email="user1@mail.com"))
+        update_status = mocker.patch('crud.order_crud.OrderCrud.update_status_order')
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        await handle_order_event(self.order_msg)
+
+        update_status.assert_awaited_once_with(session, 7, {"id": 7, "status": "done"}, check_transition=True)
+        publish.assert_awaited_once()
+        assert publish.call_args.args[0]['previous_status'] == "pending"
+
+    async def test_queued_status_changes_of_one_order_applied(self, mocker, session):
+        """Оба события изменения статуса приняты, пока заказ в БД еще pending, и несут previous_status=pending"""
+        order = Order(id=7, status=OrderStatus.pending)
+
+        async def execute_update(query):
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+            allowed = re.search(r"orders\.status IN \(([^)]*)\)", sql).group(1)
+            new_status = re.search(r"SET status='(\w+)'", sql).group(1)
+            updated = f"'{order.status.value}'" in allowed.split(', ')
+            if updated:
+                order.status = OrderStatus(new_status)
+            return MagicMock(**{'first.return_value': order if updated else None})
+
+        session.scalars.side_effect = execute_update
+        mocker.patch('crud.user_crud.UserCrud.get_user', return_value=User(id=1, email="user1@mail.com"))
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        for status in ("in_progress", "done"):
+            await handle_order_event(order_event_adapter.validate_python({
+                "type": "update", "user_id": 1, "order_data": {"id": 7, "status": status}, "previous_status": "pending"
+            }))
+
+        assert order.status == OrderStatus.done
+        assert publish.await_count == 2
+
+    async def test_concurrent_change_skipped(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_user', return_value=User(id=1, email="user1@mail.com"))
+        mocker.patch('crud.order_crud.OrderCrud.update_status_order', side_effect=OrderStatusConflictException(7))
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        await handle_order_event(self.order_msg)
+
+        publish.assert_not_called()
+
+    async def test_repeated_creation_event_not_notified(self, mocker, session):
+        order_msg = order_event_adapter.validate_python({
+            "type": "create", "user_id": 1, "idempotency_key": "order-1",
+            "order_data": {"title": "Test", "status": "pending", "price": 1.0},
+        })
+        mocker.patch('crud.user_crud.UserCrud.get_user', return_value=User(id=1, email="user1@mail.com"))
+        create_order = mocker.patch('crud.order_crud.OrderCrud.create_order', return_value=None)
+        publish = mocker.patch('services.kafka.consumers.publish_notification')
+
+        await handle_order_event(order_msg)
+        await handle_order_event(order_msg)
+
+        create_order.assert_awaited_once()
+        assert create_order.call_args.kwargs['idempotency_key'] == "order-1"
+        publish.assert_not_called()
+
+    async def test_update_conflict_detected_in_single_statement(self):
+        session = AsyncMock()
+        session.scalars.return_value = MagicMock(**{'first.return_value': None})
+        session.scalar.return_value = 7
+        with pytest.raises(OrderStatusConflictException):
+            await OrderCrud.update_status_order(session, 7, {"status": "done"}, check_transition=True)
+        session.scalar.return_value = None
+        with pytest.raises(OrderNotFoundException):
+            await OrderCrud.update_status_order(session, 7, {"status": "done"}, check_transition=True)
+        session.commit.assert_not_called()
+
+    async def test_batch_update_checks_transitions(self):
+        session = AsyncMock()
+        session.execute.return_value = MagicMock()
+        await OrderCrud.bulk_update_status_orders(
+            session, [{"id": 7, "status": "in_progress"}, {"id": 7, "status": "done"}], check_transitions=True
+        )
+        sql = str(session.execute.call_args.args[0].compile(
+            dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}
+        ))
+        assert "orders.status IN ('pending', 'in_progress')" in sql
+        assert "'in_progress'" not in sql.split('VALUES')[1].split(')')[0]
+
+    async def test_update_returns_updated_order(self):
+        order = Order(id=7, status="done", version=2)
+        session = AsyncMock()
+        session.scalars.return_value = MagicMock(**{'first.return_value': order})
+        assert await OrderCrud.update_status_order(session, 7, {"status": "done"}, expected_version=1) is order
+        session.scalars.assert_awaited_once()
+        session.commit.assert_awaited_once()
+        session.refresh.assert_not_called()
+
+
+@pytest.fixture
+def failed_events():
+    producer = MagicMock()
+    producer.send_message = AsyncMock(return_value=True)
+    return FailedEvents(producer, KafkaConsumerSettings(max_retries=2, retry_backoff=1, retry_backoff_max=3))
+
+
+@pytest.mark.asyncio
+class TestFailedEvents:
+    order_value = (
+        b'{"type": "update", "user_id": 1, "order_data": {"id": 7, "status": "done"}, "previous_status": "pending"}'
+    )
+
+    async def test_failed_event_sent_to_retry_topic(self, failed_events):
+        await failed_events.handle(make_message(5, value=self.order_value), Exception("DB unavailable"))
+
+        topic, value, headers = failed_events.producer.send_message.call_args.args
+        retry_msg = make_message(0, value=value, headers=headers, topic=topic)
+        assert topic == 'order_topic_retry'
+        assert value == self.order_value
+        assert message_headers(retry_msg)['x-retry-count'] == '1'
+        assert message_headers(retry_msg)['x-original-offset'] == '5'
+        assert 0 < retry_due_in(retry_msg) <= 1
+
+    async def test_retry_keeps_message_key(self, failed_events):
+        await failed_events.handle(make_message(5, value=self.order_value, key=b'7'), Exception("DB unavailable"))
+
+        assert failed_events.producer.send_message.call_args.kwargs['key'] == b'7'
+
+    async def test_retry_keeps_event_format_headers(self, failed_events):
+        headers = [('content-type', b'application/msgpack'), ('event-version', b'1')]
+        await failed_events.handle(make_message(5, headers=headers), Exception("DB unavailable"))
+
+        retry_headers = dict(failed_events.producer.send_message.call_args.args[2])
+        assert retry_headers['content-type'] == b'application/msgpack'
+        assert retry_headers['event-version'] == b'1'
+
+    async def test_backoff_grows_exponentially_up_to_max(self, failed_events):
+        assert [failed_events.retry_delay(retries) for retries in range(4)] == [1, 2, 3, 3]
+
+    async def test_event_moved_to_dlq_after_max_retries(self, failed_events):
+        headers = [('x-retry-count', b'2'), ('x-original-topic', b'order_topic'), ('x-original-offset', b'5')]
+        msg = make_message(0, value=self.order_value, headers=headers, topic='order_topic_retry')
+        await failed_events.handle(msg, Exception("DB unavailable"))
+
+        topic, value, headers = failed_events.producer.send_message.call_args.args
+        dead_letter = message_headers(make_message(0, headers=headers))
+        assert topic == 'order_topic_dlq'
+        assert dead_letter['x-original-topic'] == 'order_topic'
+        assert dead_letter['x-original-offset'] == '5'
+        assert dead_letter['x-error'] == 'Exception: DB unavailable'
+
+    async def test_malformed_event_moved_to_dlq_without_retries(self, mocker, failed_events):
+        handle_event = mocker.patch('services.kafka.consumers.handle_order_event')
+
+        await handle_order_message(make_message(5, value=b'not json'), failed_events)
+
+        handle_event.assert_not_called()
+        assert failed_events.producer.send_message.call_args.args[0] == 'order_topic_dlq'
+
+    @pytest.mark.parametrize('value', [
+        b'{"type": "update", "user_id": "1", "order_data": {"id": 7, "status": "done"}, "previous_status": "pending"}',
+        b'{"type": "update", "user_id": 1, "order_data": {"id": 7, "status": "closed"}, "previous_status": "pending"}',
+        b'{"type": "create", "user_id": 1, "order_data": {"title": "Test", "status": "pending", "price": -1}}',
+        b'{"type": "delete", "user_id": 1}',
+    ])
+    async def test_invalid_event_rejected_before_db(self, mocker, session, failed_events, value):
+        get_user = mocker.patch('crud.user_crud.UserCrud.get_user')
+
+        await handle_order_message(make_message(5, value=value), failed_events)
+
+        get_user.assert_not_called()
+        session.commit.assert_not_called()
+        topic, _, headers = failed_events.producer.send_message.call_args.args
+        assert topic == 'order_topic_dlq'
+        assert message_headers(make_message(0, headers=headers))['x-error'].startswith('ValidationError')
+
+    @pytest.mark.parametrize('error', [OrderNotFoundException(7), AttributeError("'NoneType' object has no attribute")])
+    async def test_permanent_errors_moved_to_dlq_without_retries(self, failed_events, error):
+        await failed_events.handle(make_message(5, value=self.order_value), error)
+
+        assert failed_events.producer.send_message.call_args.args[0] == 'order_topic_dlq'
+
+    async def test_retry_not_due_does_not_take_worker(self, mocker):
+        not_before = [('x-not-before', str(time.time() + 300).encode())]
+        messages = [
+            make_message(1, partition=0, headers=not_before, topic='order_topic_retry'),
+            make_message(2, partition=0, topic='order_topic_retry'),
+            make_message(1, partition=1, topic='order_topic_retry'),
+        ]
+        paused = set()
+        consumer = MagicMock()
+        consumer.commit = AsyncMock()
+        consumer.paused.side_effect = lambda: paused
+        consumer.pause.side_effect = paused.add
+        consumer.__aiter__.return_value = messages
+        handle = mocker.patch('services.kafka.consumers.handle_order_message')
+
+        await consume_concurrently(consumer, KafkaConsumerSettings(concurrency=1, max_pending=1), 'order-retries')
+
+        tp = TopicPartition('order_topic_retry', 0)
+        consumer.pause.assert_called_once_with(tp)
+        consumer.seek.assert_called_once_with(tp, 1)
+        assert [call.args[0] for call in handle.await_args_list] == [messages[2]]
+
+    async def test_failed_event_does_not_raise(self, mocker, failed_events):
+        mocker.patch('services.kafka.consumers.handle_order_event', side_effect=Exception("DB unavailable"))
+
+        await handle_order_message(make_message(5, value=self.order_value), failed_events)
+
+        assert failed_events.producer.send_message.call_args.args[0] == 'order_topic_retry'
+
+    async def test_notification_error_after_commit_not_retried(self, mocker, session, failed_events):
+        value = b'{"type": "create", "user_id": 1, "order_data": {"title": "Test", "status": "pending", "price": 1.0}}'
+        mocker.patch('crud.user_crud.UserCrud.get_user', return_value=User(id=1, email="user1@mail.com"))
+        create_order = mocker.patch('crud.order_crud.OrderCrud.create_order', return_value=Order(id=10))
+        mocker.patch('services.kafka.consumers.publish_notification', side_effect=Exception("DB error"))
+
+        await handle_order_message(make_message(5, value=value), failed_events)
+
+        create_order.assert_awaited_once()
+        failed_events.producer.send_message.assert_not_called()
+
+    async def test_send_repeated_until_broker_accepts(self, mocker, failed_events):
+        mocker.patch('services.kafka.retry.asyncio.sleep')
+        failed_events.producer.send_message.side_effect = [False, False, True]
+
+        await failed_events.handle(make_message(5, value=self.order_value), Exception("DB unavailable"))
+
+        assert failed_events.producer.send_message.await_count == 3
+
+    async def test_failed_batch_events_reported(self, mocker, session):
+        mocker.patch('crud.user_crud.UserCrud.get_users_by_ids', side_effect=Exception("DB error"))
+        mocker.patch('services.kafka.consumers.handle_order_event', side_effect=[None, Exception("DB error")])
+        on_failure = AsyncMock()
+
+        await handle_order_events_batch(TestHandleOrderEventsBatch.order_msgs[:2], on_failure=on_failure)
+
+        on_failure.assert_awaited_once()
+        assert on_failure.call_args.args[0] == 1
+
+
+@pytest.mark.asyncio
+class TestNotifications:
+    notification_event = status_notification_event(7, "done", "pending", "user1@mail.com")
+
+    async def test_publish_sends_to_notification_topic(self, mocker):
+        send = mocker.patch('services.kafka.notifications.notification_producer.send', return_value=True)
+        handle = mocker.patch('services.kafka.notifications.handle_notification_event')
+
+        await publish_notification(self.notification_event)
+
+        send.assert_awaited_once()
+        handle.assert_not_called()
+
+    async def test_publish_falls_back_to_inline_delivery(self, mocker):
+        mocker.patch('services.kafka.notifications.notification_producer.send', return_value=False)
+        handle = mocker.patch('services.kafka.notifications.handle_notification_event')
+
+        await publish_notification(self.notification_event)
+
+        handle.assert_awaited_once_with(self.notification_event)
+
+    async def test_handle_notification_event_saves_notification(self, mocker, session):
+        notification_data = NotificationCreate(order_id=7, type='update', message="Статус заказа изменился")
+        notify = mocker.patch(
+            'services.send_mail.EmailService.notify_order_status_update', return_value=notification_data
+        )
+        create_notification = mocker.patch('crud.notification_crud.NotificationCrud.create_notification')
+
+        await handle_notification_event(self.notification_event)
+
+        notify.assert_awaited_once_with(
+            to_email="user1@mail.com",
+            order_data={"id": 7, "status": "done"},
+            previous_status="pending",
+            type="update",
+        )
+        create_notification.assert_awaited_once_with(session, notification_data)
+
+    async def test_handle_notification_event_smtp_error(self, mocker, session):
+        mocker.patch('services.send_mail.EmailService.notify_order_status_update', side_effect=Exception("SMTP Error"))
+        create_notification = mocker.patch('crud.notification_crud.NotificationCrud.create_notification')
+
+        await handle_notification_event(self.notification_event)
+
+        create_notification.assert_not_called()
+
+    async def test_malformed_event_skipped_without_stopping_consumer(self, mocker):
+        messages = [
+            make_message(0, value=b'not json', topic='notification_topic'),
+            make_message(1, value=b'{"type": "update", "order_id": 7}', topic='notification_topic'),
+            make_message(2, value=json.dumps(self.notification_event).encode('utf-8'), topic='notification_topic'),
+        ]
+
+        async def iterate():
+            for msg in messages:
+                yield msg
+
+        kafka_consumer = MagicMock(start=AsyncMock(), stop=AsyncMock(), commit=AsyncMock())
+        kafka_consumer.__aiter__ = lambda self: iterate()
+        mocker.patch('services.kafka.notifications.AIOKafkaConsumer', return_value=kafka_consumer)
+        mocker.patch('services.kafka.notifications.AppSettings', return_value=SimpleNamespace(
+            kafka_consumer=KafkaConsumerSettings(notification_digest_window=0)
+        ))
+        mocker.patch('services.kafka.notifications.smtp_pool.close', new=AsyncMock())
+        handle = mocker.patch('services.kafka.notifications.handle_notification_event')
+
+        await consume_notifications()
+
+        handle.assert_awaited_once_with(self.notification_event)
+        committed = [next(iter(call.args[0].values())) for call in kafka_consumer.commit.await_args_list]
+        assert max(committed) == 3
+
+
+@pytest.mark.asyncio
+class TestNotificationCoalescer:
+    async def test_burst_of_updates_sent_as_one_digest(self):
+        flush = AsyncMock()
+        on_flushed = AsyncMock()
+        coalescer = NotificationCoalescer(window=0.05, max_delay=1, flush=flush)
+
+        coalescer.add(status_notification_event(7, "in_progress", "pending", "user1@mail.com"), on_flushed)
+        coalescer.add(status_notification_event(7, "done", "in_progress", "user1@mail.com"), on_flushed)
+        coalescer.add(status_notification_event(8, "done", "pending", "user1@mail.com"), on_flushed)
+        await asyncio.sleep(0.1)
+
+        assert sorted(call.args[0].statuses for call in flush.await_args_list) == [
+            ["pending", "done"], ["pending", "in_progress", "done"]
+        ]
+        assert on_flushed.await_count == 3
+
+    async def test_max_delay_caps_digest(self):
+        flush = AsyncMock()
+        coalescer = NotificationCoalescer(window=0.05, max_delay=0.1, flush=flush)
+
+        for status in ("in_progress", "done", "pending", "in_progress"):
+            coalescer.add(status_notification_event(7, status, "pending", "user1@mail.com"), AsyncMock())
+            await asyncio.sleep(0.04)
+        await asyncio.sleep(0.1)
+
+        assert flush.await_count == 2
+
+    async def test_close_flushes_pending_digests(self):
+        flush = AsyncMock()
+        on_flushed = AsyncMock()
+        coalescer = NotificationCoalescer(window=10, max_delay=60, flush=flush)
+
+        coalescer.add(status_notification_event(7, "done", "pending", "user1@mail.com"), on_flushed)
+        await coalescer.close()
+
+        flush.assert_awaited_once()
+        on_flushed.assert_awaited_once()
@@ -1,15 +1,34 @@
+import json
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
 import pytest
 from httpx import AsyncClient, ASGITransport
-from exceptions import JSONSerializationError
+from sqlalchemy.dialects import postgresql
+from auth.token_revocations import token_revocations
+from crud.order_crud import OrderCrud
+from crud.outbox_crud import OutboxCrud
 from main import app
 from models.orders import Order, OrderStatus
 from schemas.order_schema import OrderCreate, OrderUpdateStatus
+from services.kafka.producers import InMemoryOrderProducer
+from services.pagination import decode_cursor, encode_cursor
 from test.test_user import get_access_token_and_user, get_access_token_and_superuser
 
 
+@pytest.fixture
+def outbox(mocker):
+    events = []
+
+    async def add_event(session, topic, payload, key=None):
+        events.append(payload)
+
+    mocker.patch.object(OutboxCrud, 'add_event', side_effect=add_event)
+    return events
+
+
 @pytest.mark.asyncio
 class TestOrderCreate:
-    async def test_create_order_success(self, mocker, get_access_token_and_user):
+    async def test_create_order_success(self, mocker, get_access_token_and_user, outbox):
         mock_user = get_access_token_and_user[1]
         order_data = OrderCreate(
             title="Test",
@@ -20,7 +39,6 @@ class TestOrderCreate:
 
         mocker.patch('auth.oauth2.get_user_by_token', return_value=mock_user)
         mocker.patch('crud.order_crud.OrderCrud.create_order', return_value=order)
-        produce_mock = mocker.patch('services.kafka.producers.produce_orders')
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
             response = await client.post(
                 "/v1/api/orders/create/",
@@ -29,10 +47,23 @@ class TestOrderCreate:
             )
 
         assert response.status_code == 200
-        try:
-            produce_mock.assert_called_once()
-        except AssertionError as e:
-            print("Ошибка при проверке вызова produce_notification:", e)
+        assert len(outbox) == 1
+        event = json.loads(outbox[0])
+        assert event['type'] == 'create'
+        assert event['user_id'] == mock_user.id
+
+    async def test_create_order_idempotency_key_carried_in_event(self, get_access_token_and_user, outbox):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/v1/api/orders/create/",
+                json={"title": "Test", "price": 1.0},
+                headers={
+                    "Authorization": f"Bearer {get_access_token_and_user[0]}",
+                    "Idempotency-Key": "order-1",
+                }
+            )
+        assert response.status_code == 200
+        assert json.loads(outbox[0])['idempotency_key'] == "order-1"
 
     async def test_create_order_unauthorized(self):
         order_data = OrderCreate(
@@ -48,29 +79,58 @@ class TestOrderCreate:
 
         assert response.status_code == 401
 
-    async def test_create_order_json_serialization_error(self, mocker, get_access_token_and_user):
+    async def test_create_order_outbox_write_error(self, mocker, get_access_token_and_user, outbox):
         mock_user = get_access_token_and_user[1]
         order_data = OrderCreate(
             title="Test",
             price=1.0,
             status=OrderStatus.pending
         )
-        order = Order(id=1, title=order_data.title,  price=order_data.price, status=order_data.status)
 
         mocker.patch('auth.oauth2.get_user_by_token', return_value=mock_user)
-        mocker.patch('crud.order_crud.OrderCrud.create_order', return_value=order)
-        produce_mock = mocker.patch('services.kafka.producers.produce_orders',side_effect=JSONSerializationError("Serialization failed"))
-        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        produce_mock = mocker.patch.object(OutboxCrud, 'add_event', side_effect=Exception("DB unavailable"))
+        transport = ASGITransport(app=app, raise_app_exceptions=False)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
             response = await client.post(
                 "/v1/api/orders/create/",
                 json=order_data.model_dump(),
                 headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
             )
-        assert response.status_code == 200
-        try:
-            produce_mock.assert_called_once()
-        except AssertionError as e:
-            print("Ошибка при проверке вызова produce_notification:", e)
+        assert response.status_code == 500
+        produce_mock.assert_called_once()
+
+    async def test_create_order_event_serialization_error(self, mocker, get_access_token_and_user, outbox):
+        mocker.patch('auth.oauth2.get_user_by_token', return_value=get_access_token_and_user[1])
+        mocker.patch('routers.order_routers.OrderCreatedEvent', side_effect=ValueError("Serialization failed"))
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/v1/api/orders/create/",
+                json={"title": "Test", "price": 1.0},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 400
+        assert outbox == []
+
+
+    async def test_create_order_single_round_trip(self, get_access_token_and_user):
+        mock_user = get_access_token_and_user[1]
+        session = AsyncMock()
+        session.scalar.return_value = Order(id=1, title="Test", price=1.0, user_id=mock_user.id)
+        order = await OrderCrud.create_order({"title": "Test", "price": 1.0}, mock_user, session)
+        assert order.id == 1
+        assert "RETURNING" in str(session.scalar.call_args.args[0])
+        session.refresh.assert_not_called()
+        session.commit.assert_awaited_once()
+
+    async def test_create_order_ignores_repeated_idempotency_key(self, get_access_token_and_user):
+        session = AsyncMock()
+        session.scalar.return_value = None
+        order = await OrderCrud.create_order(
+            {"title": "Test", "price": 1.0}, get_access_token_and_user[1], session, idempotency_key="order-1"
+        )
+        assert order is None
+        query = str(session.scalar.call_args.args[0].compile(dialect=postgresql.dialect()))
+        assert "ON CONFLICT ON CONSTRAINT uq_orders_user_id_idempotency_key DO NOTHING" in query
 
 
 @pytest.mark.asyncio
@@ -112,6 +172,54 @@ class TestGetOrders:
         assert response_data[1]['title'] == orders_list[1].title
         assert response.status_code == 200
 
+    async def test_get_orders_next_page_cursor(self, mocker, get_access_token_and_user):
+        mock_user = get_access_token_and_user[1]
+        orders_list = [
+            Order(id=3, user_id=mock_user.id, title="Test 3", status=OrderStatus.pending, price=1.0,
+                  created_at=datetime(2024, 11, 3)),
+            Order(id=2, user_id=mock_user.id, title="Test 2", status=OrderStatus.pending, price=1.0,
+                  created_at=datetime(2024, 11, 2)),
+            Order(id=1, user_id=mock_user.id, title="Test 1", status=OrderStatus.pending, price=1.0,
+                  created_at=datetime(2024, 11, 1)),
+        ]
+        get_all_orders = mocker.patch('crud.order_crud.OrderCrud.get_all_orders', return_value=orders_list)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/",
+                params={"limit": 2, "status": "pending", "price_min": 1},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 200
+        assert [order['id'] for order in response.json()] == [3, 2]
+        assert decode_cursor(response.headers['X-Next-Cursor']) == (datetime(2024, 11, 2), 2)
+        filters = get_all_orders.call_args.args[2]
+        assert filters.status == OrderStatus.pending
+        assert filters.price_min == 1
+        assert get_all_orders.call_args.kwargs['limit'] == 3
+
+    async def test_get_orders_from_cursor(self, mocker, get_access_token_and_user):
+        get_all_orders = mocker.patch('crud.order_crud.OrderCrud.get_all_orders', return_value=[])
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/",
+                params={"cursor": encode_cursor(datetime(2024, 11, 2), 2), "limit": 100000},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 200
+        assert 'X-Next-Cursor' not in response.headers
+        assert get_all_orders.call_args.kwargs['after'] == (datetime(2024, 11, 2), 2)
+        assert get_all_orders.call_args.kwargs['limit'] == 501
+
+    async def test_get_orders_invalid_cursor(self, get_access_token_and_user):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/",
+                params={"cursor": "invalid"},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Bad request: Invalid pagination cursor"}
+
     async def test_get_orders_unauthorized(self):
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
             response = await client.get(
@@ -119,17 +227,95 @@ class TestGetOrders:
             )
         assert response.status_code == 401
 
+    async def test_get_orders_authorized_from_claims(self, mocker, get_access_token_and_user):
+        token_revocations.load({}, [])
+        get_user = mocker.patch('crud.user_crud.UserCrud.get_user')
+        get_all_orders = mocker.patch('crud.order_crud.OrderCrud.get_all_orders', return_value=[])
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/",
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 200
+        get_user.assert_not_called()
+        current_user = get_all_orders.call_args.args[1]
+        assert (current_user.id, current_user.is_superuser) == (1, False)
+
+    async def test_get_orders_revoked_token(self, mocker, get_access_token_and_user):
+        token_revocations.load({1: 1}, [])
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/",
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+class TestExportOrders:
+    orders_chunks = [
+        [Order(id=1, user_id=1, title="Test 1", status=OrderStatus.pending, price=1.0,
+               created_at=datetime(2024, 11, 1))],
+        [Order(id=2, user_id=2, title="Test, 2", status=OrderStatus.done, price=2.5,
+               created_at=datetime(2024, 11, 2))],
+    ]
+
+    def mock_stream_orders(self, mocker):
+        async def stream_orders(session, current_user, filters=None, chunk_size=1000):
+            for orders in self.orders_chunks:
+                yield orders
+
+        return mocker.patch('crud.order_crud.OrderCrud.stream_orders', side_effect=stream_orders)
+
+    async def test_export_ndjson(self, mocker, get_access_token_and_superuser):
+        stream_orders = self.mock_stream_orders(mocker)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/export/",
+                params={"status": "done"},
+                headers={"Authorization": f"Bearer {get_access_token_and_superuser[0]}"}
+            )
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row['id'] for row in rows] == [1, 2]
+        assert rows[0]['created_at'] == '2024-11-01T00:00:00'
+        assert stream_orders.call_args.args[2].status == OrderStatus.done
+
+    async def test_export_csv(self, mocker, get_access_token_and_superuser):
+        self.mock_stream_orders(mocker)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/export/",
+                params={"format": "csv"},
+                headers={"Authorization": f"Bearer {get_access_token_and_superuser[0]}"}
+            )
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/csv')
+        lines = response.text.splitlines()
+        assert lines[0] == 'title,description,status,price,id,user_id,created_at,updated_at'
+        assert lines[2] == '"Test, 2",,done,2.5,2,2,2024-11-02T00:00:00,'
+
+    async def test_export_forbidden_for_user(self, mocker, get_access_token_and_user):
+        stream_orders = self.mock_stream_orders(mocker)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(
+                "/v1/api/orders/export/",
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 403
+        stream_orders.assert_not_called()
+
 
 @pytest.mark.asyncio
 class TestUpdateStatusOrder:
-    async def test_update_status_order_success(self, mocker, get_access_token_and_user):
+    async def test_update_status_order_success(self, mocker, get_access_token_and_user, outbox):
         mock_user = get_access_token_and_user[1]
         order_update_status = OrderUpdateStatus(status=OrderStatus.in_progress)
-        order = Order(id=1, user_id=mock_user.id, title="Test", status=order_update_status.status, price=1.0)
+        order = Order(id=1, user_id=mock_user.id, title="Test", status=OrderStatus.pending, price=1.0)
 
         mocker.patch('auth.oauth2.get_user_by_token', return_value=mock_user)
         mocker.patch('crud.order_crud.OrderCrud.get_order', return_value=order)
-        produce_mock = mocker.patch('services.kafka.producers.produce_orders')
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
             response = await client.put(
                 f"/v1/api/orders/{order.id}/",
@@ -137,10 +323,65 @@ class TestUpdateStatusOrder:
                 headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
             )
         assert response.status_code == 200
-        try:
-            produce_mock.assert_called_once()
-        except AssertionError as e:
-            print("Ошибка при проверке вызова produce_notification:", e)
+        assert len(outbox) == 1
+        event = json.loads(outbox[0])
+        assert event['type'] == 'update'
+        assert event['order_data'] == {"id": order.id, "status": order_update_status.status}
+        assert event['previous_status'] == OrderStatus.pending
+        assert OutboxCrud.add_event.call_args.kwargs['key'] == str(order.id)
+
+    async def test_update_status_order_reads_status_from_primary(self, mocker, get_access_token_and_user, outbox):
+        mock_user = get_access_token_and_user[1]
+        order = Order(id=1, user_id=mock_user.id, title="Test", status=OrderStatus.pending, price=1.0)
+        reads_from_primary = []
+
+        async def get_order(order_id, session):
+            reads_from_primary.append(session.info.get('primary'))
+            return order
+
+        mocker.patch('auth.oauth2.get_user_by_token', return_value=mock_user)
+        mocker.patch('crud.order_crud.OrderCrud.get_order', side_effect=get_order)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.put(
+                f"/v1/api/orders/{order.id}/",
+                json={"status": OrderStatus.in_progress},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 200
+        assert reads_from_primary == [True]
+
+    @pytest.mark.parametrize("current_status, new_status", [
+        (OrderStatus.in_progress, OrderStatus.in_progress),
+        (OrderStatus.done, OrderStatus.pending),
+        (OrderStatus.in_progress, OrderStatus.pending),
+    ])
+    async def test_update_status_order_invalid_transition(
+        self, mocker, get_access_token_and_user, outbox, current_status, new_status
+    ):
+        order = Order(id=1, user_id=get_access_token_and_user[1].id, title="Test", status=current_status, price=1.0)
+        mocker.patch('crud.order_crud.OrderCrud.get_order', return_value=order)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.put(
+                f"/v1/api/orders/{order.id}/",
+                json={"status": new_status},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 409
+        assert response.json() == {
+            "detail": f"Conflict: Order status cannot change from {current_status.value} to {new_status.value}"
+        }
+        assert outbox == []
+
+    async def test_update_status_order_not_found(self, mocker, get_access_token_and_user, outbox):
+        mocker.patch('crud.order_crud.OrderCrud.get_order', return_value=None)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.put(
+                "/v1/api/orders/999/",
+                json={"status": OrderStatus.done},
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"}
+            )
+        assert response.status_code == 404
+        assert outbox == []
 
     @pytest.mark.asyncio
     async def test_update_status_order_user_no_permission(self, mocker, get_access_token_and_user):
@@ -171,4 +412,36 @@ class TestUpdateStatusOrder:
         assert response.status_code == 401
 
 
+@pytest.fixture
+def health_session(mocker):
+    session = AsyncMock()
+    session_context = MagicMock()
+    session_context.__aenter__.return_value = session
+    mocker.patch('main.new_session', return_value=session_context)
+    return session
+
+
+@pytest.mark.asyncio
+class TestHealth:
+    async def test_health_reports_outbox_lag(self, health_session):
+        health_session.scalar.return_value = datetime.utcnow() - timedelta(seconds=30)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["database"] == "connected"
+        assert 30 <= response.json()["outbox_lag_seconds"] < 60
 
+    async def test_health_does_not_depend_on_broker(self, mocker, health_session):
+        health_session.scalar.return_value = None
+        mocker.patch('main.order_producer', InMemoryOrderProducer())
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/health")
+        assert response.status_code == 200
+        assert response.json() == {"database": "connected", "outbox_lag_seconds": 0}
+
+    async def test_health_database_unavailable(self, health_session):
+        health_session.scalar.side_effect = Exception("connection refused")
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/health")
+        assert response.status_code == 503
+        assert response.json() == {"database": "unavailable"}
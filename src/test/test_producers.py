@@ -0,0 +1,236 @@
+import asyncio
+import json
+import shutil
+import msgpack
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from datetime import datetime
+from prometheus_client import REGISTRY
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+from config.settings import KafkaProducerSettings, OutboxSettings
+from crud.outbox_crud import OutboxCrud
+from models.outbox import OutboxEvent
+from schemas.order_event_schema import order_event_adapter
+from services.kafka.codecs import EventCodec, SchemaCodec, decode_event, event_codecs
+from services.kafka.outbox_relay import OutboxRelay
+from services.kafka.schema_registry import DEFAULT_SCHEMA_DIR, FileSchemaRegistry
+from services.kafka.producers import InMemoryOrderProducer, OrderProducer
+
+
+@pytest.fixture
+def kafka_producer_mock(mocker):
+    """Подмена AIOKafkaProducer: send возвращает future подтверждения, которым управляет тест"""
+    producer = MagicMock()
+    producer.start = AsyncMock()
+    producer.stop = AsyncMock()
+    producer.send_and_wait = AsyncMock()
+    producer.deliveries = []
+
+    async def send(topic, value, headers=None, key=None):
+        delivery = asyncio.get_running_loop().create_future()
+        producer.deliveries.append(delivery)
+        return delivery
+
+    producer.send = AsyncMock(side_effect=send)
+    mocker.patch('services.kafka.producers.AIOKafkaProducer', return_value=producer)
+    return producer
+
+
+@pytest.mark.asyncio
+class TestOrderProducer:
+    async def test_send_waits_for_broker(self, kafka_producer_mock):
+        producer = OrderProducer(bootstrap_servers='kafka:9092')
+        await producer.start()
+
+        assert await producer.send('{"type": "create"}') is True
+        kafka_producer_mock.send_and_wait.assert_awaited_once_with(topic='order_topic', value=b'{"type": "create"}')
+        kafka_producer_mock.send.assert_not_called()
+
+    async def test_batch_waits_for_every_delivery(self, kafka_producer_mock):
+        settings = KafkaProducerSettings(linger_ms=5, compression_type='gzip')
+        producer = OrderProducer(bootstrap_servers='kafka:9092', settings=settings)
+        await producer.start()
+
+        sending = asyncio.create_task(producer.send_batch([('order_topic', b'1', [], b'7'), ('order_topic', b'2', [], None)]))
+        await asyncio.sleep(0.01)
+        kafka_producer_mock.deliveries[0].set_result(None)
+        await asyncio.sleep(0.01)
+        assert not sending.done()
+
+        kafka_producer_mock.deliveries[1].set_exception(Exception("Broker unavailable"))
+        assert await asyncio.wait_for(sending, timeout=1) is False
+
+    async def test_connection_gauge_follows_client_state_per_topic(self, kafka_producer_mock):
+        connection = MagicMock()
+        connection.connected.return_value = True
+        kafka_producer_mock.client._conns = {'bootstrap': connection}
+        orders = OrderProducer(bootstrap_servers='kafka:9092', topic='gauge_orders')
+        notifications = OrderProducer(bootstrap_servers='kafka:9092', topic='gauge_notifications')
+        await orders.start()
+        await notifications.start()
+
+        def connected(topic):
+            return REGISTRY.get_sample_value('kafka_producer_connected', {'topic': topic})
+
+        await notifications.stop()
+        assert (connected('gauge_orders'), connected('gauge_notifications')) == (1, 0)
+
+        connection.connected.return_value = False
+        assert orders.is_connected is False
+        assert connected('gauge_orders') == 0
+
+    async def test_send_when_broker_unavailable(self, kafka_producer_mock):
+        kafka_producer_mock.start.side_effect = Exception("Unable to bootstrap")
+        producer = OrderProducer(bootstrap_servers='kafka:9092')
+        await producer.start()
+
+        assert producer.is_connected is False
+        assert await producer.send('{"type": "create"}') is False
+
+
+@pytest.fixture
+def outbox_session(mocker):
+    session = AsyncMock()
+    session_context = MagicMock()
+    session_context.__aenter__.return_value = session
+    mocker.patch('services.kafka.outbox_relay.new_session', return_value=session_context)
+    return session
+
+
+@pytest.mark.asyncio
+class TestOutboxRelay:
+    async def test_relays_batch_and_deletes_events(self, mocker, outbox_session):
+        events = [
+            OutboxEvent(id=1, topic='order_topic', payload='{"type": "create"}', created_at=datetime.utcnow()),
+            OutboxEvent(id=2, topic='order_topic', payload='{"type": "update"}', created_at=datetime.utcnow()),
+        ]
+        lock_events = mocker.patch.object(OutboxCrud, 'lock_events', return_value=events)
+        delete_events = mocker.patch.object(OutboxCrud, 'delete_events')
+        producer = InMemoryOrderProducer()
+        relay = OutboxRelay(producer, OutboxSettings(batch_size=10, relay_workers=2))
+
+        assert await relay.relay_batch() == 2
+        assert producer.messages == [b'{"type": "create"}', b'{"type": "update"}']
+        lock_events.assert_awaited_once_with(outbox_session, 10, 0, 2)
+        delete_events.assert_awaited_once_with(outbox_session, [1, 2])
+        outbox_session.commit.assert_awaited_once()
+
+    async def test_events_kept_when_broker_unavailable(self, mocker, outbox_session):
+        events = [OutboxEvent(id=1, topic='order_topic', payload='{}', created_at=datetime.utcnow())]
+        mocker.patch.object(OutboxCrud, 'lock_events', return_value=events)
+        delete_events = mocker.patch.object(OutboxCrud, 'delete_events')
+        producer = InMemoryOrderProducer()
+        mocker.patch.object(producer, 'send_batch', return_value=False)
+
+        assert await OutboxRelay(producer, OutboxSettings()).relay_batch() == 0
+        delete_events.assert_not_called()
+        outbox_session.rollback.assert_awaited_once()
+        outbox_session.commit.assert_not_called()
+
+    async def test_partition_locked_for_single_worker(self):
+        session = AsyncMock()
+        session.execute.return_value = MagicMock()
+        session.scalar.return_value = True
+        await OutboxCrud.lock_events(session, 100, partition=1, partitions=2)
+        lock = str(session.scalar.call_args.args[0].compile(dialect=postgresql.dialect()))
+        query = str(session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        assert 'pg_try_advisory_xact_lock' in lock
+        assert 'hashtext(coalesce(outbox_events.key' in query
+        assert 'ORDER BY outbox_events.id' in query
+
+    async def test_partition_skipped_when_locked_by_another_worker(self):
+        session = AsyncMock()
+        session.scalar.return_value = False
+        assert await OutboxCrud.lock_events(session, 100, partition=1, partitions=2) == []
+        session.execute.assert_not_called()
+
+    async def test_relay_sends_order_id_as_message_key(self, mocker, outbox_session):
+        events = [OutboxEvent(id=1, topic='order_topic', payload='{}', key='7', created_at=datetime.utcnow())]
+        mocker.patch.object(OutboxCrud, 'lock_events', return_value=events)
+        mocker.patch.object(OutboxCrud, 'delete_events')
+        producer = InMemoryOrderProducer()
+        send_batch = mocker.patch.object(producer, 'send_batch', return_value=True)
+
+        await OutboxRelay(producer, OutboxSettings()).relay_batch()
+
+        assert send_batch.call_args.args[0][0][3] == b'7'
+
+
+CREATE_EVENT = order_event_adapter.validate_python({
+    "type": "create",
+    "user_id": 1,
+    "idempotency_key": "order-1",
+    "order_data": {"title": "Test", "description": None, "status": "pending", "price": 10.0},
+})
+UPDATE_EVENT = order_event_adapter.validate_python({
+    "type": "update", "user_id": 1, "order_data": {"id": 7, "status": "done"}, "previous_status": "pending"
+})
+
+
+def decode(value, headers):
+    return decode_event(value, {key: header.decode() for key, header in headers})
+
+
+class TestEventCodecs:
+    @pytest.mark.parametrize('codec_name', ['json', 'msgpack', 'schema'])
+    @pytest.mark.parametrize('event', [CREATE_EVENT, UPDATE_EVENT])
+    def test_round_trip(self, codec_name, event):
+        value, headers = event_codecs[codec_name].encode(event)
+        assert dict(headers)['event-version'] == b'1'
+        assert decode(value, headers) == event
+
+    def test_schema_codec_omits_field_names(self):
+        value, headers = event_codecs['schema'].encode(CREATE_EVENT)
+        assert dict(headers)['event-schema'] == b'order.create'
+        assert b'order_data' not in value and b'pending' not in value
+        assert len(value) < len(event_codecs['json'].encode(CREATE_EVENT)[0]) / 4
+
+    def test_message_without_headers_read_as_json(self):
+        assert decode_event(UPDATE_EVENT.model_dump_json().encode(), {}) == UPDATE_EVENT
+
+    @pytest.mark.parametrize('codec_name', ['json', 'msgpack', 'schema'])
+    def test_outbox_payload_encoded(self, codec_name):
+        value, headers = event_codecs[codec_name].encode_json(CREATE_EVENT.model_dump_json())
+        assert decode(value, headers) == CREATE_EVENT
+
+    def test_event_types_checked_in_binary_formats(self):
+        _, headers = event_codecs['msgpack'].encode(UPDATE_EVENT)
+        invalid = msgpack.packb({**UPDATE_EVENT.model_dump(), "user_id": "1"}, use_bin_type=True)
+        with pytest.raises(ValidationError):
+            decode(invalid, headers)
+
+    def test_unknown_content_type_rejected(self):
+        with pytest.raises(ValueError):
+            decode_event(b'', {'content-type': 'application/xml'})
+
+    @pytest.mark.parametrize('index', [-1, 3])
+    def test_unknown_enum_index_rejected(self, index):
+        value, headers = event_codecs['schema'].encode(UPDATE_EVENT)
+        user_id, order_data, _ = msgpack.unpackb(value)
+        with pytest.raises(ValueError, match='enum index'):
+            decode(msgpack.packb([user_id, order_data, index]), headers)
+
+    def test_codec_must_implement_encode_and_decode(self):
+        class IncompleteCodec(EventCodec):
+            name = 'incomplete'
+
+            def encode(self, event):
+                return b'', []
+
+        with pytest.raises(TypeError):
+            IncompleteCodec()
+
+    def test_events_of_previous_schema_version_readable(self, tmp_path):
+        shutil.copy(DEFAULT_SCHEMA_DIR / 'order.update.v1.json', tmp_path)
+        schema = json.loads((DEFAULT_SCHEMA_DIR / 'order.update.v1.json').read_text())
+        schema['version'] = 2
+        schema['fields'].append({"name": "comment", "type": "string", "optional": True})
+        (tmp_path / 'order.update.v2.json').write_text(json.dumps(schema))
+        old_value, old_headers = SchemaCodec(FileSchemaRegistry(DEFAULT_SCHEMA_DIR)).encode(UPDATE_EVENT)
+        codec = SchemaCodec(FileSchemaRegistry(tmp_path))
+
+        value, headers = codec.encode(UPDATE_EVENT)
+        assert dict(headers)['event-version'] == b'2'
+        assert codec.decode(value, {key: header.decode() for key, header in headers}) == UPDATE_EVENT
+        assert codec.decode(old_value, {key: header.decode() for key, header in old_headers}) == UPDATE_EVENT
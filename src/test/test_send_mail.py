@@ -1,7 +1,60 @@
+import socket
 import pytest
+from email.message import EmailMessage
 from unittest import mock
+from aiosmtpd.controller import Controller
 from fastapi import HTTPException
+from config.settings import SMTPSettings
 from services.send_mail import EmailService
+from services.smtp_pool import SMTPConnectionPool
+
+
+class RecordingHandler:
+    """Обработчик локального SMTP-сервера: запоминает письма и считает соединения (EHLO - один раз на соединение)"""
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.connections += 1
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content)
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_pool(controller, **settings):
+    """Пул для тестового сервера без авторизации: учетные данные из окружения не используются"""
+    return SMTPConnectionPool(SMTPSettings(
+        smtp_server=controller.hostname, smtp_port=controller.port, smtp_username=None, smtp_password=None, **settings
+    ))
+
+
+def make_message(number):
+    msg = EmailMessage()
+    msg["From"] = "tracker@example.com"
+    msg["To"] = "test@example.com"
+    msg["Subject"] = f"Test {number}"
+    msg.set_content("Test Message")
+    return msg
 
 
 @pytest.mark.asyncio
@@ -25,6 +78,19 @@ class TestSendMail:
                 logger_msg="Notification of order status change for ID=123 sent"
             )
 
+    async def test_notify_order_status_digest_success(self, email_service):
+        with mock.patch.object(email_service, 'send_email', return_value=None) as mock_send_email:
+            notification = await email_service.notify_order_status_digest(
+                "test@example.com", 123, ["pending", "in_progress", "done"], 'update'
+            )
+            mock_send_email.assert_called_once_with(
+                to_email="test@example.com",
+                subject="Обновление статуса заказа ID=123",
+                message="Статус заказа изменился: pending → in_progress → done",
+                logger_msg="Digest of 2 status changes for order ID=123 sent"
+            )
+            assert notification.message == "Статус заказа изменился: pending → in_progress → done"
+
     async def test_notify_order_creation_success(self, email_service):
         with mock.patch.object(email_service, 'send_email', return_value=None) as mock_send_email:
             order_id = 123
@@ -39,7 +105,7 @@ class TestSendMail:
             )
 
     async def test_send_email_failure(self, email_service):
-        with mock.patch("aiosmtplib.send", side_effect=Exception("SMTP Error")) as mock_send:
+        with mock.patch.object(email_service.pool, "send_message", side_effect=Exception("SMTP Error")) as mock_send:
             to_email = "test@example.com"
             subject = "Test Subject"
             message = "Test Message"
@@ -47,3 +113,41 @@ class TestSendMail:
             with pytest.raises(HTTPException):
                 await email_service.send_email(to_email, subject, message, logger_msg)
             mock_send.assert_called_once()
+
+
+@pytest.mark.asyncio
+class TestSMTPConnectionPool:
+    async def test_connection_reused(self, smtp_server):
+        controller, handler = smtp_server
+        pool = make_pool(controller, smtp_pool_size=1)
+        messages = 50
+
+        for number in range(messages):
+            await pool.send_message(make_message(number))
+        await pool.close()
+
+        assert len(handler.messages) == messages
+        assert handler.connections == 1
+
+    async def test_max_messages_per_connection(self, smtp_server):
+        controller, handler = smtp_server
+        pool = make_pool(controller, smtp_pool_size=1, smtp_pool_max_messages=2)
+
+        for number in range(5):
+            await pool.send_message(make_message(number))
+        await pool.close()
+
+        assert len(handler.messages) == 5
+        assert handler.connections == 3
+
+    async def test_reconnect_after_disconnect(self, smtp_server):
+        controller, handler = smtp_server
+        pool = make_pool(controller, smtp_pool_size=1, smtp_pool_health_check_after=60)
+
+        await pool.send_message(make_message(1))
+        pool._idle[0].client.close()
+        await pool.send_message(make_message(2))
+        await pool.close()
+
+        assert len(handler.messages) == 2
+        assert handler.connections == 2
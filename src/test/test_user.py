@@ -1,8 +1,20 @@
+import asyncio
+import threading
 import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy.exc import IntegrityError
 from unittest.mock import AsyncMock, MagicMock
 from starlette.testclient import TestClient
-from auth.hash_password import HashPassword
+from auth.hash_password import HashPassword, PasswordHashExecutor, build_password_context
+from auth.oauth2 import (
+    TOKEN_CLAIMS_VERSION, decode_access_token, get_current_user, get_user_by_claims, hash_refresh_token
+)
+from auth.token_revocations import TokenRevocations, token_revocations
+from auth.user_cache import UserCache, user_cache
+from config.settings import AuthSettings, PasswordHashSettings
+from exceptions import CredentialException, PasswordHashingBusyException
+from crud.refresh_token_crud import RefreshTokenCrud
 from crud.user_crud import UserCrud
 from main import app
 from models.users import User
@@ -20,6 +32,7 @@ def get_access_token_and_superuser(mocker):
     mock_user.id = 1
     mocker.patch('crud.user_crud.UserCrud.get_user', return_value=mock_user)
     mocker.patch('auth.hash_password.HashPassword.verify', return_value=True)
+    mocker.patch('crud.refresh_token_crud.RefreshTokenCrud.create_refresh_token')
     data = {
         "id": mock_user.id,
         "username": mock_user.username,
@@ -42,6 +55,7 @@ def get_access_token_and_user(mocker):
     mock_user.id = 1
     mocker.patch.object(UserCrud, 'get_user', return_value=mock_user)
     mocker.patch.object(HashPassword, 'verify', return_value=True)
+    mocker.patch.object(RefreshTokenCrud, 'create_refresh_token')
     data = {
         "id": mock_user.id,
         "username": mock_user.username,
@@ -67,7 +81,7 @@ class TestUserRegistration:
             email=mock_user_data.email
         )
         mock_user.id = 1
-        mock_user.password = HashPassword.bcrypt(mock_user_data.password)
+        mock_user.password = await HashPassword.hash(mock_user_data.password)
         mocker.patch('crud.user_crud.UserCrud.create_user', return_value=mock_user)
         mocker.patch('config.db.get_session', return_value=AsyncMock())
 
@@ -81,6 +95,25 @@ class TestUserRegistration:
             assert response_data["username"] == mock_user.username
             assert response_data["email"] == mock_user.email
 
+    @pytest.mark.parametrize('index, detail', [
+        ('ix_users_username', "Bad request: Username 'user1' is already registered."),
+        ('ix_users_email', "Bad request: Email 'user1@mail.ru' is already registered."),
+    ])
+    async def test_create_user_unique_violation(self, mocker, index, detail):
+        mocker.patch.object(HashPassword, 'hash', return_value="hashed_password")
+        session = AsyncMock()
+        session.scalar.side_effect = IntegrityError(
+            "INSERT", {}, Exception(f'duplicate key value violates unique constraint "{index}"')
+        )
+        with pytest.raises(HTTPException) as exc_info:
+            await UserCrud.create_user(
+                session, UserCreate(username="user1", email="user1@mail.ru", password="Password123!")
+            )
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.detail == detail
+        session.execute.assert_not_called()
+        session.rollback.assert_awaited_once()
+
 
 @pytest.mark.asyncio
 class TestUserLogin:
@@ -91,6 +124,7 @@ class TestUserLogin:
         )
         mocker.patch.object(UserCrud, 'get_user', return_value=mock_user)
         mocker.patch.object(HashPassword, 'verify', return_value=True)
+        create_refresh_token = mocker.patch.object(RefreshTokenCrud, 'create_refresh_token')
 
         data = {
             "username": "testuser",
@@ -101,6 +135,8 @@ class TestUserLogin:
         assert response.status_code == 200
         assert "access_token" in response.json()
         assert response.json()["token_type"] == "bearer"
+        refresh_token_hash = create_refresh_token.call_args.args[2]
+        assert refresh_token_hash == hash_refresh_token(response.json()["refresh_token"])
 
     async def test_login_user_not_found(self, mocker):
         mock_user = {
@@ -258,6 +294,21 @@ class TestPutUpdateUser:
         assert response_data['id'] == mock_updated_user.id
         assert response_data['username'] == mock_updated_user.username
 
+    async def test_update_own_user_loaded_once(self, mocker, get_access_token_and_user):
+        mock_user = get_access_token_and_user[1]
+        user_cache.clear()
+        get_user = mocker.patch.object(UserCrud, 'get_user', return_value=mock_user)
+        update_user = mocker.patch.object(UserCrud, 'update_user', return_value=mock_user)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.put(
+                f'/v1/api/users/{mock_user.id}/update',
+                headers={"Authorization": f"Bearer {get_access_token_and_user[0]}"},
+                json={"email": "user1@mail.com"}
+            )
+        assert response.status_code == 200
+        get_user.assert_awaited_once()
+        assert update_user.call_args.kwargs['db_user'] is mock_user
+
     async def test_update_user_not_found(self, mocker, get_access_token_and_user):
         mock_user = get_access_token_and_user[1]
         user_update = UserUpdate(
@@ -344,3 +395,219 @@ class TestDeleteUser:
 
 
 
+
+
+@pytest.mark.asyncio
+class TestUserCache:
+    async def test_current_user_served_from_cache(self, mocker, get_access_token_and_user):
+        get_user = mocker.patch.object(UserCrud, 'get_user', return_value=get_access_token_and_user[1])
+        await get_current_user(get_access_token_and_user[0], session=None)
+        cached = await get_current_user(get_access_token_and_user[0], session=None)
+        assert get_user.call_count == 1
+        assert cached is not get_access_token_and_user[1]
+        assert cached.username == "user1" and cached.id == 1 and not cached.is_superuser
+
+    async def test_cache_entry_expires(self, mocker):
+        cache = UserCache(AuthSettings(user_cache_size=10, user_cache_ttl=0.01))
+        cache.set(User(id=1, username="user1"))
+        assert cache.get("user1").id == 1
+        await asyncio.sleep(0.02)
+        assert cache.get("user1") is None
+
+    async def test_least_recently_used_evicted(self):
+        cache = UserCache(AuthSettings(user_cache_size=2, user_cache_ttl=60))
+        cache.set(User(id=1, username="user1"))
+        cache.set(User(id=2, username="user2"))
+        cache.get("user1")
+        cache.set(User(id=3, username="user3"))
+        assert cache.get("user2") is None
+        assert cache.get("user1").id == 1
+        assert cache.get("user3").id == 3
+
+    async def test_stale_read_not_cached_after_invalidation(self):
+        cache = UserCache(AuthSettings(user_cache_size=10, user_cache_ttl=60))
+        generation = cache.generation
+        cache.invalidate("user1")
+        cache.set(User(id=1, username="user1"), generation)
+        assert cache.get("user1") is None
+
+    async def test_update_user_invalidates_cache(self, mocker):
+        db_user = User(id=1, username="user1", email="user1@mail.com", hashed_password="hashed_password")
+        user_cache.set(db_user)
+        user_cache.set(User(id=2, username="user2"))
+        session = AsyncMock()
+        session.scalar.return_value = User(id=1, username="renamed", email="user1@mail.com", token_version=1)
+        await UserCrud.update_user(session, UserUpdate(username="renamed"), db_user=db_user)
+        assert user_cache.get("user1") is None
+        assert user_cache.get("renamed") is None
+        assert user_cache.get("user2").id == 2
+
+    async def test_delete_user_invalidates_cache(self, mocker):
+        db_user = User(id=1, username="user1", is_active=True)
+        user_cache.set(db_user)
+        session = AsyncMock()
+        session.add = MagicMock()
+        await UserCrud.delete_user(session, db_user)
+        assert user_cache.get("user1") is None
+
+
+@pytest.mark.asyncio
+class TestPasswordHashExecutor:
+    async def test_hash_and_verify_off_event_loop(self):
+        hashed_password = await HashPassword.hash("Password123!")
+        assert await HashPassword.verify(hashed_password, "Password123!")
+        assert not await HashPassword.verify(hashed_password, "wrong")
+
+    async def test_rejects_when_queue_is_full(self):
+        executor = PasswordHashExecutor(AuthSettings(password_hash_workers=1, password_hash_queue_size=1))
+        release = threading.Event()
+        running = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHashingBusyException):
+            await executor.run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+        assert await executor.run(lambda: 'done') == 'done'
+        executor.shutdown()
+
+    async def test_login_rejected_with_503_when_busy(self, mocker):
+        mocker.patch.object(UserCrud, 'get_user', return_value=User(id=1, username="user1", hashed_password="hash"))
+        mocker.patch('auth.hash_password.password_hash_executor.run', side_effect=PasswordHashingBusyException())
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/v1/api/users/token", data={"username": "user1", "password": "Password123!"})
+        assert response.status_code == 503
+        assert response.headers['retry-after'] == '1'
+
+
+@pytest.mark.asyncio
+class TestPasswordHashPolicy:
+    cheap_argon2 = PasswordHashSettings(scheme='argon2', argon2_time_cost=1, argon2_memory_cost=1024,
+                                        argon2_parallelism=1, bcrypt_rounds=4)
+
+    async def test_outdated_scheme_and_cost_need_rehash(self):
+        bcrypt_context = build_password_context(PasswordHashSettings(scheme='bcrypt', bcrypt_rounds=4))
+        bcrypt_hash = bcrypt_context.hash("Password123!")
+        argon2_context = build_password_context(self.cheap_argon2)
+        assert argon2_context.verify("Password123!", bcrypt_hash)
+        assert argon2_context.needs_update(bcrypt_hash)
+        argon2_hash = argon2_context.hash("Password123!")
+        assert argon2_hash.startswith("$argon2id$")
+        assert not argon2_context.needs_update(argon2_hash)
+        stronger_context = build_password_context(self.cheap_argon2.model_copy(update={'argon2_time_cost': 2}))
+        assert stronger_context.needs_update(argon2_hash)
+
+    @pytest.mark.parametrize('param, values', [
+        ('bcrypt_rounds', (4, 5, 6)),
+        ('argon2_time_cost', (1, 2, 3)),
+        ('argon2_memory_cost', (1024, 2048, 4096)),
+        ('scrypt_rounds', (4, 5, 6)),
+        ('scrypt_block_size', (4, 8, 16)),
+    ])
+    async def test_only_weaker_hashes_need_rehash(self, param, values):
+        def context(value):
+            return build_password_context(self.cheap_argon2.model_copy(
+                update={'scheme': param.split('_')[0], 'scrypt_rounds': 4, param: value}
+            ))
+
+        weaker, current, stronger = (context(value) for value in values)
+        assert current.needs_update(weaker.hash("Password123!"))
+        assert not current.needs_update(current.hash("Password123!"))
+        assert not current.needs_update(stronger.hash("Password123!"))
+
+    async def test_login_schedules_rehash_of_outdated_hash(self, mocker):
+        context = build_password_context(self.cheap_argon2)
+        mocker.patch('auth.hash_password.password_context', context)
+        bcrypt_hash = build_password_context(PasswordHashSettings(scheme='bcrypt', bcrypt_rounds=4)).hash("Password123!")
+        mocker.patch.object(UserCrud, 'get_user', return_value=User(id=1, username="user1", hashed_password=bcrypt_hash))
+        update_password_hash = mocker.patch.object(UserCrud, 'update_password_hash', return_value=True)
+        mocker.patch.object(RefreshTokenCrud, 'create_refresh_token')
+        mocker.patch('routers.user_routers.new_session', return_value=AsyncMock())
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/v1/api/users/token", data={"username": "user1", "password": "Password123!"})
+        assert response.status_code == 200
+        user_id, previous_hash, new_hash = update_password_hash.call_args.args[1:]
+        assert (user_id, previous_hash) == (1, bcrypt_hash)
+        assert new_hash.startswith("$argon2id$") and context.verify("Password123!", new_hash)
+
+    async def test_login_with_current_hash_does_not_rehash(self, mocker):
+        context = build_password_context(self.cheap_argon2)
+        mocker.patch('auth.hash_password.password_context', context)
+        mocker.patch.object(UserCrud, 'get_user', return_value=User(
+            id=1, username="user1", hashed_password=context.hash("Password123!")
+        ))
+        rehash_password = mocker.patch('routers.user_routers.rehash_password')
+        mocker.patch.object(RefreshTokenCrud, 'create_refresh_token')
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/v1/api/users/token", data={"username": "user1", "password": "Password123!"})
+        assert response.status_code == 200
+        rehash_password.assert_not_called()
+
+
+@pytest.mark.asyncio
+class TestTokenClaims:
+    async def test_login_token_carries_claims(self, get_access_token_and_superuser):
+        payload = decode_access_token(get_access_token_and_superuser[0])
+        assert payload['uid'] == 1 and payload['su'] is True and payload['tv'] == 0
+        assert payload['cv'] == TOKEN_CLAIMS_VERSION
+
+    async def test_stale_revocation_table_falls_back_to_db(self, mocker, get_access_token_and_user):
+        get_user = mocker.patch.object(UserCrud, 'get_user', return_value=get_access_token_and_user[1])
+        current_user = await get_user_by_claims(get_access_token_and_user[0], session=None)
+        assert get_user.call_count == 1
+        assert current_user is get_access_token_and_user[1]
+
+    async def test_token_of_older_version_rejected_by_db_path(self, mocker, get_access_token_and_user):
+        mock_user = get_access_token_and_user[1]
+        mock_user.token_version = 1
+        mocker.patch.object(UserCrud, 'get_user', return_value=mock_user)
+        with pytest.raises(CredentialException):
+            await get_current_user(get_access_token_and_user[0], session=None)
+
+    async def test_deleted_user_tokens_revoked(self):
+        revocations = TokenRevocations(AuthSettings(token_revocation_refresh_interval=30))
+        revocations.load({1: 2}, [3])
+        assert revocations.is_fresh
+        assert revocations.is_revoked(1, 1) and not revocations.is_revoked(1, 2)
+        assert revocations.is_revoked(3, 0) and not revocations.is_revoked(4, 0)
+
+    async def test_password_change_revokes_tokens(self, mocker):
+        db_user = User(id=1, username="user1", hashed_password="hashed_password", token_version=0)
+        mocker.patch.object(HashPassword, 'hash', return_value="new_hash")
+        session = AsyncMock()
+        session.scalar.return_value = User(id=1, username="user1", hashed_password="new_hash", token_version=1)
+        updated_user = await UserCrud.update_user(session, UserUpdate(password="Password123!"), db_user=db_user)
+        assert updated_user.token_version == 1
+        assert "token_version" in str(session.scalar.call_args.args[0])
+        session.refresh.assert_not_called()
+        assert token_revocations.is_revoked(1, 0)
+
+
+@pytest.mark.asyncio
+class TestRefreshToken:
+    async def test_refresh_rotates_token(self, mocker):
+        rotate_refresh_token = mocker.patch.object(RefreshTokenCrud, 'rotate_refresh_token', return_value=1)
+        mocker.patch.object(UserCrud, 'get_user', return_value=User(id=1, username="user1", is_superuser=False))
+        verify = mocker.patch.object(HashPassword, 'verify')
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/v1/api/users/token/refresh", json={"refresh_token": "old_token"})
+        assert response.status_code == 200
+        verify.assert_not_called()
+        token_hash, new_token_hash = rotate_refresh_token.call_args.args[1:3]
+        assert token_hash == hash_refresh_token("old_token")
+        assert new_token_hash == hash_refresh_token(response.json()["refresh_token"])
+        assert decode_access_token(response.json()["access_token"])['uid'] == 1
+
+    async def test_refresh_with_used_token_rejected(self, mocker):
+        mocker.patch.object(RefreshTokenCrud, 'rotate_refresh_token', return_value=None)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/v1/api/users/token/refresh", json={"refresh_token": "used_token"})
+        assert response.status_code == 401
+
+    async def test_password_change_revokes_refresh_tokens(self, mocker):
+        db_user = User(id=1, username="user1", token_version=0)
+        mocker.patch.object(HashPassword, 'hash', return_value="new_hash")
+        revoke_user_tokens = mocker.patch.object(RefreshTokenCrud, 'revoke_user_tokens')
+        session = AsyncMock()
+        session.scalar.return_value = User(id=1, username="user1", token_version=1)
+        await UserCrud.update_user(session, UserUpdate(password="Password123!"), db_user=db_user)
+        revoke_user_tokens.assert_called_once_with(session, 1)